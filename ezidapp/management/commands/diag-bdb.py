@@ -54,6 +54,10 @@ connect to the EZID database.
 
   This command intended for generating a sequence expected from a given minter in order
   to determine when and where identifiers found 'in the wild' would have been minted.
+
+  Large slices are minted with the vectorized minter if NumPy is installed.
+
+  E.g.: ./manage.py bdb slice ark:/99999/fk4 --start 1000000 --count 10
 """
 from __future__ import absolute_import, division, print_function
 
@@ -285,14 +289,11 @@ class Command(django.core.management.BaseCommand):
             bdb_path = nog.minter.create_minter_database(
                 self.opt.ns_str, dir_path.as_posix()
             )
-            for i, id_str in enumerate(
-                nog.minter.mint_by_bdb_path(
-                    bdb_path, self.opt.count, dry_run=True,
-                )
-            ):
-                # noinspection PyArgumentList
-                # log.info("{}".format(case_fn(self.opt.ns_str + id_str)))
-                print(case_fn(self.opt.ns_str + id_str))
+            with nog.minter.Minter(bdb_path, dry_run=True) as minter:
+                minter.skip(self.opt.start)
+                for id_str in minter.mint_list(self.opt.count):
+                    # noinspection PyArgumentList
+                    print(case_fn(self.opt.ns_str + id_str))
         finally:
             shutil.rmtree(dir_path.as_posix())
 
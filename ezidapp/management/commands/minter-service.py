@@ -0,0 +1,91 @@
+"""Run the minter service
+
+The minter service owns the minters of all shoulders and mints on behalf of the EZID
+processes on this host. It listens on the Unix socket set in 'minter_service_socket' in
+the [shoulders] section of the EZID configuration. EZID uses the service when
+'minter_service_enabled' is true.
+
+The service runs in the foreground until it is terminated with SIGINT or SIGTERM. The
+minters are then checkpointed and closed.
+
+E.g.: ./manage.py minter-service
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import logging
+import os.path
+import signal
+import threading
+
+import django.conf
+import django.core.management
+
+# The following must precede any EZID module imports:
+execfile(
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))),
+        "tools",
+        "offline.py",
+    )
+)
+
+import config
+import impl.nog.util
+import nog.exc
+import nog.minter_service
+
+log = logging.getLogger(__name__)
+
+
+class Command(django.core.management.BaseCommand):
+    help = __doc__
+
+    def __init__(self):
+        super(Command, self).__init__()
+        self.opt = None
+
+    def add_arguments(self, parser):
+        parser.formatter_class = argparse.RawDescriptionHelpFormatter
+        parser.add_argument(
+            "--socket",
+            dest="socket_path",
+            metavar="path",
+            help="Override the socket path set in the EZID configuration",
+        )
+        parser.add_argument(
+            "--root",
+            dest="root_path",
+            metavar="path",
+            help="Override default root path for BerkeleyDB minters",
+        )
+        parser.add_argument(
+            "--debug", action="store_true", help="Debug level logging",
+        )
+
+    def handle(self, *_, **opt):
+        self.opt = opt = argparse.Namespace(**opt)
+        impl.nog.util.log_to_console(__name__, opt.debug)
+
+        service = nog.minter_service.MinterService(
+            opt.socket_path or config.get("shoulders.minter_service_socket"),
+            opt.root_path or django.conf.settings.MINTERS_PATH,
+            int(config.get("shoulders.minter_checkpoint_interval")),
+            int(config.get("shoulders.minter_checkpoint_max_age")),
+        )
+
+        def handle_signal(*_):
+            log.info('Shutting down minter service')
+            # shutdown() blocks until serve_forever() returns, so it must not run in
+            # the thread that is serving.
+            threading.Thread(target=service.shutdown).start()
+
+        signal.signal(signal.SIGINT, handle_signal)
+        signal.signal(signal.SIGTERM, handle_signal)
+
+        try:
+            service.serve_forever()
+        except nog.exc.MinterError as e:
+            raise django.core.management.CommandError(
+                'Minter error: {}'.format(str(e))
+            )
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0026_auto_20200728_2041'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MintReservoir',
+            fields=[
+                ('seq', models.AutoField(serialize=False, primary_key=True)),
+                ('prefix', models.CharField(max_length=255)),
+                ('mintedId', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='mintreservoir', unique_together=set([('prefix', 'mintedId')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='mintreservoir', index_together=set([('prefix', 'seq')]),
+        ),
+    ]
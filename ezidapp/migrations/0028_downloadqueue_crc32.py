@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0027_mintreservoir'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='crc32',
+            field=models.BigIntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='uncompressedSize',
+            field=models.BigIntegerField(null=True, blank=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0028_downloadqueue_crc32'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='claimant',
+            field=models.CharField(default='', max_length=255, blank=True),
+        ),
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='claimTime',
+            field=models.IntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='estimatedSize',
+            field=models.BigIntegerField(null=True, blank=True),
+        ),
+    ]
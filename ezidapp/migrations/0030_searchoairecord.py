@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0029_downloadqueue_claim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchOaiRecord',
+            fields=[
+                (
+                    'identifier',
+                    models.CharField(max_length=255, serialize=False, primary_key=True),
+                ),
+                ('updateTime', models.IntegerField()),
+                ('oaiDc', models.TextField()),
+                ('datacite', models.TextField()),
+            ],
+        ),
+    ]
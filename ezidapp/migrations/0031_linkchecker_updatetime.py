@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0030_searchoairecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='linkchecker',
+            name='updateTime',
+            field=models.IntegerField(default=0, db_index=True),
+        ),
+    ]
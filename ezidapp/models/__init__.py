@@ -8,6 +8,7 @@ from download_queue import DownloadQueue
 from group import Group
 from identifier import Identifier
 from link_checker import LinkChecker
+from mint_reservoir import MintReservoir
 from new_account_worksheet import NewAccountWorksheet
 from profile import Profile
 from realm import Realm
@@ -15,6 +16,7 @@ from registration_queue import RegistrationQueue
 from search_datacenter import SearchDatacenter
 from search_group import SearchGroup
 from search_identifier import SearchIdentifier
+from search_oai_record import SearchOaiRecord
 from search_profile import SearchProfile
 from search_realm import SearchRealm
 from search_user import SearchUser
@@ -42,6 +44,9 @@ getCrossrefTestShoulder = shoulder.getCrossrefTestShoulder
 getAgentShoulder = shoulder.getAgentShoulder
 getDatacenterBySymbol = shoulder.getDatacenterBySymbol
 getDatacenterById = shoulder.getDatacenterById
+getMinterPath = shoulder.getMinterPath
+clearMinterPathCache = shoulder.clearMinterPathCache
+getMinterPathCacheStatistics = shoulder.getMinterPathCacheStatistics
 getGroupByPid = store_group.getByPid
 getGroupByGroupname = store_group.getByGroupname
 getGroupById = store_group.getById
@@ -15,12 +15,15 @@
 
 import ast
 import json
+import struct
 import zlib
 
 import django.core.exceptions
 import django.core.serializers
 import django.db.models
+import django.db.models.query_utils
 
+import cm_codec
 import shoulder
 import store_group
 import store_profile
@@ -28,13 +31,69 @@ import store_user
 import util
 
 
+class _EncodedJsonValue(object):
+    # A CompressedJsonField database value that has not been decoded
+    # yet.
+
+    def __init__(self, blob):
+        self.blob = blob
+
+
+class _LazyJsonAttribute(django.db.models.query_utils.DeferredAttribute):
+    # The model attribute of a CompressedJsonField.  Decodes the
+    # database value on first access and caches the decoded value in
+    # the model instance.
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super(_LazyJsonAttribute, self).__get__(instance, cls)
+        if isinstance(value, _EncodedJsonValue):
+            value = _decodeJson(value.blob)
+            instance.__dict__[self.field_name] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field_name] = value
+
+
+def _decodeJson(blob):
+    try:
+        return json.loads(cm_codec.decompress(blob))
+    except Exception, e:
+        raise django.core.exceptions.ValidationError(
+            "Exception encountered unpacking compressed JSON database value: "
+            + util.formatException(e)
+        )
+
+
 class CompressedJsonField(django.db.models.BinaryField):
-    # Stores an arbitrary (well, pickle-able) Python object as a gzipped
-    # JSON string.
+    # Stores an arbitrary (well, pickle-able) Python object as a
+    # compressed JSON string; see cm_codec.
+    #
+    # Decoding is deferred until the field is first accessed on a model
+    # instance, so that loading rows whose field is never looked at
+    # (e.g., in search results) costs no decompression or JSON parsing.
+    # A value that is never accessed is saved back as is.  Note that
+    # values() and values_list() querysets return undecoded values.
+
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super(CompressedJsonField, self).contribute_to_class(cls, name, *args, **kwargs)
+        setattr(cls, self.attname, _LazyJsonAttribute(self.attname, cls))
+
+    def pre_save(self, model_instance, add):
+        value = model_instance.__dict__.get(self.attname)
+        if isinstance(value, _EncodedJsonValue):
+            return value
+        return super(CompressedJsonField, self).pre_save(model_instance, add)
 
     def get_db_prep_save(self, value, *args, **kwargs):
         if value is None:
             return None
+        if isinstance(value, _EncodedJsonValue):
+            return super(CompressedJsonField, self).get_db_prep_save(
+                value.blob, *args, **kwargs
+            )
         # When the DB is populated via a JSON fixture, using the loaddata management
         # command, the values arrive here as strings wrapped in native C buffer objects
         # instead of the expected Python container type. This only occurs when invoking
@@ -45,7 +104,7 @@ class CompressedJsonField(django.db.models.BinaryField):
         try:
             json_str = json.dumps(value, separators=(",", ":"))
             return super(CompressedJsonField, self).get_db_prep_save(
-                zlib.compress(json_str), *args, **kwargs
+                cm_codec.compress(json_str), *args, **kwargs
             )
         except Exception, e:
             raise django.core.exceptions.ValidationError(
@@ -57,13 +116,7 @@ class CompressedJsonField(django.db.models.BinaryField):
         if value is None:
             return None
         else:
-            try:
-                return json.loads(zlib.decompress(value))
-            except Exception, e:
-                raise django.core.exceptions.ValidationError(
-                    "Exception encountered unpacking compressed JSON database value: "
-                    + util.formatException(e)
-                )
+            return _EncodedJsonValue(value)
 
 
 class NonValidatingForeignKey(django.db.models.ForeignKey):
@@ -74,13 +127,15 @@ class NonValidatingForeignKey(django.db.models.ForeignKey):
 
 
 class StoreIdentifierObjectField(django.db.models.BinaryField):
-    # Stores a StoreIdentifier object as a gzipped
-    # Django/JSON-serialized string (hereinafter "blob").  The object
-    # may have a primary key (i.e., represent an existing row in the
-    # StoreIdentifier table) or not.  In setting the field, the supplied
-    # value may be a StoreIdentifier object or a previously-created
-    # blob.  In getting the field, the returned value is a tuple
-    # (StoreIdentifier, blob).
+    # Stores a StoreIdentifier object as a compact binary string
+    # (hereinafter "blob").  The object may have a primary key (i.e.,
+    # represent an existing row in the StoreIdentifier table) or not.
+    # In setting the field, the supplied value may be a StoreIdentifier
+    # object or a previously-created blob.  In getting the field, the
+    # returned value is a tuple (StoreIdentifier, blob).
+    #
+    # Blobs were formerly gzipped Django/JSON-serialized strings.  Such
+    # blobs are still read, but are no longer written.
 
     def get_db_prep_save(self, value, *args, **kwargs):
         if value is None:
@@ -90,9 +145,7 @@ class StoreIdentifierObjectField(django.db.models.BinaryField):
                 if type(value) in [str, buffer]:
                     v = value
                 else:
-                    v = zlib.compress(
-                        django.core.serializers.serialize("json", [value])
-                    )
+                    v = _encodeStoreIdentifier(value)
                 return super(StoreIdentifierObjectField, self).get_db_prep_save(
                     v, *args, **kwargs
                 )
@@ -107,18 +160,10 @@ class StoreIdentifierObjectField(django.db.models.BinaryField):
             return None
         else:
             try:
-                si = (
-                    django.core.serializers.deserialize("json", zlib.decompress(value))
-                    .next()
-                    .object
-                )
-                # The citation metadata, being a dictionary and not a type the
-                # Django serializer understands, appears to get serialized as
-                # though by calling repr() and then base64-ing that.  Thus we
-                # must eval() it to return it to its dictionary form.
-                # (There's a way to inform the serializer of new types, but
-                # that's not supported until Django 1.11.)
-                si.cm = ast.literal_eval(str(si.cm))
+                if value[:1] == _STORE_IDENTIFIER_FORMAT_1:
+                    si = _decodeStoreIdentifier(value)
+                else:
+                    si = _decodeLegacyStoreIdentifier(value)
                 # Replace subservient objects referenced by foreign keys with
                 # pointers to cached copies to avoid database lookups.
                 if si.owner_id != None:
@@ -134,3 +179,103 @@ class StoreIdentifierObjectField(django.db.models.BinaryField):
                     "Exception encountered unpacking StoreIdentifier database value: "
                     + util.formatException(e)
                 )
+
+
+# Version 1 of the StoreIdentifier blob format consists of the
+# version byte; a fixed-size header holding the integer and boolean
+# fields and the lengths of the UTF-8 encoded string fields; the
+# string fields; and the citation metadata, compressed as by
+# CompressedJsonField.  A null foreign key is stored as -1.  Any change
+# to the fields of StoreIdentifier requires a new version.  The
+# version byte can't be confused with the first byte of a legacy
+# (zlib) blob.
+
+_STORE_IDENTIFIER_FORMAT_1 = "\x01"
+
+_storeIdentifierIntFields = [
+    "id",
+    "createTime",
+    "updateTime",
+    "owner_id",
+    "ownergroup_id",
+    "datacenter_id",
+    "profile_id",
+]
+_storeIdentifierBoolFields = ["exported", "isTest"]
+_storeIdentifierStringFields = [
+    "identifier",
+    "status",
+    "unavailableReason",
+    "crossrefStatus",
+    "crossrefMessage",
+    "target",
+    "agentRole",
+]
+_storeIdentifierHeader = struct.Struct(
+    "<%dq%d?%dI"
+    % (
+        len(_storeIdentifierIntFields),
+        len(_storeIdentifierBoolFields),
+        len(_storeIdentifierStringFields),
+    )
+)
+
+
+def _encodeStoreIdentifier(si):
+    ints = [getattr(si, f) for f in _storeIdentifierIntFields]
+    ints = [v if v is not None else -1 for v in ints]
+    bools = [getattr(si, f) for f in _storeIdentifierBoolFields]
+    strings = [getattr(si, f) for f in _storeIdentifierStringFields]
+    strings = [s.encode("utf-8") if isinstance(s, unicode) else s for s in strings]
+    # Citation metadata that has not been decoded is copied as is.
+    cm = si.__dict__.get("cm")
+    if isinstance(cm, _EncodedJsonValue):
+        cmBlob = str(cm.blob)
+    else:
+        cmBlob = cm_codec.compress(json.dumps(si.cm, separators=(",", ":")))
+    return "".join(
+        [
+            _STORE_IDENTIFIER_FORMAT_1,
+            _storeIdentifierHeader.pack(*(ints + bools + [len(s) for s in strings])),
+        ]
+        + strings
+        + [cmBlob]
+    )
+
+
+def _decodeStoreIdentifier(blob):
+    import store_identifier
+
+    blob = str(blob)
+    values = _storeIdentifierHeader.unpack_from(blob, 1)
+    numInts = len(_storeIdentifierIntFields)
+    numBools = len(_storeIdentifierBoolFields)
+    kwargs = {}
+    for f, v in zip(_storeIdentifierIntFields, values[:numInts]):
+        kwargs[f] = v if v != -1 else None
+    for f, v in zip(_storeIdentifierBoolFields, values[numInts : numInts + numBools]):
+        kwargs[f] = v
+    i = 1 + _storeIdentifierHeader.size
+    for f, l in zip(_storeIdentifierStringFields, values[numInts + numBools :]):
+        kwargs[f] = blob[i : i + l].decode("utf-8")
+        i += l
+    # The citation metadata is decoded on first access, as by
+    # CompressedJsonField.
+    kwargs["cm"] = _EncodedJsonValue(blob[i:])
+    return store_identifier.StoreIdentifier(**kwargs)
+
+
+def _decodeLegacyStoreIdentifier(blob):
+    si = (
+        django.core.serializers.deserialize("json", zlib.decompress(blob))
+        .next()
+        .object
+    )
+    # The citation metadata, being a dictionary and not a type the
+    # Django serializer understands, appears to get serialized as
+    # though by calling repr() and then base64-ing that.  Thus we
+    # must eval() it to return it to its dictionary form.
+    # (There's a way to inform the serializer of new types, but
+    # that's not supported until Django 1.11.)
+    si.cm = ast.literal_eval(str(si.cm))
+    return si
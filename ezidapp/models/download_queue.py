@@ -19,9 +19,9 @@ import util
 
 
 class DownloadQueue(django.db.models.Model):
-    # Holds batch download requests.  Since the download processor is
-    # single-threaded, if there are multiple entries, only the first
-    # entry is "in progress."
+    # Holds batch download requests.  Requests are processed by a pool
+    # of download worker threads; a request is "in progress" if it is
+    # claimed by a worker.
 
     seq = django.db.models.AutoField(primary_key=True)
     # Order of insertion into this table; also, the order in which
@@ -109,5 +109,28 @@ class DownloadQueue(django.db.models.Model):
     # The last identifier processed.  HARVEST stage only.
 
     fileSize = django.db.models.BigIntegerField(blank=True, null=True)
-    # The size of the file in bytes after the last flush.  HARVEST stage
-    # only.
+    # The size of the (compressed) file in bytes after the last flush.
+    # HARVEST stage only.
+
+    crc32 = django.db.models.BigIntegerField(blank=True, null=True)
+    # The CRC-32 checksum of the uncompressed data written as of the
+    # last flush.  HARVEST stage only.
+
+    uncompressedSize = django.db.models.BigIntegerField(blank=True, null=True)
+    # The size in bytes of the uncompressed data written as of the last
+    # flush.  HARVEST stage only.
+
+    claimant = django.db.models.CharField(max_length=255, blank=True, default="")
+    # The name of the download worker thread processing the request, or
+    # empty if the request is not claimed.  Claims made by threads of a
+    # previous daemon generation are stale.
+
+    claimTime = django.db.models.IntegerField(blank=True, null=True)
+    # The time the request was last claimed or its claim renewed, as a
+    # Unix timestamp.  Claims made by other server processes expire if
+    # not renewed in time.
+
+    estimatedSize = django.db.models.BigIntegerField(blank=True, null=True)
+    # The number of identifiers the download is expected to contain,
+    # computed when the request is first considered for processing.
+    # Used for scheduling.
@@ -267,13 +267,15 @@ class Identifier(django.db.models.Model):
     # All of the identifier's citation metadata as a dictionary of
     # name/value pairs, e.g., { "erc.who": "Proust, Marcel", ... }.
 
-    def kernelMetadata(self):
+    def kernelMetadata(self, parsedXml=None):
         # Returns citation metadata as a mapping.KernelMetadata object.
         # The mapping is based on the identifier's preferred metadata
-        # profile.  Missing attributes will be None.
+        # profile.  Missing attributes will be None.  'parsedXml', if
+        # not None, is a dictionary in which parsed XML metadata fields
+        # are cached; see mapping.map.
         import mapping
 
-        return mapping.map(self.cm, profile=self.profile.label)
+        return mapping.map(self.cm, profile=self.profile.label, parsedXml=parsedXml)
 
     def dataciteMetadata(self):
         # Returns citation metadata as a DataCite XML record.  (The record
@@ -102,13 +102,32 @@ class LinkChecker(django.db.models.Model):
     # If the last check was successful, the MD5 hash of the returned
     # resource; otherwise empty.
 
+    updateTime = django.db.models.IntegerField(default=0, db_index=True)
+    # The time this row was last saved as a Unix timestamp, set
+    # automatically.  Used by linkcheck_update.py to find rows whose
+    # results may have changed since its last run.
+
     class Meta:
         index_together = [("owner_id", "isBad", "lastCheckTime")]
 
     def clean(self):
         self.isBad = self.numFailures > 0
 
+    def save(self, *args, **kwargs):
+        self.updateTime = int(time.time())
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = list(kwargs["update_fields"]) + ["updateTime"]
+        super(LinkChecker, self).save(*args, **kwargs)
+
     def checkSucceeded(self, mimeType, content):
+        self.checkSucceededStreamed(
+            mimeType, len(content), hashlib.md5(content).hexdigest()
+        )
+
+    def checkSucceededStreamed(self, mimeType, size, hash):
+        # As checkSucceeded, but for a resource that was hashed as it was
+        # read: 'size' is the number of bytes read, and 'hash' the MD5
+        # hash of those bytes.
         self.lastCheckTime = int(time.time())
         self.numFailures = 0
         self.returnCode = 200
@@ -118,8 +137,8 @@ class LinkChecker(django.db.models.Model):
         self.mimeType = re.sub("[^ -~]", "?", mimeType)[
             : self._meta.get_field("mimeType").max_length
         ]
-        self.size = len(content)
-        self.hash = hashlib.md5(content).hexdigest()
+        self.size = size
+        self.hash = hash
 
     def checkFailed(self, code, error=None):
         self.lastCheckTime = int(time.time())
@@ -0,0 +1,43 @@
+# =============================================================================
+#
+# EZID :: ezidapp/models/mint_reservoir.py
+#
+# Database model for identifiers minted ahead of time.
+#
+# License:
+#   Copyright (c) 2020, Regents of the University of California
+#   http://creativecommons.org/licenses/BSD/
+#
+# -----------------------------------------------------------------------------
+
+import django.db.models
+
+import util
+
+
+class MintReservoir(django.db.models.Model):
+    # Describes identifiers that have been minted ahead of time on a
+    # shoulder and that are waiting to be handed out by
+    # ezid.mintIdentifier.  The minter state is advanced before rows are
+    # inserted into this table, and an identifier is handed out only
+    # after its row has been deleted, so an identifier that has a row
+    # here has never been handed out.
+
+    seq = django.db.models.AutoField(primary_key=True)
+    # Order of insertion into this table, and the order in which
+    # identifiers are handed out.
+
+    prefix = django.db.models.CharField(max_length=util.maxIdentifierLength)
+    # The shoulder the identifier was minted on, qualified and
+    # normalized, e.g., "ark:/99999/fk4".
+
+    mintedId = django.db.models.CharField(max_length=util.maxIdentifierLength)
+    # The identifier as returned by the minter, i.e., without the
+    # shoulder, e.g., "2t0f5k".
+
+    class Meta:
+        unique_together = ("prefix", "mintedId")
+        index_together = [("prefix", "seq")]
+
+    def __unicode__(self):
+        return "%s%s" % (self.prefix, self.mintedId)
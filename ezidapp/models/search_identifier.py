@@ -14,6 +14,7 @@
 # -----------------------------------------------------------------------------
 
 import django.db.models
+import django.db.transaction
 import django.db.utils
 
 import custom_fields
@@ -182,6 +183,8 @@ class SearchIdentifier(identifier.Identifier):
         return reasons
 
     def computeHasIssues(self):
+        # N.B.: linkcheck_update._applyChanges sets hasIssues in bulk and
+        # must be kept in agreement with this method.
         self.hasIssues = not self.hasMetadata or self.linkIsBroken or self.isCrossrefBad
 
     def computeComputedValues(self):
@@ -194,7 +197,10 @@ class SearchIdentifier(identifier.Identifier):
         self.resourcePublisher = ""
         self.resourcePublicationDate = ""
         self.resourceType = ""
-        km = self.kernelMetadata()
+        # XML metadata parsed by the mapping is reused in computing the
+        # keywords below.
+        parsedXml = {}
+        km = self.kernelMetadata(parsedXml)
         if km.creator != None:
             self.resourceCreator = km.creator
         if km.title != None:
@@ -223,7 +229,10 @@ class SearchIdentifier(identifier.Identifier):
         for k, v in self.cm.items():
             if k in ["datacite", "crossref"]:
                 try:
-                    kw.append(util.extractXmlContent(v))
+                    if k in parsedXml and v == v.strip():
+                        kw.append(util.extractXmlContent(parsedXml[k]))
+                    else:
+                        kw.append(util.extractXmlContent(v))
                 except:
                     kw.append(v)
             else:
@@ -399,6 +408,18 @@ def _getProfile(label):
     return p
 
 
+def _carryOverLinkIsBroken(i, linkIsBroken):
+    # linkIsBroken is maintained by the link checker update daemon, not
+    # derived from an identifier's metadata, so an identifier being
+    # updated retains its previous value.  (The daemon propagates only
+    # link checker results that have changed since its last run, and so
+    # would not otherwise restore the value until its next full
+    # reconciliation.)
+    if linkIsBroken:
+        i.linkIsBroken = True
+        i.computeHasIssues()
+
+
 def updateFromLegacy(identifier, metadata, forceInsert=False, forceUpdate=False):
     # Inserts or updates an identifier in the search database.  The
     # identifier is constructed from a legacy representation.
@@ -409,13 +430,43 @@ def updateFromLegacy(identifier, metadata, forceInsert=False, forceUpdate=False)
     # place identifiers get inserted and updated in the search database,
     # we're not concerned with race conditions.
     if not forceInsert:
-        j = SearchIdentifier.objects.filter(identifier=identifier).only("id")
+        j = SearchIdentifier.objects.filter(identifier=identifier).only(
+            "id", "linkIsBroken"
+        )
         if len(j) > 0:
             i.id = j[0].id
-    # Ideally we would like to specify that all fields be updated
-    # *except* linkIsBroken, but Django does not provide a way to do
-    # this.  As a consequence, linkIsBroken's default value will
-    # override the previous value in the table.  The next time the link
-    # checker update daemon runs it will correct the value, which is
-    # some consolation.
+            _carryOverLinkIsBroken(i, j[0].linkIsBroken)
     i.save(force_insert=forceInsert, force_update=forceUpdate)
+    return i
+
+
+def updateFromLegacyBatch(items):
+    # Inserts or updates a batch of identifiers in the search database,
+    # as updateFromLegacy does for single identifiers.  'items' is a list
+    # of (identifier, metadata) pairs, in which each identifier appears
+    # at most once.  Existing identifiers are looked up in a single
+    # query; new identifiers are inserted with a single bulk insert, and
+    # existing identifiers are updated, all in one transaction.  Returns
+    # the list of SearchIdentifiers.
+    l = []
+    for identifier, metadata in items:
+        i = SearchIdentifier(identifier=identifier)
+        i.fromLegacy(metadata)
+        i.my_full_clean()
+        l.append(i)
+    ids = dict(
+        (identifier, (id, linkIsBroken))
+        for identifier, id, linkIsBroken in SearchIdentifier.objects.filter(
+            identifier__in=[i.identifier for i in l]
+        ).values_list("identifier", "id", "linkIsBroken")
+    )
+    with django.db.transaction.atomic(using="search"):
+        for i in l:
+            if i.identifier in ids:
+                i.id, linkIsBroken = ids[i.identifier]
+                _carryOverLinkIsBroken(i, linkIsBroken)
+                i.save(force_update=True)
+        SearchIdentifier.objects.bulk_create(
+            [i for i in l if i.identifier not in ids]
+        )
+    return l
@@ -0,0 +1,42 @@
+# =============================================================================
+#
+# EZID :: ezidapp/models/search_oai_record.py
+#
+# Database model for pre-rendered OAI-PMH metadata records.
+#
+# License:
+#   Copyright (c) 2020, Regents of the University of California
+#   http://creativecommons.org/licenses/BSD/
+#
+# -----------------------------------------------------------------------------
+
+import django.db.models
+
+import util
+
+
+class SearchOaiRecord(django.db.models.Model):
+    # Caches the OAI-PMH metadata records of an OAI-visible identifier,
+    # as rendered by the background processing daemon when the
+    # identifier was last added to or updated in the search database.
+    # A record is current only if its update time matches the
+    # identifier's; otherwise the OAI-PMH interface renders the
+    # identifier's records on the fly.
+
+    identifier = django.db.models.CharField(
+        max_length=util.maxIdentifierLength, primary_key=True
+    )
+    # The identifier in qualified, normalized form, e.g.,
+    # "ark:/12345/abc" or "doi:10.1234/ABC".
+
+    updateTime = django.db.models.IntegerField()
+    # The identifier's update time at the time the records were
+    # rendered.
+
+    oaiDc = django.db.models.TextField()
+    datacite = django.db.models.TextField()
+    # The identifier's oai_dc and datacite metadata records, as
+    # unencoded Unicode strings without XML declarations.
+
+    def __unicode__(self):
+        return self.identifier
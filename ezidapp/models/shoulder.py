@@ -33,6 +33,7 @@ import validation
 """
 import config
 import log
+import nog.bdb
 import util2
 """
 
@@ -45,8 +46,20 @@ _doiTestPrefix = None
 _crossrefTestPrefix = None
 _agentPrefix = None
 _shoulders = None
+_shoulderTrie = None
 _datacenters = None  # (symbolLookup, idLookup)
 
+# Cache of minter BerkeleyDB paths, keyed by shoulder prefix.  Values
+# are (minter URI, path) pairs; the URI is checked on lookup so that a
+# changed minter field is never served a stale path.  The generation
+# is advanced on every clear, so that a path computed concurrently
+# with a clear is not stored.
+_minterPathLock = threading.Lock()
+_minterPaths = {}
+_minterPathGeneration = 0
+_minterPathHits = 0
+_minterPathMisses = 0
+
 
 logger = logging.getLogger(__name__)
 
@@ -174,9 +187,38 @@ class Shoulder(django.db.models.Model):
         return "%s (%s)" % (self.name, self.prefix)
 
 
+class PrefixTrie(object):
+    # Maps string prefixes to values.  Supports finding the value of the
+    # longest prefix of a given string in time proportional to the
+    # length of the string, independent of the number of prefixes.
+    # Each node is a dictionary mapping the next character to a child
+    # node; the value of a prefix, if any, is stored under the None key
+    # of the node at which the prefix ends.
+
+    def __init__(self, items=()):
+        self._root = {}
+        for prefix, value in items:
+            node = self._root
+            for c in prefix:
+                node = node.setdefault(c, {})
+            node[None] = value
+
+    def longestMatch(self, s):
+        # Returns the value of the longest prefix of 's', or None.
+        node = self._root
+        lm = node.get(None)
+        for c in s:
+            node = node.get(c)
+            if node is None:
+                break
+            if None in node:
+                lm = node[None]
+        return lm
+
+
 def loadConfig(acquireLock=True):
     global _url, _username, _password, _arkTestPrefix, _doiTestPrefix
-    global _agentPrefix, _shoulders, _datacenters
+    global _agentPrefix, _shoulders, _shoulderTrie, _datacenters
     global _crossrefTestPrefix
     import config
 
@@ -199,14 +241,19 @@ def loadConfig(acquireLock=True):
         _crossrefTestPrefix = config.get("shoulders.crossref_test")
         _agentPrefix = config.get("shoulders.agent")
 
-        _shoulders = dict(
+        shoulders = dict(
             (s.prefix, s)
             for s in Shoulder.objects.select_related("datacenter").all()
             if s.active and s.manager == 'ezid'
         )
+        # The trie is built before either cache is replaced, so readers
+        # never see a partially built index.
+        shoulderTrie = PrefixTrie(shoulders.items())
+        _shoulders, _shoulderTrie = shoulders, shoulderTrie
 
         dc = dict((d.symbol, d) for d in store_datacenter.StoreDatacenter.objects.all())
         _datacenters = (dc, dict((d.id, d) for d in dc.values()))
+        clearMinterPathCache()
 
 
 def getAll():
@@ -217,12 +264,7 @@ def getAll():
 def getLongestMatch(identifier):
     # Returns the longest shoulder that matches 'identifier', i.e., that
     # is a prefix of 'identifier', or None.
-    lm = None
-    for s in _shoulders.itervalues():
-        if identifier.startswith(s.prefix):
-            if lm is None or len(s.prefix) > len(lm.prefix):
-                lm = s
-    return lm
+    return _shoulderTrie.longestMatch(identifier)
 
 
 def getExactMatch(prefix):
@@ -236,6 +278,50 @@ def getExactMatch(prefix):
     return shoulder_model
 
 
+def getMinterPath(shoulder):
+    """
+  Returns the path (a pathlib2.Path) to the minter BerkeleyDB of
+  Shoulder 'shoulder', as computed by
+  nog.bdb.get_bdb_path_by_shoulder_model.  Paths are cached by
+  shoulder prefix.
+  """
+    global _minterPathHits, _minterPathMisses
+    import nog.bdb
+
+    with _minterPathLock:
+        e = _minterPaths.get(shoulder.prefix)
+        if e is not None and e[0] == shoulder.minter:
+            _minterPathHits += 1
+            return e[1]
+        _minterPathMisses += 1
+        generation = _minterPathGeneration
+    path = nog.bdb.get_bdb_path_by_shoulder_model(shoulder)
+    with _minterPathLock:
+        if generation == _minterPathGeneration:
+            _minterPaths[shoulder.prefix] = (shoulder.minter, path)
+    return path
+
+
+def clearMinterPathCache():
+    """
+  Clears the minter path cache.  Must be called when shoulders or
+  minters are created or changed.
+  """
+    global _minterPathGeneration
+    with _minterPathLock:
+        _minterPaths.clear()
+        _minterPathGeneration += 1
+
+
+def getMinterPathCacheStatistics():
+    """
+  Returns the number of minter path cache hits and misses since the
+  server was started, as a tuple (hits, misses).
+  """
+    with _minterPathLock:
+        return _minterPathHits, _minterPathMisses
+
+
 def getArkTestShoulder():
     # Returns the ARK test shoulder.
     return _shoulders[_arkTestPrefix]
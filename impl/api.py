@@ -17,6 +17,14 @@
 #   request body: optional metadata
 #   response body: status line
 #
+# Mint a batch of identifiers:
+#   POST /batch_mint/{shoulder}   [authentication required]
+#     ?count={n}
+#   request body: optional metadata, shared by all identifiers
+#   response body: one status line per minted identifier, streamed
+#     back as the identifiers are stored; if storing fails part way,
+#     the last line is an error status line
+#
 # Create an identifier:
 #   PUT /id/{identifier}   [authentication required]
 #     ?update_if_exists={yes|no}
@@ -231,6 +239,43 @@ def mintIdentifier(request):
     return _response(ezid.mintIdentifier(shoulder, user, metadata), createRequest=True)
 
 
+def batchMintIdentifiers(request):
+    """
+  Mints a batch of identifiers; interface to
+  ezid.batchMintIdentifiers.
+  """
+    if request.method != "POST":
+        return _methodNotAllowed()
+    user = userauth.authenticateRequest(request)
+    if type(user) is str:
+        return _response(user)
+    elif not user:
+        return _unauthorized()
+    metadata = _readInput(request)
+    if type(metadata) is str:
+        return _response(metadata)
+    options = _validateOptions(request, {"count": None})
+    if type(options) is str:
+        return _response(options)
+    try:
+        count = int(options["count"])
+    except (KeyError, ValueError):
+        return _response("error: bad request - missing or invalid 'count' parameter")
+    assert request.path_info.startswith("/batch_mint/")
+    shoulder = request.path_info[12:]
+    r = ezid.batchMintIdentifiers(shoulder, user, count, metadata)
+    if type(r) is str:
+        return _response(r, createRequest=True)
+    return django.http.StreamingHttpResponse(
+        (
+            anvl.formatPair(*[v.strip() for v in s.split(":", 1)]).encode("UTF-8")
+            for s in r
+        ),
+        status=201,
+        content_type="text/plain; charset=UTF-8",
+    )
+
+
 def identifierDispatcher(request):
     """
   Dispatches an identifier request depending on the HTTP method;
@@ -4,6 +4,15 @@
 #
 # Background identifier processing.
 #
+# Queue entries are processed either one at a time or, if so
+# configured, in batches: the search database is updated with a bulk
+# existence lookup and bulk insert, and the downstream registration
+# queue entries are inserted in bulk.  Entries can further be
+# partitioned by identifier among several worker threads; since all
+# entries for a given identifier go to the same worker, and each
+# worker processes its entries in queue order, per-identifier ordering
+# is preserved.
+#
 # This module should be imported at server startup so that its daemon
 # thread is started.
 #
@@ -20,6 +29,7 @@ import logging
 import threading
 import time
 import uuid
+import zlib
 
 import django.conf
 import django.db
@@ -32,7 +42,10 @@ import datacite_async
 import ezidapp.models
 import ezidapp.models.search_identifier
 import log
+import oai
+import register_async
 import search_util
+import stats
 import util
 
 _enabled = None
@@ -40,25 +53,264 @@ _lock = threading.Lock()
 _runningThreads = set()
 _threadName = None
 _idleSleep = None
+_batchSize = None
+_numWorkers = None
 
 
 logger = logging.getLogger(__name__)
 
 
 def _updateSearchDatabase(identifier, operation, metadata, blob):
+    # Returns the resulting statistics changes (see stats.addDelta) if
+    # statistics are maintained incrementally.
+    deltas = {}
+    if stats.isIncremental():
+        oldKey = stats.getStatisticsKeys([identifier]).get(identifier)
     if operation in ["create", "update"]:
-        ezidapp.models.search_identifier.updateFromLegacy(identifier, metadata)
+        i = ezidapp.models.search_identifier.updateFromLegacy(identifier, metadata)
+        oai.cacheRecords([i])
+        if stats.isIncremental():
+            stats.addDelta(deltas, oldKey, stats.getStatisticsKey(i))
     elif operation == "delete":
         ezidapp.models.SearchIdentifier.objects.filter(identifier=identifier).delete()
+        oai.uncacheRecords([identifier])
+        if stats.isIncremental():
+            stats.addDelta(deltas, oldKey, None)
     else:
         assert False, "unrecognized operation"
+    search_util.noteSearchDatabaseUpdate()
+    return deltas
+
+
+def _deltasLost(deltas):
+    # Called when the search database has been updated but the
+    # resulting statistics changes could not be applied.  A retry will
+    # find the search database already updated and compute no changes,
+    # so the statistics must be reconciled.
+    if len([v for v in deltas.values() if v != 0]) > 0:
+        stats.requestReconciliation()
+
 
+def _checkContinue(threadName=None):
+    # Worker threads pass the name of the daemon thread that started
+    # them.
+    if threadName is None:
+        threadName = threading.currentThread().getName()
+    return _enabled and threadName == _threadName
 
-def _checkContinue():
-    return _enabled and threading.currentThread().getName() == _threadName
+
+def _processUpdate(update_model, checkContinue):
+    # The use of legacy representations and blobs will go away soon.
+    metadata = update_model.actualObject.toLegacy()
+    blob = util.blobify(metadata)
+    deltas = {}
+    if update_model.actualObject.owner != None:
+        deltas = search_util.withAutoReconnect(
+            "backproc._updateSearchDatabase",
+            lambda: _updateSearchDatabase(
+                update_model.identifier,
+                update_model.get_operation_display(),
+                metadata,
+                blob,
+            ),
+            checkContinue,
+        )
+    try:
+        with django.db.transaction.atomic():
+            if not update_model.actualObject.isReserved:
+                binder_async.enqueueIdentifier(
+                    update_model.identifier, update_model.get_operation_display(), blob
+                )
+                if update_model.updateExternalServices:
+                    if update_model.actualObject.isDatacite:
+                        if not update_model.actualObject.isTest:
+                            datacite_async.enqueueIdentifier(
+                                update_model.identifier,
+                                update_model.get_operation_display(),
+                                blob,
+                            )
+                    elif update_model.actualObject.isCrossref:
+                        crossref.enqueueIdentifier(
+                            update_model.identifier,
+                            update_model.get_operation_display(),
+                            metadata,
+                            blob,
+                        )
+            stats.applyDeltas(deltas)
+            update_model.delete()
+    except:
+        _deltasLost(deltas)
+        raise
+
+
+def _updateSearchDatabaseBatch(finalOperations):
+    # 'finalOperations' maps identifiers to (operation, metadata) tuples
+    # holding the last operation applied to each identifier.  Returns
+    # the resulting statistics changes as in _updateSearchDatabase.
+    deltas = {}
+    if stats.isIncremental():
+        oldKeys = stats.getStatisticsKeys(finalOperations.keys())
+    deletes = [i for i, (op, _) in finalOperations.items() if op == "delete"]
+    if len(deletes) > 0:
+        ezidapp.models.SearchIdentifier.objects.filter(
+            identifier__in=deletes
+        ).delete()
+        oai.uncacheRecords(deletes)
+        if stats.isIncremental():
+            for i in deletes:
+                stats.addDelta(deltas, oldKeys.get(i), None)
+    updates = [
+        (i, m) for i, (op, m) in finalOperations.items() if op != "delete"
+    ]
+    if len(updates) > 0:
+        l = ezidapp.models.search_identifier.updateFromLegacyBatch(updates)
+        oai.cacheRecords(l)
+        if stats.isIncremental():
+            for i in l:
+                stats.addDelta(
+                    deltas, oldKeys.get(i.identifier), stats.getStatisticsKey(i)
+                )
+    search_util.noteSearchDatabaseUpdate()
+    return deltas
+
+
+def _processBatch(update_list, checkContinue):
+    # 'update_list' must be in queue order.
+    entries = []
+    finalOperations = {}
+    for update_model in update_list:
+        operation = update_model.get_operation_display()
+        assert operation in ["create", "update", "delete"], "unrecognized operation"
+        metadata = update_model.actualObject.toLegacy()
+        blob = util.blobify(metadata)
+        entries.append((update_model, operation, metadata, blob))
+        if update_model.actualObject.owner != None:
+            finalOperations[update_model.identifier] = (operation, metadata)
+    deltas = {}
+    if len(finalOperations) > 0:
+        deltas = search_util.withAutoReconnect(
+            "backproc._updateSearchDatabaseBatch",
+            lambda: _updateSearchDatabaseBatch(finalOperations),
+            checkContinue,
+        )
+    binderEntries = []
+    dataciteEntries = []
+    crossrefEntries = []
+    for update_model, operation, metadata, blob in entries:
+        if update_model.actualObject.isReserved:
+            continue
+        binderEntries.append(
+            register_async.newQueueEntry(
+                ezidapp.models.BinderQueue, update_model.identifier, operation, blob
+            )
+        )
+        if update_model.updateExternalServices:
+            if update_model.actualObject.isDatacite:
+                if not update_model.actualObject.isTest:
+                    dataciteEntries.append(
+                        register_async.newQueueEntry(
+                            ezidapp.models.DataciteQueue,
+                            update_model.identifier,
+                            operation,
+                            blob,
+                        )
+                    )
+            elif update_model.actualObject.isCrossref:
+                crossrefEntries.append(
+                    crossref.newQueueEntry(
+                        update_model.identifier, operation, metadata, blob
+                    )
+                )
+    try:
+        with django.db.transaction.atomic():
+            ezidapp.models.BinderQueue.objects.bulk_create(binderEntries)
+            ezidapp.models.DataciteQueue.objects.bulk_create(dataciteEntries)
+            ezidapp.models.CrossrefQueue.objects.bulk_create(crossrefEntries)
+            stats.applyDeltas(deltas)
+            # The processed entries are deleted by sequence number rather
+            # than by range, as entries with lower sequence numbers may be
+            # committed after entries with higher ones.
+            ezidapp.models.UpdateQueue.objects.filter(
+                seq__in=[u.seq for u in update_list]
+            ).delete()
+    except:
+        _deltasLost(deltas)
+        raise
+
+
+def _processPartition(update_list, checkContinue):
+    # Processes a list of queue entries, in queue order.  Returns False
+    # if processing was aborted.
+    try:
+        for i in range(0, len(update_list), _batchSize):
+            if not checkContinue():
+                return False
+            batch = update_list[i : i + _batchSize]
+            if len(batch) > 1:
+                try:
+                    _processBatch(batch, checkContinue)
+                    continue
+                except search_util.AbortException:
+                    raise
+                except Exception, e:
+                    # Fall back to processing the entries one at a time,
+                    # so that a single bad entry does not hold up the
+                    # others.
+                    log.otherError("backproc._processBatch", e)
+            for update_model in batch:
+                if not checkContinue():
+                    return False
+                _processUpdate(update_model, checkContinue)
+    except search_util.AbortException:
+        return False
+    return True
+
+
+def _partitionWorker(update_list, checkContinue, results, index):
+    # An exception is passed back to the daemon thread in 'results'.
+    try:
+        results[index] = _processPartition(update_list, checkContinue)
+    except Exception, e:
+        results[index] = e
+    finally:
+        django.db.connections["default"].close()
+        django.db.connections["search"].close()
+
+
+def _processChunk(update_list, checkContinue):
+    # Processes a chunk of queue entries, partitioning them by
+    # identifier among the worker threads.  Returns False if processing
+    # was aborted.  An exception raised in any worker thread is raised
+    # once all workers have finished, so that the daemon backs off as
+    # it does when processing in a single thread.
+    if _numWorkers == 1:
+        return _processPartition(update_list, checkContinue)
+    partitions = [[] for i in range(_numWorkers)]
+    for update_model in update_list:
+        h = zlib.crc32(update_model.identifier.encode("UTF-8")) & 0xFFFFFFFF
+        partitions[h % _numWorkers].append(update_model)
+    results = [True] * _numWorkers
+    threads = []
+    for i, p in enumerate(partitions):
+        if len(p) == 0:
+            continue
+        t = threading.Thread(
+            target=_partitionWorker, args=(p, checkContinue, results, i)
+        )
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    for r in results:
+        if isinstance(r, Exception):
+            raise r
+    return all(results)
 
 
 def _backprocDaemon():
+    threadName = threading.currentThread().getName()
+    checkContinue = lambda: _checkContinue(threadName)
     _lock.acquire()
 
     try:
@@ -91,49 +343,13 @@ def _backprocDaemon():
     # Regular processing.
     while _checkContinue():
         try:
-            update_list = list(ezidapp.models.UpdateQueue.objects.all().order_by("seq")[:1000])
+            update_list = list(
+                ezidapp.models.UpdateQueue.objects.all().order_by("seq")[
+                    : max(1000, _batchSize * _numWorkers)
+                ]
+            )
             if len(update_list) > 0:
-                for update_model in update_list:
-                    if not _checkContinue():
-                        break
-                    # The use of legacy representations and blobs will go away soon.
-                    metadata = update_model.actualObject.toLegacy()
-                    blob = util.blobify(metadata)
-                    if update_model.actualObject.owner != None:
-                        try:
-                            search_util.withAutoReconnect(
-                                "backproc._updateSearchDatabase",
-                                lambda: _updateSearchDatabase(
-                                    update_model.identifier,
-                                    update_model.get_operation_display(),
-                                    metadata,
-                                    blob,
-                                ),
-                                _checkContinue,
-                            )
-                        except search_util.AbortException:
-                            break
-                    with django.db.transaction.atomic():
-                        if not update_model.actualObject.isReserved:
-                            binder_async.enqueueIdentifier(
-                                update_model.identifier, update_model.get_operation_display(), blob
-                            )
-                            if update_model.updateExternalServices:
-                                if update_model.actualObject.isDatacite:
-                                    if not update_model.actualObject.isTest:
-                                        datacite_async.enqueueIdentifier(
-                                            update_model.identifier,
-                                            update_model.get_operation_display(),
-                                            blob,
-                                        )
-                                elif update_model.actualObject.isCrossref:
-                                    crossref.enqueueIdentifier(
-                                        update_model.identifier,
-                                        update_model.get_operation_display(),
-                                        metadata,
-                                        blob,
-                                    )
-                        update_model.delete()
+                _processChunk(update_list, checkContinue)
             else:
                 django.db.connections["default"].close()
                 django.db.connections["search"].close()
@@ -151,13 +367,15 @@ def _backprocDaemon():
 
 
 def loadConfig():
-    global _enabled, _idleSleep, _threadName
+    global _enabled, _idleSleep, _threadName, _batchSize, _numWorkers
     _enabled = (
         django.conf.settings.DAEMON_THREADS_ENABLED
         and config.get("daemons.backproc_enabled").lower() == "true"
     )
     if _enabled:
         _idleSleep = int(config.get("daemons.background_processing_idle_sleep"))
+        _batchSize = max(int(config.get("daemons.backproc_batch_size")), 1)
+        _numWorkers = max(int(config.get("daemons.backproc_num_workers")), 1)
         _threadName = uuid.uuid1().hex
         t = threading.Thread(target=_backprocDaemon, name=_threadName)
         t.setDaemon(True)
@@ -31,12 +31,11 @@ def _create(sh, rows, id, metadata):
     )
 
 
-def _update(sh, rows, id, metadata):
-    m = register_async.callWrapper(
-        sh, rows, "noid_egg.getElements", noid_egg.getElements, id
-    )
-    if m == None:
-        m = {}
+def _diff(current, metadata):
+    # Returns the elements that must be set (or, if empty, removed) to
+    # change an identifier's bound elements from 'current' (which may
+    # be None) to 'metadata'.
+    m = current or {}
     for k, v in metadata.items():
         if m.get(k) == v:
             del m[k]
@@ -45,6 +44,14 @@ def _update(sh, rows, id, metadata):
     for k in m.keys():
         if k not in metadata:
             m[k] = ""
+    return m
+
+
+def _update(sh, rows, id, metadata):
+    m = register_async.callWrapper(
+        sh, rows, "noid_egg.getElements", noid_egg.getElements, id
+    )
+    m = _diff(m, metadata)
     if len(m) > 0:
         register_async.callWrapper(
             sh, rows, "noid_egg.setElements", noid_egg.setElements, id, m
@@ -63,6 +70,25 @@ def _batchCreate(sh, rows, batch):
     )
 
 
+def _batchUpdate(sh, rows, batch):
+    currents = register_async.callWrapper(
+        sh,
+        rows,
+        "noid_egg.batchGetElements",
+        noid_egg.batchGetElements,
+        [identifier for identifier, metadata in batch],
+    )
+    updates = []
+    for (identifier, metadata), current in zip(batch, currents):
+        m = _diff(current, metadata)
+        if len(m) > 0:
+            updates.append((identifier, m))
+    if len(updates) > 0:
+        register_async.callWrapper(
+            sh, rows, "noid_egg.batchSetElements", noid_egg.batchSetElements, updates
+        )
+
+
 def _batchDelete(sh, rows, batch):
     register_async.callWrapper(
         sh,
@@ -107,11 +133,12 @@ def loadConfig():
             _update,
             _delete,
             _batchCreate,
-            None,
+            _batchUpdate,
             _batchDelete,
             int(config.get("daemons.binder_num_worker_threads")),
             int(config.get("daemons.binder_processing_idle_sleep")),
             int(config.get("daemons.binder_processing_error_sleep")),
             _daemonEnabled,
             _threadName,
+            minWorkerThreads=int(config.get("daemons.binder_min_worker_threads")),
         )
@@ -0,0 +1,215 @@
+# =============================================================================
+#
+# EZID :: cm_codec.py
+#
+# Compression of citation metadata database values.
+#
+# Citation metadata is stored as a compressed JSON string.  Two
+# formats are in use, and both are always readable:
+#
+#   legacy            A plain zlib stream.  The first byte of a zlib
+#                     stream is a CMF byte whose low nibble is 8.
+#
+#   preset dictionary A FORMAT_PRESET_DICTIONARY byte, a byte holding a
+#                     dictionary ID, and a raw deflate continuation of
+#                     the dictionary's own compressed stream, ending
+#                     with the zlib checksum.
+#
+# Most stored records are small, so zlib has little opportunity to
+# find repetitions within a single record.  The preset dictionary
+# holds the strings that recur across records (XML prologs, namespace
+# declarations, element names, metadata element names), so that they
+# compress to short back references even the first time they appear
+# in a record.
+#
+# Python 2's zlib module does not support preset dictionaries, so a
+# dictionary is emulated: a compressor is primed by compressing the
+# dictionary and flushing with Z_SYNC_FLUSH, which leaves the
+# dictionary in the compressor's window and aligns its output to a
+# byte boundary.  Each value is compressed by a copy of the primed
+# compressor, and only the output that follows the flush is stored.
+# Likewise, a decompressor is primed with the dictionary's compressed
+# prefix, and each value is decompressed by a copy of it.
+#
+# A dictionary must never change once values have been written with
+# it.  To use a new dictionary, add it under a new ID, keeping the old
+# ones.  The preset dictionary format is written only if
+# 'cm_preset_dictionary_enabled' is true, so that it can be enabled
+# once every process that reads the database understands it.
+#
+# License:
+#   Copyright (c) 2020, Regents of the University of California
+#   http://creativecommons.org/licenses/BSD/
+#
+# -----------------------------------------------------------------------------
+
+import json
+import zlib
+
+import config
+
+FORMAT_PRESET_DICTIONARY = "\x01"
+
+_presetDictionaryEnabled = False
+
+# Strings that appear as is in the JSON encoding of citation metadata.
+_jsonFragments = [
+    '{"_profile":"',
+    '","_target":"',
+    '{"erc.who":"',
+    '","erc.what":"',
+    '","erc.when":"',
+    '{"dc.creator":"',
+    '","dc.title":"',
+    '","dc.publisher":"',
+    '","dc.date":"',
+    '","dc.type":"',
+    '{"datacite.creator":"',
+    '","datacite.title":"',
+    '","datacite.publisher":"',
+    '","datacite.publicationyear":"',
+    '","datacite.resourcetype":"',
+    '{"crossref":"',
+    '","datacite":"',
+    '{"datacite":"',
+]
+
+# XML fragments of DataCite and Crossref records.  These appear in
+# citation metadata as JSON string contents, and so are escaped before
+# being added to the dictionary.
+_xmlFragments = [
+    '<?xml version="1.0"?>\n<journal xmlns="http://www.crossref.org/schema/4.4.0"'
+    ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+    ' xsi:schemaLocation="http://www.crossref.org/schema/4.4.0'
+    ' http://www.crossref.org/schema/deposit/crossref4.4.0.xsd">\n'
+    '  <journal_metadata language="en">\n    <full_title></full_title>\n'
+    '    <abbrev_title></abbrev_title>\n    <issn media_type="print"></issn>\n'
+    '  </journal_metadata>\n  <journal_issue>\n    <publication_date'
+    ' media_type="print">\n      <year></year>\n    </publication_date>\n'
+    '    <journal_volume>\n      <volume></volume>\n    </journal_volume>\n'
+    '    <issue></issue>\n  </journal_issue>\n  <journal_article'
+    ' publication_type="full_text">\n    <titles>\n      <title></title>\n'
+    '    </titles>\n    <contributors>\n      <person_name sequence="first"'
+    ' contributor_role="author">\n        <given_name></given_name>\n'
+    '        <surname></surname>\n      </person_name>\n'
+    '      <person_name sequence="additional" contributor_role="author">\n'
+    '    </contributors>\n    <pages>\n      <first_page></first_page>\n'
+    '      <last_page></last_page>\n    </pages>\n    <doi_data>\n'
+    '      <doi>(:tba)</doi>\n      <resource>(:tba)</resource>\n'
+    '    </doi_data>\n  </journal_article>\n</journal>',
+    '<?xml version="1.0"?>\n<resource xmlns="http://datacite.org/schema/kernel-3"'
+    ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+    ' xsi:schemaLocation="http://datacite.org/schema/kernel-3'
+    ' http://schema.datacite.org/meta/kernel-3/metadata.xsd">\n',
+    '<?xml version="1.0"?>\n<resource xmlns="http://datacite.org/schema/kernel-4"'
+    ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+    ' xsi:schemaLocation="http://datacite.org/schema/kernel-4'
+    ' http://schema.datacite.org/meta/kernel-4/metadata.xsd">\n'
+    '  <identifier identifierType="DOI">10.</identifier>\n  <creators>\n'
+    '    <creator>\n      <creatorName nameType="Personal"></creatorName>\n'
+    '      <givenName></givenName>\n      <familyName></familyName>\n'
+    '      <nameIdentifier nameIdentifierScheme="ORCID"'
+    ' schemeURI="https://orcid.org/">https://orcid.org/</nameIdentifier>\n'
+    '      <affiliation></affiliation>\n    </creator>\n  </creators>\n'
+    '  <titles>\n    <title xml:lang="en"></title>\n  </titles>\n'
+    '  <publisher></publisher>\n  <publicationYear></publicationYear>\n'
+    '  <resourceType resourceTypeGeneral="Dataset">Dataset</resourceType>\n'
+    '  <subjects>\n    <subject></subject>\n  </subjects>\n'
+    '  <contributors>\n    <contributor contributorType="ContactPerson">\n'
+    '      <contributorName></contributorName>\n    </contributor>\n'
+    '  </contributors>\n  <dates>\n    <date dateType="Issued"></date>\n'
+    '    <date dateType="Available"></date>\n  </dates>\n'
+    '  <language>en</language>\n  <alternateIdentifiers>\n'
+    '    <alternateIdentifier alternateIdentifierType="URL">'
+    '</alternateIdentifier>\n  </alternateIdentifiers>\n'
+    '  <relatedIdentifiers>\n    <relatedIdentifier relatedIdentifierType="DOI"'
+    ' relationType="IsSupplementTo">10.</relatedIdentifier>\n'
+    '    <relatedIdentifier relatedIdentifierType="URL"'
+    ' relationType="IsReferencedBy">https://</relatedIdentifier>\n'
+    '  </relatedIdentifiers>\n  <sizes>\n    <size></size>\n  </sizes>\n'
+    '  <formats>\n    <format></format>\n  </formats>\n'
+    '  <version>1</version>\n  <rightsList>\n    <rights'
+    ' rightsURI="https://creativecommons.org/licenses/by/4.0/">Creative Commons'
+    ' Attribution 4.0 International</rights>\n    <rights'
+    ' rightsURI="info:eu-repo/semantics/openAccess">Open Access</rights>\n'
+    '  </rightsList>\n  <descriptions>\n    <description'
+    ' descriptionType="Abstract"></description>\n  </descriptions>\n'
+    '  <geoLocations>\n    <geoLocation>\n      <geoLocationPlace>'
+    '</geoLocationPlace>\n      <geoLocationPoint>\n        <pointLongitude>'
+    '</pointLongitude>\n        <pointLatitude></pointLatitude>\n'
+    '      </geoLocationPoint>\n    </geoLocation>\n  </geoLocations>\n'
+    '  <fundingReferences>\n    <fundingReference>\n      <funderName>'
+    '</funderName>\n      <funderIdentifier funderIdentifierType="Crossref'
+    ' Funder ID">https://doi.org/10.13039/</funderIdentifier>\n'
+    '      <awardNumber></awardNumber>\n    </fundingReference>\n'
+    '  </fundingReferences>\n</resource>',
+]
+
+
+def _buildDictionary(jsonFragments, xmlFragments):
+    # Strings used most are placed last, as back references to the end
+    # of the window are the cheapest.
+    return "".join(
+        [json.dumps(f)[1:-1] for f in xmlFragments] + jsonFragments
+    )
+
+
+class _PresetDictionary(object):
+    def __init__(self, id, dictionary):
+        self.id = id
+        self.header = FORMAT_PRESET_DICTIONARY + chr(id)
+        self.compressor = zlib.compressobj(9, zlib.DEFLATED, 15)
+        prefix = self.compressor.compress(dictionary) + self.compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+        self.decompressor = zlib.decompressobj(15)
+        assert self.decompressor.decompress(prefix) == dictionary
+
+    def compress(self, s):
+        c = self.compressor.copy()
+        return self.header + c.compress(s) + c.flush()
+
+    def decompress(self, blob):
+        d = self.decompressor.copy()
+        s = d.decompress(buffer(blob, 2)) + d.flush()
+        assert d.unused_data == "", "trailing data after compressed value"
+        return s
+
+
+_dictionaries = {
+    1: _PresetDictionary(1, _buildDictionary(_jsonFragments, _xmlFragments))
+}
+_currentDictionary = _dictionaries[1]
+
+
+def loadConfig():
+    global _presetDictionaryEnabled
+    _presetDictionaryEnabled = (
+        config.get("DEFAULT.cm_preset_dictionary_enabled").lower() == "true"
+    )
+
+
+def compress(s, presetDictionary=None):
+    """
+  Compresses string 's'.  The preset dictionary format is used if
+  'presetDictionary' is true or, if it is None, if the format is
+  enabled in the configuration; otherwise, the legacy format is used.
+  """
+    if presetDictionary is None:
+        presetDictionary = _presetDictionaryEnabled
+    if presetDictionary:
+        return _currentDictionary.compress(s)
+    else:
+        return zlib.compress(s)
+
+
+def decompress(blob):
+    """
+  Decompresses a string compressed by compress, in either format.
+  """
+    if blob[:1] == FORMAT_PRESET_DICTIONARY:
+        d = _dictionaries.get(ord(blob[1:2]))
+        assert d is not None, "unknown compression dictionary"
+        return d.decompress(blob)
+    else:
+        return zlib.decompress(blob)
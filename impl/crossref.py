@@ -46,11 +46,25 @@ _threadName = None
 _idleSleep = None
 _ezidUrl = None
 _dataciteEnabled = None
+_numWorkers = None
+_pollMaxInterval = None
+
+# Poll schedule, maintained by the daemon thread: maps queue entry
+# sequence numbers to the times at which the entries' deposits are
+# next to be polled.
+_nextPollTime = {}
+
+_statisticsLock = threading.Lock()
+_cycleTime = 0.0
+_numDeposited = 0
+_numPolled = 0
+_pollsScheduled = 0
 
 def loadConfig ():
   global _enabled, _depositorName, _depositorEmail, _realServer, _testServer
   global _depositUrl, _resultsUrl, _username, _password
   global _daemonEnabled, _threadName, _idleSleep, _ezidUrl, _dataciteEnabled
+  global _numWorkers, _pollMaxInterval
   _enabled = (config.get("crossref.enabled").lower() == "true")
   _depositorName = config.get("crossref.depositor_name")
   _depositorEmail = config.get("crossref.depositor_email")
@@ -61,6 +75,8 @@ def loadConfig ():
   _username = config.get("crossref.username")
   _password = config.get("crossref.password")
   _idleSleep = int(config.get("daemons.crossref_processing_idle_sleep"))
+  _numWorkers = int(config.get("daemons.crossref_num_worker_threads"))
+  _pollMaxInterval = int(config.get("daemons.crossref_poll_max_interval"))
   _daemonEnabled = (
     django.conf.settings.DAEMON_THREADS_ENABLED
     and config.get("daemons.crossref_enabled").lower() == "true"
@@ -439,10 +455,16 @@ def enqueueIdentifier (identifier, operation, metadata, blob):
   strings "create", "update", or "delete".  'metadata' is the
   identifier's metadata dictionary; 'blob' is the same in blob form.
   """
-  e = ezidapp.models.CrossrefQueue(identifier=identifier, owner=metadata["_o"],
-    metadata=blob,
+  newQueueEntry(identifier, operation, metadata, blob).save()
+
+def newQueueEntry (identifier, operation, metadata, blob):
+  """
+  Returns a new, unsaved Crossref queue entry.  The arguments are as
+  in enqueueIdentifier.
+  """
+  return ezidapp.models.CrossrefQueue(identifier=identifier,
+    owner=metadata["_o"], metadata=blob,
     operation=ezidapp.models.CrossrefQueue.operationLabelToCode(operation))
-  e.save()
 
 def getQueueStatistics ():
   """
@@ -456,6 +478,19 @@ def getQueueStatistics ():
   for r in q: d[r["status"]] = r["status__count"]
   return (d.get("U", 0), d.get("S", 0), d.get("W", 0), d.get("F", 0))
 
+def getSchedulerStatistics ():
+  """
+  Returns a 4-tuple describing the most recent processing cycle of
+  the Crossref daemon: (cycle time in seconds, number of deposits
+  submitted, number of deposits polled, number of submitted deposits
+  awaiting their next poll).
+  """
+  _statisticsLock.acquire()
+  try:
+    return (_cycleTime, _numDeposited, _numPolled, _pollsScheduled)
+  finally:
+    _statisticsLock.release()
+
 class _AbortException (Exception):
   pass
 
@@ -464,8 +499,11 @@ def _checkAbort ():
   # daemon is disabled or if a new daemon thread is started by a
   # configuration reload.  It doesn't entirely eliminate potential
   # race conditions between two daemon threads, but it should make
-  # conflicts very unlikely.
-  if not _daemonEnabled or threading.currentThread().getName() != _threadName:
+  # conflicts very unlikely.  Worker threads are named after the
+  # daemon thread that started them.
+  n = threading.currentThread().getName()
+  if not _daemonEnabled or (n != _threadName and\
+    not n.startswith(_threadName + ".")):
     raise _AbortException()
   return True
 
@@ -570,7 +608,69 @@ def _doPoll (r):
   else:
     pass
 
+def _pollInterval (r, now):
+  # The interval until a submitted deposit is next polled grows with
+  # the time since it was submitted: Crossref usually completes a
+  # deposit within a few minutes, but deposits that remain queued at
+  # Crossref may take hours.
+  return min(max(now-r.submitTime, _idleSleep), _pollMaxInterval)
+
+def _runWorkers (function, entries):
+  # Applies 'function' to each of the queue entries in 'entries' using
+  # a bounded pool of worker threads.  Returns the number of entries
+  # processed.  Any _AbortException or other exception is re-raised
+  # in the calling thread.
+  entries = list(reversed(entries))
+  lock = threading.Lock()
+  errors = []
+  processed = [0]
+  def worker ():
+    try:
+      while True:
+        lock.acquire()
+        try:
+          if len(entries) == 0 or len(errors) > 0: break
+          r = entries.pop()
+        finally:
+          lock.release()
+        function(r)
+        lock.acquire()
+        processed[0] += 1
+        lock.release()
+    except Exception, e:
+      lock.acquire()
+      errors.append(e)
+      lock.release()
+    finally:
+      django.db.connections["default"].close()
+      django.db.connections["search"].close()
+  if len(entries) == 0: return 0
+  threads = []
+  for i in range(min(_numWorkers, len(entries))):
+    t = threading.Thread(target=worker, name="%s.%d" % (_threadName, i))
+    t.setDaemon(True)
+    t.start()
+    threads.append(t)
+  for t in threads: t.join()
+  if len(errors) > 0:
+    for e in errors:
+      if isinstance(e, _AbortException): raise e
+    raise errors[0]
+  return processed[0]
+
+def _supersededEntries (entries):
+  # If there are multiple entries for an identifier, all but the last,
+  # i.e., the most recent, represent modifications that have since
+  # been superseded.  Returns the sequence numbers of those entries.
+  latest = {}
+  superseded = []
+  for seq, identifier in entries:
+    if identifier in latest: superseded.append(latest[identifier])
+    latest[identifier] = seq
+  return superseded
+
 def _daemonThread ():
+  global _cycleTime, _numDeposited, _numPolled, _pollsScheduled
   maxSeq = None
   while True:
     django.db.connections["default"].close()
@@ -578,38 +678,65 @@ def _daemonThread ():
     time.sleep(_idleSleep)
     try:
       _checkAbort()
-      # First, a quick test to avoid retrieving the entire table if
-      # nothing needs to be done.  Note that in the loop below, if any
-      # entry is deleted or if any identifier is processed, maxSeq is
-      # set to None, thus forcing another round of processing.
-      if maxSeq != None:
+      # First, a quick test to avoid examining the table if nothing
+      # needs to be done.  Note that below, if any entry is deleted or
+      # if any identifier is processed, maxSeq is set to None, thus
+      # forcing another round of processing.
+      if maxSeq != None and (len(_nextPollTime) == 0 or\
+        min(_nextPollTime.itervalues()) > time.time()):
         if _queue().objects.aggregate(
           django.db.models.Max("seq"))["seq__max"] == maxSeq:
           continue
-      # Hopefully the queue will not grow so large that the following
-      # query will cause a burden.
-      query = _queue().objects.all().order_by("seq")
-      if len(query) > 0:
-        maxSeq = query[len(query)-1].seq
+      start = time.time()
+      # Entries are first retrieved without their metadata, to
+      # determine what needs to be done.
+      entries = list(_queue().objects.order_by("seq").\
+        values_list("seq", "identifier", "status"))
+      if len(entries) > 0:
+        maxSeq = entries[-1][0]
       else:
         maxSeq = None
-      for r in query:
-        # If there are multiple entries for this identifier, we are
-        # necessarily looking at the first, i.e., the earliest, and
-        # the others must represent subsequent modifications.  Hence
-        # we simply delete this entry regardless of its status.
-        if _queue().objects.filter(identifier=r.identifier).count() > 1:
-          r.delete()
-          maxSeq = None
-        else:
-          if r.status == ezidapp.models.CrossrefQueue.UNSUBMITTED:
-            _doDeposit(r)
-            maxSeq = None
-          elif r.status == ezidapp.models.CrossrefQueue.SUBMITTED:
-            _doPoll(r)
-            maxSeq = None
-          else:
-            pass
+      superseded = set(_supersededEntries([(e[0], e[1]) for e in entries]))
+      for i in range(0, len(superseded), 1000):
+        _queue().objects.filter(
+          seq__in=sorted(superseded)[i:i+1000]).delete()
+        maxSeq = None
+      entries = [e for e in entries if e[0] not in superseded]
+      unsubmitted = [e[0] for e in entries\
+        if e[2] == ezidapp.models.CrossrefQueue.UNSUBMITTED]
+      submitted = set(e[0] for e in entries\
+        if e[2] == ezidapp.models.CrossrefQueue.SUBMITTED)
+      for seq in _nextPollTime.keys():
+        if seq not in submitted: del _nextPollTime[seq]
+      now = time.time()
+      due = sorted(seq for seq in submitted\
+        if _nextPollTime.get(seq, 0) <= now)
+      numDeposited = numPolled = 0
+      for i in range(0, len(unsubmitted), 1000):
+        numDeposited += _runWorkers(_doDeposit,
+          list(_queue().objects.filter(seq__in=unsubmitted[i:i+1000]).\
+          order_by("seq")))
+        maxSeq = None
+      # Due polls are retrieved in groups and polled in parallel.
+      # Polling requires no metadata.
+      for i in range(0, len(due), 1000):
+        polls = list(_queue().objects.filter(seq__in=due[i:i+1000]).\
+          defer("metadata").order_by("seq"))
+        numPolled += _runWorkers(_doPoll, polls)
+        now = time.time()
+        for r in polls:
+          if r.pk != None and\
+            r.status == ezidapp.models.CrossrefQueue.SUBMITTED:
+            _nextPollTime[r.pk] = now + _pollInterval(r, now)
+        maxSeq = None
+      _statisticsLock.acquire()
+      try:
+        _cycleTime = time.time()-start
+        _numDeposited = numDeposited
+        _numPolled = numPolled
+        _pollsScheduled = len(_nextPollTime)
+      finally:
+        _statisticsLock.release()
     except _AbortException:
       break
     except Exception, e:
@@ -16,16 +16,21 @@
 #
 # -----------------------------------------------------------------------------
 
+import StringIO
 import base64
 import django.conf
+import httplib
 import lxml.etree
 import os
 import os.path
+import random
 import re
+import socket
 import threading
 import time
 import urllib
 import urllib2
+import urlparse
 
 import config
 import ezidapp.models
@@ -39,30 +44,46 @@ _doiUrl = None
 _metadataUrl = None
 _numAttempts = None
 _reattemptDelay = None
+_maxReattemptDelay = None
 _timeout = None
+_poolSize = None
+_idleTimeout = None
 _allocators = None
+_authorizations = {}
 _stylesheet = None
 _crossrefTransform = None
 _pingDoi = None
 _pingDatacenter = None
 _pingTarget = None
 _numActiveOperations = 0
+_numRequests = 0
+_numReusedConnections = 0
+_numReattempts = 0
+_requestTime = 0.0
 _schemas = None
+_pools = {}
+_poolsLock = threading.Lock()
 
 
 def loadConfig():
     global _enabled, _doiUrl, _metadataUrl, _numAttempts, _reattemptDelay
-    global _timeout, _allocators, _stylesheet, _crossrefTransform, _pingDoi
+    global _maxReattemptDelay, _timeout, _poolSize, _idleTimeout, _allocators
+    global _authorizations, _stylesheet, _crossrefTransform, _pingDoi
     global _pingDatacenter, _pingTarget, _schemas
     _enabled = config.get("datacite.enabled").lower() == "true"
     _doiUrl = config.get("datacite.doi_url")
     _metadataUrl = config.get("datacite.metadata_url")
     _numAttempts = int(config.get("datacite.num_attempts"))
     _reattemptDelay = int(config.get("datacite.reattempt_delay"))
+    _maxReattemptDelay = int(config.get("datacite.max_reattempt_delay"))
     _timeout = int(config.get("datacite.timeout"))
+    _poolSize = int(config.get("datacite.connection_pool_size"))
+    _idleTimeout = int(config.get("datacite.connection_idle_timeout"))
     _allocators = {}
     for a in config.get("datacite.allocators").split(","):
         _allocators[a] = config.get("allocator_%s.password" % a)
+    _authorizations = {}
+    _closeConnectionPools()
     _stylesheet = lxml.etree.XSLT(
         lxml.etree.parse(
             os.path.join(django.conf.settings.PROJECT_ROOT, "profiles", "datacite.xsl")
@@ -78,23 +99,102 @@ def loadConfig():
     _pingDoi = config.get("datacite.ping_doi")
     _pingDatacenter = config.get("datacite.ping_datacenter")
     _pingTarget = config.get("datacite.ping_target")
+    poolSize = int(config.get("datacite.schema_validators_per_version"))
     schemas = {}
     for f in os.listdir(os.path.join(django.conf.settings.PROJECT_ROOT, "xsd")):
         m = re.match("datacite-kernel-(.*)", f)
         if m:
-            schemas[m.group(1)] = (
-                lxml.etree.XMLSchema(
-                    lxml.etree.parse(
-                        os.path.join(
-                            django.conf.settings.PROJECT_ROOT, "xsd", f, "metadata.xsd"
-                        )
-                    )
+            schemas[m.group(1)] = _SchemaPool(
+                os.path.join(
+                    django.conf.settings.PROJECT_ROOT, "xsd", f, "metadata.xsd"
                 ),
-                threading.Lock(),
+                poolSize,
             )
     _schemas = schemas
 
 
+class _SchemaPool(object):
+    # A pool of compiled XML schemas for one DataCite schema version.
+    # Despite its claims, an lxml XMLSchema object is not threadsafe, so
+    # each schema in the pool is used by one thread at a time.  Schemas
+    # are compiled from the local xsd tree as needed, up to the pool
+    # size, and are kept for reuse; a thread that finds all schemas in
+    # use and the pool full waits for one to be returned.
+
+    def __init__(self, path, size):
+        self._path = path
+        self._size = size
+        self._cond = threading.Condition()
+        self._free = []
+        self._numCompiled = 0
+        self._numValidations = 0
+        self._numWaits = 0
+        self._waitTime = 0.0
+
+    def acquire(self):
+        self._cond.acquire()
+        try:
+            self._numValidations += 1
+            start = None
+            while len(self._free) == 0 and self._numCompiled >= self._size:
+                if start == None:
+                    self._numWaits += 1
+                    start = time.time()
+                self._cond.wait()
+            if start != None:
+                self._waitTime += time.time() - start
+            if len(self._free) > 0:
+                return self._free.pop()
+            self._numCompiled += 1
+        finally:
+            self._cond.release()
+        try:
+            return lxml.etree.XMLSchema(lxml.etree.parse(self._path))
+        except:
+            self._cond.acquire()
+            try:
+                self._numCompiled -= 1
+                self._cond.notify()
+            finally:
+                self._cond.release()
+            raise
+
+    def release(self, schema):
+        self._cond.acquire()
+        try:
+            self._free.append(schema)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def getStatistics(self):
+        self._cond.acquire()
+        try:
+            return (
+                self._numCompiled,
+                self._numValidations,
+                self._numWaits,
+                self._waitTime,
+            )
+        finally:
+            self._cond.release()
+
+
+def getSchemaPoolStatistics():
+    """
+  Returns a tuple (compiled, validations, waits, waitTime) summed over
+  the XML schemas of all DataCite schema versions: the number of
+  schemas compiled, the number of schema validations performed, the
+  number of validations that had to wait for a schema to become
+  available, and the total time in seconds spent waiting.
+  """
+    totals = [0, 0, 0, 0.0]
+    for pool in _schemas.values():
+        for i, v in enumerate(pool.getStatistics()):
+            totals[i] += v
+    return tuple(totals)
+
+
 def _modifyActiveCount(delta):
     global _numActiveOperations
     _lock.acquire()
@@ -115,27 +215,215 @@ def numActiveOperations():
         _lock.release()
 
 
-class _HTTPErrorProcessor(urllib2.HTTPErrorProcessor):
-    def http_response(self, request, response):
-        # Bizarre that Python considers this an error.
-        if response.code == 201:
-            return response
+class _ConnectionPool(object):
+    # A pool of keep-alive connections to one DataCite endpoint (scheme
+    # and host).  Connections are opened as needed and returned to the
+    # pool after each exchange, so that successive operations do not
+    # each pay for a TCP and TLS handshake.  At most 'size' idle
+    # connections are kept, and a connection that has been idle for
+    # longer than 'idleTimeout' seconds is discarded rather than reused,
+    # as the server has likely closed its end by then.
+
+    def __init__(self, scheme, netloc, size, idleTimeout):
+        self._scheme = scheme
+        self._netloc = netloc
+        self._size = size
+        self._idleTimeout = idleTimeout
+        self._lock = threading.Lock()
+        # List of (connection, releaseTime), most recently released last.
+        self._idle = []
+
+    def acquire(self):
+        # Returns (connection, reused).
+        self._lock.acquire()
+        try:
+            if len(self._idle) > 0:
+                c, t = self._idle.pop()
+                if time.time() - t <= self._idleTimeout:
+                    return c, True
+                # The most recently released connection has expired, and
+                # hence so have all the others.
+                c.close()
+                while len(self._idle) > 0:
+                    self._idle.pop()[0].close()
+        finally:
+            self._lock.release()
+        if self._scheme == "https":
+            return httplib.HTTPSConnection(self._netloc, timeout=_timeout), False
         else:
-            return urllib2.HTTPErrorProcessor.http_response(self, request, response)
+            return httplib.HTTPConnection(self._netloc, timeout=_timeout), False
+
+    def release(self, c):
+        self._lock.acquire()
+        try:
+            if len(self._idle) < self._size:
+                self._idle.append((c, time.time()))
+                return
+        finally:
+            self._lock.release()
+        c.close()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            while len(self._idle) > 0:
+                self._idle.pop()[0].close()
+        finally:
+            self._lock.release()
+
+
+def _getConnectionPool(url):
+    u = urlparse.urlparse(url)
+    _poolsLock.acquire()
+    try:
+        p = _pools.get((u.scheme, u.netloc))
+        if p == None:
+            p = _ConnectionPool(u.scheme, u.netloc, _poolSize, _idleTimeout)
+            _pools[(u.scheme, u.netloc)] = p
+        return p
+    finally:
+        _poolsLock.release()
+
+
+def _closeConnectionPools():
+    _poolsLock.acquire()
+    try:
+        for p in _pools.values():
+            p.close()
+        _pools.clear()
+    finally:
+        _poolsLock.release()
+
+
+def _recordRequest(reused, requestTime):
+    global _numRequests, _numReusedConnections, _requestTime
+    _lock.acquire()
+    try:
+        _numRequests += 1
+        if reused:
+            _numReusedConnections += 1
+        _requestTime += requestTime
+    finally:
+        _lock.release()
+
 
-    https_response = http_response
+def _recordReattempt():
+    global _numReattempts
+    _lock.acquire()
+    try:
+        _numReattempts += 1
+    finally:
+        _lock.release()
+
+
+def getConnectionStatistics():
+    """
+  Returns a tuple (requests, reused, reattempts, requestTime)
+  describing HTTP exchanges with DataCite: the number of exchanges
+  completed, the number of those that reused a pooled connection, the
+  number of operations reattempted following a transient error, and
+  the total time in seconds spent in completed exchanges.
+  """
+    _lock.acquire()
+    try:
+        return (_numRequests, _numReusedConnections, _numReattempts, _requestTime)
+    finally:
+        _lock.release()
+
+
+def _exchange(method, url, headers, body):
+    # Performs one HTTP exchange over a pooled connection and returns
+    # (status, reason, headers, body).  A pooled connection may have
+    # been closed by the server since it was last used, so a failure on
+    # a reused connection is retried at once on a new connection.
+    pool = _getConnectionPool(url)
+    u = urlparse.urlparse(url)
+    path = u.path + ("?" + u.query if u.query != "" else "")
+    while True:
+        c, reused = pool.acquire()
+        start = time.time()
+        try:
+            c.request(method, path, body, headers)
+            r = c.getresponse()
+            s = r.read()
+        except (httplib.HTTPException, socket.error):
+            c.close()
+            if reused:
+                continue
+            raise
+        _recordRequest(reused, time.time() - start)
+        if r.will_close:
+            c.close()
+        else:
+            pool.release(c)
+        return r.status, r.reason, r.msg, s
+
+
+def _reattemptDelayFor(attempt, retryAfter):
+    # Returns the delay in seconds before reattempting after failed
+    # attempt number 'attempt' (1-based).  The delay doubles with each
+    # attempt, up to the maximum, and is jittered so that workers that
+    # failed together do not reattempt together.  A Retry-After header
+    # value, if given in seconds, is honored if it asks for longer.
+    d = min(_reattemptDelay * 2 ** (attempt - 1), _maxReattemptDelay)
+    d = random.uniform(d / 2.0, d)
+    if retryAfter != None and retryAfter.strip().isdigit():
+        d = max(d, min(int(retryAfter), _maxReattemptDelay))
+    return d
+
+
+def _call(method, url, authorization, body=None, contentType=None):
+    # Issues a request to DataCite and returns the body of a successful
+    # (2xx) response; any other response raises urllib2.HTTPError.  We
+    # manually supply the HTTP Basic authorization header to avoid the
+    # doubling of the number of HTTP transactions caused by the
+    # challenge/response model.  To deal with transient problems with
+    # the DataCite service and the Handle system underlying it, network
+    # errors, server errors, and rate limiting responses (429) are
+    # reattempted, up to the configured number of attempts.
+    headers = {"Authorization": authorization}
+    if contentType != None:
+        headers["Content-Type"] = contentType
+    attempt = 0
+    while True:
+        attempt += 1
+        _modifyActiveCount(1)
+        try:
+            status, reason, responseHeaders, s = _exchange(method, url, headers, body)
+        except (httplib.HTTPException, socket.error):
+            if attempt >= _numAttempts:
+                raise
+            retryAfter = None
+        else:
+            if 200 <= status < 300:
+                return s
+            if (status < 500 and status != 429) or attempt >= _numAttempts:
+                raise urllib2.HTTPError(
+                    url, status, reason, responseHeaders, StringIO.StringIO(s)
+                )
+            retryAfter = responseHeaders.get("Retry-After")
+        finally:
+            _modifyActiveCount(-1)
+        _recordReattempt()
+        time.sleep(_reattemptDelayFor(attempt, retryAfter))
 
 
 def _authorization(doi, datacenter=None):
+    # Authorization headers are computed once per datacenter and cached;
+    # the cache is replaced when the configuration is reloaded.
     if datacenter == None:
         s = ezidapp.models.getLongestShoulderMatch("doi:" + doi)
         # Should never happen.
         assert s is not None, "shoulder not found"
         datacenter = s.datacenter.symbol
-    a = datacenter.split(".")[0]
-    p = _allocators.get(a, None)
-    assert p is not None, "no such allocator: " + a
-    return "Basic " + base64.b64encode(datacenter + ":" + p)
+    h = _authorizations.get(datacenter, None)
+    if h == None:
+        a = datacenter.split(".")[0]
+        p = _allocators.get(a, None)
+        assert p is not None, "no such allocator: " + a
+        h = "Basic " + base64.b64encode(datacenter + ":" + p)
+        _authorizations[datacenter] = h
+    return h
 
 
 def registerIdentifier(doi, targetUrl, datacenter=None):
@@ -149,45 +437,23 @@ def registerIdentifier(doi, targetUrl, datacenter=None):
   """
     if not _enabled:
         return None
-    # To deal with transient problems with the Handle system underlying
-    # the DataCite service, we make multiple attempts.
-    for i in range(_numAttempts):
-        o = urllib2.build_opener(_HTTPErrorProcessor)
-        r = urllib2.Request(_doiUrl)
-        # We manually supply the HTTP Basic authorization header to avoid
-        # the doubling of the number of HTTP transactions caused by the
-        # challenge/response model.
-        r.add_header("Authorization", _authorization(doi, datacenter))
-        r.add_header("Content-Type", "text/plain; charset=UTF-8")
-        r.add_data(
+    try:
+        s = _call(
+            "POST",
+            _doiUrl,
+            _authorization(doi, datacenter),
             (
                 "doi=%s\nurl=%s"
                 % (doi.replace("\\", "\\\\"), targetUrl.replace("\\", "\\\\"))
-            ).encode("UTF-8")
+            ).encode("UTF-8"),
+            "text/plain; charset=UTF-8",
         )
-        c = None
-        try:
-            _modifyActiveCount(1)
-            c = o.open(r, timeout=_timeout)
-            assert (
-                c.read() == "OK"
-            ), "unexpected return from DataCite register DOI operation"
-        except urllib2.HTTPError, e:
-            message = e.fp.read()
-            if e.code == 400 and message.startswith("[url]"):
-                return message
-            if e.code != 500 or i == _numAttempts - 1:
-                raise e
-        except:
-            if i == _numAttempts - 1:
-                raise
-        else:
-            break
-        finally:
-            _modifyActiveCount(-1)
-            if c:
-                c.close()
-        time.sleep(_reattemptDelay)
+    except urllib2.HTTPError, e:
+        message = e.fp.read()
+        if e.code == 400 and message.startswith("[url]"):
+            return message
+        raise
+    assert s == "OK", "unexpected return from DataCite register DOI operation"
     return None
 
 
@@ -209,32 +475,14 @@ def getTargetUrl(doi, datacenter=None):
   identifier is not registered.  'datacenter', if specified, should be
   the identifier's datacenter, e.g., "CDL.BUL".
   """
-    # To hide transient network errors, we make multiple attempts.
-    for i in range(_numAttempts):
-        o = urllib2.build_opener(_HTTPErrorProcessor)
-        r = urllib2.Request(_doiUrl + "/" + urllib.quote(doi))
-        # We manually supply the HTTP Basic authorization header to avoid
-        # the doubling of the number of HTTP transactions caused by the
-        # challenge/response model.
-        r.add_header("Authorization", _authorization(doi, datacenter))
-        c = None
-        try:
-            _modifyActiveCount(1)
-            c = o.open(r, timeout=_timeout)
-            return c.read()
-        except urllib2.HTTPError, e:
-            if e.code == 404:
-                return None
-            if e.code != 500 or i == _numAttempts - 1:
-                raise e
-        except:
-            if i == _numAttempts - 1:
-                raise
-        finally:
-            _modifyActiveCount(-1)
-            if c:
-                c.close()
-        time.sleep(_reattemptDelay)
+    try:
+        return _call(
+            "GET", _doiUrl + "/" + urllib.quote(doi), _authorization(doi, datacenter)
+        )
+    except urllib2.HTTPError, e:
+        if e.code == 404:
+            return None
+        raise
 
 
 _prologRE = re.compile(
@@ -310,18 +558,18 @@ def validateDcmsRecord(identifier, record, schemaValidate=True):
     if schemaValidate:
         # We temporarily replace the identifier with something innocuous
         # that will pass the schema's validation check, then change it
-        # back.  Locking lameness: despite its claims, XMLSchema objects
-        # are in fact not threadsafe.
+        # back.  The schema is checked out of the version's pool, as
+        # XMLSchema objects are not threadsafe.
         i.attrib["identifierType"] = "DOI"
         i.text = "10.1234/X"
-        schema[1].acquire()
+        s = schema.acquire()
         try:
-            schema[0].assert_(root)
+            s.assert_(root)
         except Exception, e:
             # Ouch.  On some LXML installations, but not all, an error is
             # "sticky" and, unless it is cleared out, will be returned
             # repeatedly regardless of what new error is encountered.
-            schema[0]._clear_error_log()
+            s._clear_error_log()
             # LXML error messages may contain snippets from the source
             # document, and hence may contain Unicode characters.  We're
             # really not set up to propagate such characters through
@@ -330,7 +578,7 @@ def validateDcmsRecord(identifier, record, schemaValidate=True):
             # exposing them can be a help.
             assert False, e.message.encode("ASCII", "xmlcharrefreplace")
         finally:
-            schema[1].release()
+            schema.release(s)
         i.attrib["identifierType"] = type
     i.text = identifier
     root.attrib["{http://www.w3.org/2001/XMLSchema-instance}schemaLocation"] = (
@@ -494,72 +742,31 @@ def uploadMetadata(doi, current, delta, forceUpload=False, datacenter=None):
         return None
     if not _enabled:
         return None
-    # To hide transient network errors, we make multiple attempts.
-    for i in range(_numAttempts):
-        o = urllib2.build_opener(_HTTPErrorProcessor)
-        r = urllib2.Request(_metadataUrl)
-        # We manually supply the HTTP Basic authorization header to avoid
-        # the doubling of the number of HTTP transactions caused by the
-        # challenge/response model.
-        r.add_header("Authorization", _authorization(doi, datacenter))
-        r.add_header("Content-Type", "application/xml; charset=UTF-8")
-        r.add_data(newRecord.encode("UTF-8"))
-        c = None
-        try:
-            _modifyActiveCount(1)
-            c = o.open(r, timeout=_timeout)
-            s = c.read()
-            assert s.startswith("OK"), (
-                "unexpected return from DataCite store metadata operation: " + s
-            )
-        except urllib2.HTTPError, e:
-            message = e.fp.read()
-            if e.code in [400, 422]:
-                return "element 'datacite': " + message
-            if e.code != 500 or i == _numAttempts - 1:
-                raise e
-        except:
-            if i == _numAttempts - 1:
-                raise
-        else:
-            return None
-        finally:
-            _modifyActiveCount(-1)
-            if c:
-                c.close()
-        time.sleep(_reattemptDelay)
+    try:
+        s = _call(
+            "POST",
+            _metadataUrl,
+            _authorization(doi, datacenter),
+            newRecord.encode("UTF-8"),
+            "application/xml; charset=UTF-8",
+        )
+    except urllib2.HTTPError, e:
+        if e.code in [400, 422]:
+            return "element 'datacite': " + e.fp.read()
+        raise
+    assert s.startswith("OK"), (
+        "unexpected return from DataCite store metadata operation: " + s
+    )
+    return None
 
 
 def _deactivate(doi, datacenter):
-    # To hide transient network errors, we make multiple attempts.
-    for i in range(_numAttempts):
-        o = urllib2.build_opener(_HTTPErrorProcessor)
-        r = urllib2.Request(_metadataUrl + "/" + urllib.quote(doi))
-        # We manually supply the HTTP Basic authorization header to avoid
-        # the doubling of the number of HTTP transactions caused by the
-        # challenge/response model.
-        r.add_header("Authorization", _authorization(doi, datacenter))
-        r.get_method = lambda: "DELETE"
-        c = None
-        try:
-            _modifyActiveCount(1)
-            c = o.open(r, timeout=_timeout)
-            assert (
-                c.read() == "OK"
-            ), "unexpected return from DataCite deactivate DOI operation"
-        except urllib2.HTTPError, e:
-            if e.code != 500 or i == _numAttempts - 1:
-                raise e
-        except:
-            if i == _numAttempts - 1:
-                raise
-        else:
-            break
-        finally:
-            _modifyActiveCount(-1)
-            if c:
-                c.close()
-        time.sleep(_reattemptDelay)
+    s = _call(
+        "DELETE",
+        _metadataUrl + "/" + urllib.quote(doi),
+        _authorization(doi, datacenter),
+    )
+    assert s == "OK", "unexpected return from DataCite deactivate DOI operation"
 
 
 def deactivate(doi, datacenter=None):
@@ -624,29 +831,17 @@ def pingDataciteOnly():
   """
     if not _enabled:
         return "up"
-    # To hide transient network errors, we make multiple attempts.
-    for i in range(_numAttempts):
-        o = urllib2.build_opener(_HTTPErrorProcessor)
-        r = urllib2.Request(_doiUrl + "/" + _pingDoi)
-        # We manually supply the HTTP Basic authorization header to avoid
-        # the doubling of the number of HTTP transactions caused by the
-        # challenge/response model.
-        r.add_header("Authorization", _authorization(_pingDoi, _pingDatacenter))
-        c = None
-        try:
-            _modifyActiveCount(1)
-            c = o.open(r, timeout=_timeout)
-            assert c.read() == _pingTarget
-        except:
-            if i == _numAttempts - 1:
-                return "down"
-        else:
-            return "up"
-        finally:
-            _modifyActiveCount(-1)
-            if c:
-                c.close()
-        time.sleep(_reattemptDelay)
+    try:
+        s = _call(
+            "GET",
+            _doiUrl + "/" + _pingDoi,
+            _authorization(_pingDoi, _pingDatacenter),
+        )
+        assert s == _pingTarget
+    except:
+        return "down"
+    else:
+        return "up"
 
 
 def dcmsRecordToHtml(record):
@@ -665,22 +860,29 @@ def dcmsRecordToHtml(record):
         return None
 
 
-def crossrefToDatacite(record, overrides={}):
+def crossrefToDatacite(record, overrides={}, parseString=True, returnString=True):
     """
   Converts a Crossref Deposit Schema
-  <http://help.crossref.org/deposit_schema> document to a DataCite
-  Metadata Scheme <http://schema.datacite.org/> record.  'overrides'
-  is a dictionary of individual metadata element names (e.g.,
-  "datacite.title") and values that override the conversion values
-  that would normally be drawn from the input document.  Throws an
-  exception on error.
+  <http://help.crossref.org/deposit_schema> document (supplied as a
+  string if 'parseString' is true, or a root lxml.etree.Element object
+  if not) to a DataCite Metadata Scheme <http://schema.datacite.org/>
+  record.  'overrides' is a dictionary of individual metadata element
+  names (e.g., "datacite.title") and values that override the
+  conversion values that would normally be drawn from the input
+  document.  If 'returnString' is true, the record is returned as an
+  unencoded Unicode string; otherwise, a root lxml.etree.Element
+  object is returned.  Throws an exception on error.
   """
     d = {}
     for k, v in overrides.items():
         d[k] = lxml.etree.XSLT.strparam(v)
-    return lxml.etree.tostring(
-        _crossrefTransform(util.parseXmlString(record), **d), encoding=unicode
-    )
+    if parseString:
+        record = util.parseXmlString(record)
+    result = _crossrefTransform(record, **d)
+    if returnString:
+        return lxml.etree.tostring(result, encoding=unicode)
+    else:
+        return result.getroot()
 
 
 _schemaVersionRE = re.compile("{http://datacite\.org/schema/kernel-([^}]*)}resource$")
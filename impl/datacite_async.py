@@ -81,6 +81,12 @@ def _delete(sh, rows, doi, metadata):
     )
 
 
+def _rateLimitKey(identifier, metadata):
+    # DataCite operations are rate limited per allocator, as DataCite
+    # throttles clients individually.
+    return metadata["_d"].split(".")[0]
+
+
 def enqueueIdentifier(identifier, operation, blob):
     """
   Adds an identifier to the DataCite asynchronous processing queue.
@@ -122,4 +128,10 @@ def loadConfig():
             int(config.get("daemons.datacite_processing_error_sleep")),
             _daemonEnabled,
             _threadName,
+            minWorkerThreads=int(config.get("daemons.datacite_min_worker_threads")),
+            rateLimitKeyFunction=_rateLimitKey,
+            rateLimit=float(config.get("daemons.datacite_allocator_rate_limit")),
+            rateLimitBurst=int(
+                config.get("daemons.datacite_allocator_rate_limit_burst")
+            ),
         )
@@ -4,13 +4,37 @@
 #
 # Batch download.
 #
-# Downloads are created by a single daemon thread.  The download
-# creation process is designed to be restartable at any point: if the
-# server is restarted, the current download resumes where it left off.
+# Downloads are created by a pool of worker threads.  A worker claims
+# a request by locking the queue rows and recording its name in the
+# request, and then carries the request through all processing stages.
+# The download creation process is designed to be restartable at any
+# point: if the server is restarted, in-progress downloads resume
+# where they left off.
 #
-# When the server is reloaded, a new daemon thread gets created.  Race
-# conditions exist between the old and new threads while the old
-# thread still exists, but actual conflicts should be very unlikely.
+# To keep large downloads from starving small ones, each request's
+# size is estimated before it is first claimed, and requests estimated
+# to be large are not claimed if that would leave no worker free for
+# small requests.  Also, requests from requestors that have no request
+# in progress are preferred.
+#
+# Identifiers are harvested with the request's constraints applied by
+# the search database, and are written directly to a compressed work
+# file.  The compressed data is a single raw deflate stream wrapped in
+# a gzip or zip container.  Periodically the stream is fully flushed
+# (which leaves it byte-aligned and independent of any preceding data)
+# and synced to disk, and the file size and the running checksum and
+# size of the uncompressed data are recorded in the request; to
+# resume, the file is truncated back to the last such checkpoint and
+# the stream is continued with a fresh compressor.
+#
+# When the server is reloaded, a new generation of worker threads gets
+# created, and claims made by the previous generation become stale.
+# Race conditions exist between the old and new threads while the old
+# threads still exist, but actual conflicts should be very unlikely.
+# Claims made by other server processes, whose generations are
+# unknown to this one, are renewed at every checkpoint and stage
+# transition, and are considered live until they have not been
+# renewed for 'download_claim_timeout' seconds.
 #
 # Author:
 #   Greg Janee <gjanee@ucop.edu>
@@ -24,14 +48,18 @@
 import csv
 import django.conf
 import django.core.mail
+import django.db.models
+import django.db.transaction
 import hashlib
+import operator
 import os
 import os.path
 import re
-import subprocess
+import struct
 import threading
 import time
 import uuid
+import zlib
 
 import anvl
 import config
@@ -47,13 +75,22 @@ _lock = threading.Lock()
 _daemonEnabled = None
 _threadName = None
 _idleSleep = None
-_gzipCommand = None
-_zipCommand = None
+_checkpointInterval = None
+_numWorkers = None
+_largeThreshold = None
+_claimTimeout = None
+_previousGenerations = set()
+
+# Sizes and offsets at or above this limit require ZIP64 extensions.
+_zip64Limit = 0xFFFFFFFF
+# The ID of the extra field that reserves room in the zip local file
+# header for a ZIP64 extra field.  Unknown IDs are ignored by readers.
+_zipPaddingId = 0x5A45
 
 
 def loadConfig():
     global _ezidUrl, _usedFilenames, _daemonEnabled, _threadName, _idleSleep
-    global _gzipCommand, _zipCommand
+    global _checkpointInterval, _numWorkers, _largeThreshold, _claimTimeout
     _ezidUrl = config.get("DEFAULT.ezid_base_url")
     _lock.acquire()
     try:
@@ -67,17 +104,24 @@ def loadConfig():
     finally:
         _lock.release()
     _idleSleep = int(config.get("daemons.download_processing_idle_sleep"))
-    _gzipCommand = config.get("DEFAULT.gzip_command")
-    _zipCommand = config.get("DEFAULT.zip_command")
+    _checkpointInterval = int(config.get("daemons.download_checkpoint_interval"))
+    _numWorkers = int(config.get("daemons.download_num_workers"))
+    _largeThreshold = int(config.get("daemons.download_large_request_threshold"))
+    _claimTimeout = int(config.get("daemons.download_claim_timeout"))
     _daemonEnabled = (
         django.conf.settings.DAEMON_THREADS_ENABLED
         and config.get("daemons.download_enabled").lower() == "true"
     )
     if _daemonEnabled:
+        if _threadName != None:
+            _previousGenerations.add(_threadName)
         _threadName = uuid.uuid1().hex
-        t = threading.Thread(target=_daemonThread, name=_threadName)
-        t.setDaemon(True)
-        t.start()
+        for i in range(_numWorkers):
+            t = threading.Thread(
+                target=_workerThread, name="%s.%d" % (_threadName, i)
+            )
+            t.setDaemon(True)
+            t.start()
 
 
 _formatCode = {
@@ -367,13 +411,21 @@ class _AbortException(Exception):
     pass
 
 
+def _generation(threadName):
+    # Worker thread names have the form generation.index.
+    return threadName.split(".")[0]
+
+
 def _checkAbort():
     # This function provides a handy way to abort processing if the
-    # daemon is disabled or if a new daemon thread is started by a
-    # configuration reload.  It doesn't entirely eliminate potential
-    # race conditions between two daemon threads, but it should make
-    # conflicts very unlikely.
-    if not _daemonEnabled or threading.currentThread().getName() != _threadName:
+    # daemon is disabled or if a new generation of worker threads is
+    # started by a configuration reload.  It doesn't entirely eliminate
+    # potential race conditions between two generations, but it should
+    # make conflicts very unlikely.
+    if (
+        not _daemonEnabled
+        or _generation(threading.currentThread().getName()) != _threadName
+    ):
         raise _AbortException()
 
 
@@ -394,7 +446,7 @@ def _fileSuffix(r):
 
 
 def _path(r, i):
-    # i=1: uncompressed work file
+    # i=1: uncompressed work file (no longer created)
     # i=2: compressed work file
     # i=3: compressed delivery file
     # i=4: request sidecar file
@@ -420,69 +472,243 @@ def _flushFile(f):
     os.fsync(f.fileno())
 
 
+def _dosTimestamp(t):
+    t = time.localtime(t)
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+def _zipMemberName(r):
+    return ("%s.%s" % (r.filename, _formatSuffix[r.format])).encode("UTF-8")
+
+
+def _zipLocalHeader(r, zip64):
+    # The CRC and sizes are not known when the header is written, and
+    # are instead written to a data descriptor following the data.  The
+    # extra field is the same length either way, so that the header can
+    # be rewritten in place once the sizes are known.
+    dosTime, dosDate = _dosTimestamp(r.requestTime)
+    name = _zipMemberName(r)
+    if zip64:
+        version = 45
+        placeholder = 0xFFFFFFFF
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+    else:
+        version = 20
+        placeholder = 0
+        extra = struct.pack("<HH16x", _zipPaddingId, 16)
+    return (
+        struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50,
+            version,
+            0x08,
+            8,
+            dosTime,
+            dosDate,
+            0,
+            placeholder,
+            placeholder,
+            len(name),
+            len(extra),
+        )
+        + name
+        + extra
+    )
+
+
+def _writeContainerHeader(r, f):
+    if r.compression == ezidapp.models.DownloadQueue.GZIP:
+        f.write(struct.pack("<BBBBIBB", 0x1F, 0x8B, 8, 0, r.requestTime, 0, 3))
+    else:
+        f.write(_zipLocalHeader(r, False))
+
+
+def _writeContainerTrailer(r, f, crc, size):
+    if r.compression == ezidapp.models.DownloadQueue.GZIP:
+        f.write(struct.pack("<II", crc, size & 0xFFFFFFFF))
+        return
+    # Data descriptor, central directory, and end of central directory
+    # record.  ZIP64 extensions are used where sizes or offsets
+    # overflow 32 bits; if the sizes do, the local file header is
+    # rewritten to declare them.
+    name = _zipMemberName(r)
+    csize = f.tell() - len(_zipLocalHeader(r, False))
+    if csize >= _zip64Limit or size >= _zip64Limit:
+        end = f.tell()
+        f.seek(0)
+        f.write(_zipLocalHeader(r, True))
+        f.seek(end)
+        f.write(struct.pack("<IIQQ", 0x08074B50, crc, csize, size))
+        version = 45
+        extra = struct.pack("<HHQQ", 1, 16, size, csize)
+        csize = size = 0xFFFFFFFF
+    else:
+        f.write(struct.pack("<IIII", 0x08074B50, crc, csize, size))
+        version = 20
+        extra = ""
+    cdOffset = f.tell()
+    dosTime, dosDate = _dosTimestamp(r.requestTime)
+    cd = (
+        struct.pack(
+            "<IHHHHHHIIIHHHHHII",
+            0x02014B50,
+            (3 << 8) | version,
+            version,
+            0x08,
+            8,
+            dosTime,
+            dosDate,
+            crc,
+            csize,
+            size,
+            len(name),
+            len(extra),
+            0,
+            0,
+            0,
+            0o100644 << 16,
+            0,
+        )
+        + name
+        + extra
+    )
+    f.write(cd)
+    if cdOffset >= _zip64Limit:
+        f.write(
+            struct.pack(
+                "<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, 1, 1, len(cd), cdOffset
+            )
+        )
+        f.write(struct.pack("<IIQI", 0x07064B50, 0, cdOffset + len(cd), 1))
+    f.write(
+        struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, 1, 1, len(cd), min(cdOffset, 0xFFFFFFFF), 0
+        )
+    )
+
+
+class _CompressedFile(object):
+    # A file-like wrapper around the compressed work file that
+    # compresses data as it is written.  tell() returns the size of the
+    # uncompressed data.  See the comment at the top of this module.
+
+    def __init__(self, r, f):
+        self.r = r
+        self.f = f
+        self.crc = r.crc32
+        self.size = r.uncompressedSize
+        self.compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS
+        )
+
+    def write(self, s):
+        if type(s) is unicode:
+            s = s.encode("UTF-8")
+        self.crc = zlib.crc32(s, self.crc) & 0xFFFFFFFF
+        self.size += len(s)
+        self.f.write(self.compressor.compress(s))
+
+    def tell(self):
+        return self.size
+
+    def checkpoint(self):
+        # Records the checkpoint in the request, but does not save it.
+        self.f.write(self.compressor.flush(zlib.Z_FULL_FLUSH))
+        _flushFile(self.f)
+        self.r.fileSize = self.f.tell()
+        self.r.crc32 = self.crc
+        self.r.uncompressedSize = self.size
+        _renewClaim(self.r)
+
+    def finish(self):
+        self.f.write(self.compressor.flush(zlib.Z_FINISH))
+        _writeContainerTrailer(self.r, self.f, self.crc, self.size)
+        _flushFile(self.f)
+
+
 def _createFile(r):
     f = None
     try:
-        f = open(_path(r, 1), "wb")
+        f = open(_path(r, 2), "wb")
+        _writeContainerHeader(r, f)
+        r.crc32 = 0
+        r.uncompressedSize = 0
+        cf = _CompressedFile(r, f)
         if r.format == ezidapp.models.DownloadQueue.CSV:
-            w = csv.writer(f)
+            w = csv.writer(cf)
             w.writerow([_csvEncode(c) for c in _decode(r.columns)])
-            _flushFile(f)
         elif r.format == ezidapp.models.DownloadQueue.XML:
-            f.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<records>")
-            _flushFile(f)
-        # We don't know exactly what the CSV writer wrote, so we must
-        # probe the file to find its size.
-        n = f.tell()
+            cf.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<records>")
+        cf.checkpoint()
     except Exception, e:
         raise _wrapException("error creating file", e)
     else:
         r.stage = ezidapp.models.DownloadQueue.HARVEST
-        r.fileSize = n
         r.save()
     finally:
         if f:
             f.close()
 
 
-def _satisfiesConstraints(id, constraints):
+def _restart(r):
+    # Restarts a request left in progress by a previous version of this
+    # module, which harvested to an uncompressed work file.
+    try:
+        for i in [1, 2]:
+            if os.path.exists(_path(r, i)):
+                os.unlink(_path(r, i))
+    except Exception, e:
+        raise _wrapException("error deleting work file", e)
+    r.stage = ezidapp.models.DownloadQueue.CREATE
+    r.currentIndex = 0
+    r.lastId = ""
+    r.fileSize = None
+    r.save()
+
+
+def _applyConstraints(qs, constraints):
     for k, v in constraints.items():
         if k == "createdAfter":
-            if id.createTime < v:
-                return False
+            qs = qs.filter(createTime__gte=v)
         elif k == "createdBefore":
-            if id.createTime >= v:
-                return False
+            qs = qs.filter(createTime__lt=v)
         elif k == "crossref":
-            if id.isCrossref ^ v:
-                return False
+            q = django.db.models.Q(identifier__startswith="doi:") & ~django.db.models.Q(
+                crossrefStatus=""
+            )
+            qs = qs.filter(q) if v else qs.exclude(q)
         elif k == "datacite":
-            if id.isDatacite ^ v:
-                return False
+            q = django.db.models.Q(identifier__startswith="doi:", crossrefStatus="")
+            qs = qs.filter(q) if v else qs.exclude(q)
         elif k == "exported":
-            if id.exported ^ v:
-                return False
+            qs = qs.filter(exported=v)
         elif k == "permanence":
-            if id.isTest ^ (v == "test"):
-                return False
+            qs = qs.filter(isTest=(v == "test"))
         elif k == "profile":
-            if id.profile.label not in v:
-                return False
+            qs = qs.filter(profile__label__in=v)
         elif k == "status":
-            if id.get_status_display() not in v:
-                return False
+            qs = qs.filter(
+                status__in=[
+                    ezidapp.models.SearchIdentifier.statusDisplayToCode[s] for s in v
+                ]
+            )
         elif k == "type":
-            if id.type not in v:
-                return False
+            qs = qs.filter(
+                reduce(
+                    operator.or_,
+                    [django.db.models.Q(identifier__startswith=(t + ":")) for t in v],
+                )
+            )
         elif k == "updatedAfter":
-            if id.updateTime < v:
-                return False
+            qs = qs.filter(updateTime__gte=v)
         elif k == "updatedBefore":
-            if id.updateTime >= v:
-                return False
+            qs = qs.filter(updateTime__lt=v)
         else:
             assert False, "unhandled case"
-    return True
+    return qs
 
 
 def _prepareMetadata(id, convertTimestamps):
@@ -539,42 +765,73 @@ def _writeXml(f, id, metadata):
     f.write("</record>")
 
 
-def _harvest1(r, f):
-    columns = _decode(r.columns)
-    constraints = _decode(r.constraints)
-    options = _decode(r.options)
+def _identifiers(r, constraints):
+    # Generates the identifiers of the user currently being harvested
+    # that satisfy the request's constraints, starting after the last
+    # identifier processed, as lists of at most 1000 identifiers.
+    lastId = r.lastId
     while True:
         _checkAbort()
-        qs = (
-            ezidapp.models.SearchIdentifier.objects.filter(identifier__gt=r.lastId)
-            .filter(owner__pid=r.toHarvest.split(",")[r.currentIndex])
-            .select_related("owner", "ownergroup", "datacenter", "profile")
-            .order_by("identifier")
+        qs = _applyConstraints(
+            ezidapp.models.SearchIdentifier.objects.filter(identifier__gt=lastId)
+            .filter(owner__pid=r.toHarvest.split(",")[r.currentIndex]),
+            constraints,
+        )
+        ids = list(
+            qs.select_related("owner", "ownergroup", "datacenter", "profile")
+            .defer(
+                "searchableTarget",
+                "searchablePublicationYear",
+                "searchableResourceType",
+                "keywords",
+                "resourceCreatorPrefix",
+                "resourceTitlePrefix",
+                "resourcePublisherPrefix",
+            )
+            .order_by("identifier")[:1000]
         )
-        ids = list(qs[:1000])
         if len(ids) == 0:
             break
+        yield ids
+        lastId = ids[-1].identifier
+
+
+def _harvest1(r, f):
+    columns = _decode(r.columns)
+    constraints = _decode(r.constraints)
+    options = _decode(r.options)
+    n = 0
+    for ids in _identifiers(r, constraints):
         try:
             for id in ids:
                 _checkAbort()
-                if _satisfiesConstraints(id, constraints):
-                    m = _prepareMetadata(id, options["convertTimestamps"])
-                    if r.format == ezidapp.models.DownloadQueue.ANVL:
-                        _writeAnvl(f, id, m)
-                    elif r.format == ezidapp.models.DownloadQueue.CSV:
-                        _writeCsv(f, columns, id, m)
-                    elif r.format == ezidapp.models.DownloadQueue.XML:
-                        _writeXml(f, id, m)
-                    else:
-                        assert False, "unhandled case"
+                m = _prepareMetadata(id, options["convertTimestamps"])
+                if r.format == ezidapp.models.DownloadQueue.ANVL:
+                    _writeAnvl(f, id, m)
+                elif r.format == ezidapp.models.DownloadQueue.CSV:
+                    _writeCsv(f, columns, id, m)
+                elif r.format == ezidapp.models.DownloadQueue.XML:
+                    _writeXml(f, id, m)
+                else:
+                    assert False, "unhandled case"
             _checkAbort()
-            _flushFile(f)
+            n += len(ids)
+            if n < _checkpointInterval:
+                continue
+            f.checkpoint()
         except _AbortException:
             raise
         except Exception, e:
             raise _wrapException("error writing file", e)
         r.lastId = ids[-1].identifier
-        r.fileSize = f.tell()
+        r.save()
+        n = 0
+    if n > 0:
+        try:
+            f.checkpoint()
+        except Exception, e:
+            raise _wrapException("error writing file", e)
+        r.lastId = ids[-1].identifier
         r.save()
 
 
@@ -582,12 +839,13 @@ def _harvest(r):
     f = None
     try:
         try:
-            assert os.path.getsize(_path(r, 1)) >= r.fileSize, "file is short"
-            f = open(_path(r, 1), "r+b")
+            assert os.path.getsize(_path(r, 2)) >= r.fileSize, "file is short"
+            f = open(_path(r, 2), "r+b")
             f.seek(r.fileSize)
             f.truncate()
         except Exception, e:
             raise _wrapException("error re-opening/seeking/truncating file", e)
+        cf = _CompressedFile(r, f)
         start = r.currentIndex
         for i in range(r.currentIndex, len(r.toHarvest.split(","))):
             _checkAbort()
@@ -595,73 +853,21 @@ def _harvest(r):
                 r.currentIndex = i
                 r.lastId = ""
                 r.save()
-            _harvest1(r, f)
+            _harvest1(r, cf)
         _checkAbort()
-        if r.format == ezidapp.models.DownloadQueue.XML:
-            try:
-                f.write("</records>")
-                _flushFile(f)
-            except Exception, e:
-                raise _wrapException("error writing file footer", e)
-        r.stage = ezidapp.models.DownloadQueue.COMPRESS
+        try:
+            if r.format == ezidapp.models.DownloadQueue.XML:
+                cf.write("</records>")
+            cf.finish()
+        except Exception, e:
+            raise _wrapException("error writing file footer", e)
+        r.stage = ezidapp.models.DownloadQueue.MOVE
         r.save()
     finally:
         if f:
             f.close()
 
 
-def _compressFile(r):
-    infile = None
-    outfile = None
-    try:
-        # The compression command may be long-lived, and a new daemon
-        # thread may be created by a server restart or reload while it is
-        # still running, in which case we don't try to kill the old
-        # process, but simply delete its output file and let it die a
-        # natural death.
-        if os.path.exists(_path(r, 2)):
-            os.unlink(_path(r, 2))
-        if r.compression == ezidapp.models.DownloadQueue.GZIP:
-            infile = open(_path(r, 1))
-            outfile = open(_path(r, 2), "w")
-            p = subprocess.Popen(
-                [_gzipCommand],
-                stdin=infile,
-                stdout=outfile,
-                stderr=subprocess.PIPE,
-                close_fds=True,
-                env={},
-            )
-            stderr = p.communicate()[1]
-        else:
-            p = subprocess.Popen(
-                [_zipCommand, "-jq", _path(r, 2), _path(r, 1)],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                close_fds=True,
-                env={},
-            )
-            stderr = p.communicate()[0]
-        _checkAbort()
-        assert p.returncode == 0 and stderr == "", (
-            "compression command returned status code %d, stderr '%s'"
-            % (p.returncode, stderr)
-        )
-    except _AbortException:
-        raise
-    except Exception, e:
-        raise _wrapException("error compressing file", e)
-    else:
-        r.stage = ezidapp.models.DownloadQueue.DELETE
-        r.save()
-    finally:
-        if infile:
-            infile.close()
-        if outfile:
-            outfile.close()
-
-
 def _deleteUncompressedFile(r):
     try:
         if os.path.exists(_path(r, 1)):
@@ -732,7 +938,112 @@ def _notifyRequestor(r):
     r.delete()
 
 
-def _daemonThread():
+def _isClaimed(r):
+    if r.claimant == "":
+        return False
+    g = _generation(r.claimant)
+    if g == _threadName:
+        return True
+    if g in _previousGenerations:
+        return False
+    # The claim was made by another server process.
+    return r.claimTime != None and int(time.time()) - r.claimTime < _claimTimeout
+
+
+def _renewClaim(r):
+    # Records the renewal in the request, but does not save it.
+    r.claimTime = int(time.time())
+
+
+def _estimateSize(toHarvest, constraints):
+    # 'toHarvest' and 'constraints' are as stored in a request.
+    return _applyConstraints(
+        ezidapp.models.SearchIdentifier.objects.filter(
+            owner__pid__in=toHarvest.split(",")
+        ),
+        _decode(constraints),
+    ).count()
+
+
+def _claimNextRequest():
+    # Claims the next request to process and returns it, or returns
+    # None if there is none.  A request whose size has not yet been
+    # estimated is claimed ahead of any other, so that it can be
+    # estimated by the claiming worker (and by that worker only).
+    with django.db.transaction.atomic():
+        rl = list(
+            ezidapp.models.DownloadQueue.objects.select_for_update().order_by("seq")
+        )
+        inProgress = [r for r in rl if _isClaimed(r)]
+        busyRequestors = set(r.requestor for r in inProgress)
+        isLarge = lambda r: (r.estimatedSize or 0) >= _largeThreshold
+        # A large request never takes the last free worker (this worker
+        # being one of the free ones).
+        allowLarge = _numWorkers == 1 or _numWorkers - len(inProgress) > 1
+        candidates = [r for r in rl if not _isClaimed(r)]
+        unestimated = [r for r in candidates if r.estimatedSize == None]
+        if len(unestimated) > 0:
+            candidates = unestimated
+        else:
+            candidates = [r for r in candidates if allowLarge or not isLarge(r)]
+        if len(candidates) == 0:
+            return None
+        candidates.sort(key=lambda r: (r.requestor in busyRequestors, isLarge(r)))
+        r = candidates[0]
+        r.claimant = threading.currentThread().getName()
+        r.claimTime = int(time.time())
+        r.save(update_fields=["claimant", "claimTime"])
+        return r
+
+
+def _claimRequest():
+    # Claims the next request to process, or returns None if there is
+    # none.  Requests are estimated as they are encountered, and
+    # released to be claimed again according to their estimates.
+    while True:
+        _checkAbort()
+        r = _claimNextRequest()
+        if r == None or r.estimatedSize != None:
+            return r
+        try:
+            r.estimatedSize = _estimateSize(r.toHarvest, r.constraints)
+            r.save(update_fields=["estimatedSize"])
+        finally:
+            _releaseRequest(r)
+
+
+def _releaseRequest(r):
+    ezidapp.models.DownloadQueue.objects.filter(
+        seq=r.seq, claimant=threading.currentThread().getName()
+    ).update(claimant="")
+
+
+def _processRequest(r):
+    while True:
+        _checkAbort()
+        # Every stage saves the request (or deletes it).
+        _renewClaim(r)
+        if r.stage == ezidapp.models.DownloadQueue.CREATE:
+            _createFile(r)
+        elif r.stage == ezidapp.models.DownloadQueue.HARVEST:
+            if r.uncompressedSize == None:
+                _restart(r)
+            else:
+                _harvest(r)
+        elif r.stage == ezidapp.models.DownloadQueue.COMPRESS:
+            _restart(r)
+        elif r.stage == ezidapp.models.DownloadQueue.DELETE:
+            _deleteUncompressedFile(r)
+        elif r.stage == ezidapp.models.DownloadQueue.MOVE:
+            _moveCompressedFile(r)
+        elif r.stage == ezidapp.models.DownloadQueue.NOTIFY:
+            _notifyRequestor(r)
+            break
+        else:
+            assert False, "unhandled case"
+
+
+def _workerThread():
     doSleep = True
     while True:
         if doSleep:
@@ -741,29 +1052,17 @@ def _daemonThread():
             time.sleep(_idleSleep)
         try:
             _checkAbort()
-            r = ezidapp.models.DownloadQueue.objects.all().order_by("seq")[:1]
-            if len(r) == 0:
+            r = _claimRequest()
+            if r == None:
                 doSleep = True
                 continue
-            r = r[0]
-            _checkAbort()
-            if r.stage == ezidapp.models.DownloadQueue.CREATE:
-                _createFile(r)
-            elif r.stage == ezidapp.models.DownloadQueue.HARVEST:
-                _harvest(r)
-            elif r.stage == ezidapp.models.DownloadQueue.COMPRESS:
-                _compressFile(r)
-            elif r.stage == ezidapp.models.DownloadQueue.DELETE:
-                _deleteUncompressedFile(r)
-            elif r.stage == ezidapp.models.DownloadQueue.MOVE:
-                _moveCompressedFile(r)
-            elif r.stage == ezidapp.models.DownloadQueue.NOTIFY:
-                _notifyRequestor(r)
-            else:
-                assert False, "unhandled case"
+            try:
+                _processRequest(r)
+            finally:
+                _releaseRequest(r)
             doSleep = False
         except _AbortException:
             break
         except Exception, e:
-            log.otherError("download._daemonThread", e)
+            log.otherError("download._workerThread", e)
             doSleep = True
@@ -14,6 +14,7 @@
 # -----------------------------------------------------------------------------
 import logging
 import threading
+import time
 import uuid
 
 import django.core.exceptions
@@ -22,82 +23,77 @@ import django.db.utils
 
 import config
 import ezidapp.models
+import identifier_lock
 import log
+import mint_reservoir
 import policy
 import util
 import util2
 # import noid_nog
 from nog import minter
+from nog import minter_engine
+from nog import minter_service
 
 _perUserThreadLimit = None
 _perUserThrottle = None
+_residentMinterEnabled = None
+_minterCheckpointInterval = None
+_minterCheckpointMaxAge = None
+_batchMintMaxCount = None
+_batchMintChunkSize = None
+_minterServiceEnabled = None
+_minterServiceSocket = None
+_minterServiceTimeout = None
 
 
 logger = logging.getLogger(__name__)
 
 
 def loadConfig():
-    global _perUserThreadLimit, _perUserThrottle
+    global _perUserThreadLimit, _perUserThrottle, _residentMinterEnabled
+    global _minterCheckpointInterval, _minterCheckpointMaxAge
+    global _batchMintMaxCount, _batchMintChunkSize
+    global _minterServiceEnabled, _minterServiceSocket, _minterServiceTimeout
     _perUserThreadLimit = int(config.get("DEFAULT.max_threads_per_user"))
     _perUserThrottle = int(config.get("DEFAULT.max_concurrent_operations_per_user"))
+    _lockManager.setLimits(_perUserThrottle, _perUserThreadLimit)
+    _batchMintMaxCount = int(config.get("DEFAULT.batch_mint_max_count"))
+    _batchMintChunkSize = int(config.get("DEFAULT.batch_mint_chunk_size"))
+    # Minters held by the resident engine are checkpointed and closed so that
+    # changes to the shoulders are picked up on the next mint.
+    minter_engine.close_engine()
+    _residentMinterEnabled = (
+        config.get("shoulders.minter_resident_enabled").lower() == "true"
+    )
+    _minterCheckpointInterval = int(config.get("shoulders.minter_checkpoint_interval"))
+    _minterCheckpointMaxAge = int(config.get("shoulders.minter_checkpoint_max_age"))
+    _minterServiceEnabled = (
+        config.get("shoulders.minter_service_enabled").lower() == "true"
+    )
+    _minterServiceSocket = config.get("shoulders.minter_service_socket")
+    _minterServiceTimeout = int(config.get("shoulders.minter_service_timeout"))
 
 
-# Simple locking mechanism to ensure that, in a multi-threaded
-# environment, no given identifier is operated on by two threads
-# simultaneously.  Additionally, we enforce a per-user throttle on
-# concurrent operations.  _activeUsers maps local usernames to the
-# number of operations currently being performed by that user.  For
-# status reporting purposes, _waitingUsers similarly maps local
-# usernames to numbers of waiting requests.  If _paused is true, no
-# new locks are granted, but the mechanism otherwise operates
-# normally.
-
-_lockedIdentifiers = set()
-_activeUsers = {}
-_waitingUsers = {}
-_lock = threading.Condition()
-_paused = False
-
-
-def _incrementCount(d, k):
-    d[k] = d.get(k, 0) + 1
+# Locking mechanism to ensure that, in a multi-threaded environment,
+# no given identifier is operated on by two threads simultaneously.
+# Additionally, we enforce a per-user throttle on concurrent
+# operations.  See identifier_lock.py.
 
+_lockManager = identifier_lock.IdentifierLockManager(0, 0)
 
-def _decrementCount(d, k):
-    if d[k] == 1:
-        del d[k]
-    else:
-        d[k] = d[k] - 1
+# Locks serializing minting on each shoulder, keyed by shoulder prefix.
+# Minting inline and refilling a shoulder's reservoir both advance the
+# same minter.
+_minterLocks = {}
+_minterLocksLock = threading.Lock()
 
 
 def _acquireIdentifierLock(identifier, user):
-    _lock.acquire()
-    while (
-        _paused
-        or identifier in _lockedIdentifiers
-        or _activeUsers.get(user, 0) >= _perUserThrottle
-    ):
-        if (
-            _activeUsers.get(user, 0) + _waitingUsers.get(user, 0)
-            >= _perUserThreadLimit
-        ):
-            _lock.release()
-            return False
-        _incrementCount(_waitingUsers, user)
-        _lock.wait()
-        _decrementCount(_waitingUsers, user)
-    _incrementCount(_activeUsers, user)
-    _lockedIdentifiers.add(identifier)
-    _lock.release()
-    return True
+    return _lockManager.acquire(identifier, user)
 
 
 def _releaseIdentifierLock(identifier, user):
-    _lock.acquire()
-    _lockedIdentifiers.remove(identifier)
-    _decrementCount(_activeUsers, user)
-    _lock.notifyAll()
-    _lock.release()
+    _lockManager.release(identifier, user)
 
 
 def getStatus():
@@ -110,11 +106,7 @@ def getStatus():
   numbers of waiting requests.  The boolean flag indicates if the
   server is currently paused.
   """
-    _lock.acquire()
-    try:
-        return (_activeUsers.copy(), _waitingUsers.copy(), _paused)
-    finally:
-        _lock.release()
+    return _lockManager.getStatus()
 
 
 def pause(newValue):
@@ -123,19 +115,15 @@ def pause(newValue):
   value.  If the server is paused, no new identifier locks are granted
   and all requests are forced to wait.
   """
-    global _paused
-    _lock.acquire()
-    try:
-        oldValue = _paused
-        _paused = newValue
-        if not _paused:
-            _lock.notifyAll()
-        return oldValue
-    finally:
-        _lock.release()
+    return _lockManager.pause(newValue)
 
 
 def mintIdentifier(shoulder, user, metadata={}):
+    # Identifiers taken from the shoulder's reservoir have already been
+    # minted, so the shoulder lock is needed only when minting inline.
+    mintedId = mint_reservoir.take(shoulder)
+    if mintedId is not None:
+        return _mintIdentifier(shoulder, user, metadata, mintedId)
     if not _acquireIdentifierLock(
         shoulder + '.shoulder_lock', user.username + '.shoulder_lock'
     ):
@@ -148,13 +136,16 @@ def mintIdentifier(shoulder, user, metadata={}):
         )
 
 
-def _mintIdentifier(shoulder, user, metadata={}):
+def _mintIdentifier(shoulder, user, metadata={}, mintedId=None):
     """
   Mints an identifier under the given qualified shoulder, e.g.,
   "doi:10.5060/".  'user' is the requestor and should be an
   authenticated StoreUser object.  'metadata' should be a dictionary
   of element (name, value) pairs.  If an initial target URL is not
   supplied, the identifier is given a self-referential target URL.
+  If 'mintedId' is supplied, it is used in place of minting a new
+  identifier; it should have been minted ahead of time on the
+  shoulder, as returned by the minter.
   The successful return is a string that includes the canonical,
   qualified form of the new identifier, as in:
 
@@ -204,18 +195,10 @@ def _mintIdentifier(shoulder, user, metadata={}):
             log.badRequest(tid)
             return "error: bad request - shoulder does not support minting"
 
-        identifier = minter.mint_id(shoulder_model)
-        logger.debug('Minter returned identifier: {}'.format(identifier))
-
-        if shoulder_model.prefix.startswith('doi:'):
-            identifier = shoulder_model.prefix + identifier.upper()
-        elif shoulder_model.prefix.startswith('ark:/'):
-            identifier = shoulder_model.prefix + identifier.lower()
-        else:
-            raise False, 'Expected ARK or DOI prefix, not "{}"'.format(
-                shoulder_model.prefix
-            )
-
+        if mintedId is None:
+            mintedId = mintOnShoulder(shoulder_model)[0]
+        logger.debug('Minter returned identifier: {}'.format(mintedId))
+        identifier = _qualifyMintedId(shoulder_model, mintedId)
         logger.debug('Final shoulder + identifier: {}'.format(identifier))
 
     log.success(tid, identifier)
@@ -223,6 +206,221 @@ def _mintIdentifier(shoulder, user, metadata={}):
     return createIdentifier(identifier, user, metadata)
 
 
+def _qualifyMintedId(shoulder_model, mintedId):
+    if shoulder_model.prefix.startswith('doi:'):
+        return shoulder_model.prefix + mintedId.upper()
+    elif shoulder_model.prefix.startswith('ark:/'):
+        return shoulder_model.prefix + mintedId.lower()
+    else:
+        raise False, 'Expected ARK or DOI prefix, not "{}"'.format(
+            shoulder_model.prefix
+        )
+
+
+def batchMintIdentifiers(shoulder, user, count, metadata=None):
+    """
+  Mints 'count' identifiers under the given qualified shoulder, e.g.,
+  "doi:10.5060/", all having the same metadata.  'user' is the
+  requestor and should be an authenticated StoreUser object.
+  'metadata' should be a dictionary of element (name, value) pairs.
+  The identifiers are minted in a single pass of the minter, then
+  stored in chunked transactions.  Unsuccessful returns are strings
+  as in mintIdentifier; in this case no identifier has been stored.
+  The successful return is a list of status strings, one per stored
+  identifier, as returned by mintIdentifier.  If storing fails part
+  way, the list continues with an error string and then, for each
+  identifier that was minted but not stored, a string of the form
+  "unstored: <identifier>"; the identifiers stored before the failure
+  remain valid.
+  """
+    if metadata is None:
+        metadata = {}
+    tid = uuid.uuid1()
+    log.begin(
+        tid,
+        "batchMintIdentifiers",
+        shoulder,
+        user.username,
+        user.pid,
+        user.group.groupname,
+        user.group.pid,
+        str(count),
+        *[a for p in metadata.items() for a in p]
+    )
+    shoulder_model = ezidapp.models.getExactShoulderMatch(shoulder)
+    if shoulder_model is None:
+        log.badRequest(tid)
+        return "error: bad request - no such shoulder"
+    if not shoulder_model.isUuid and shoulder_model.minter == "":
+        log.badRequest(tid)
+        return "error: bad request - shoulder does not support minting"
+    if count < 1 or count > _batchMintMaxCount:
+        log.badRequest(tid)
+        return "error: bad request - count must be between 1 and %d" % (
+            _batchMintMaxCount
+        )
+    if not policy.authorizeCreate(user, shoulder_model.prefix):
+        log.forbidden(tid)
+        return "error: forbidden"
+    if shoulder_model.isUuid:
+        identifiers = ["uuid:" + str(uuid.uuid1()) for _ in range(count)]
+    else:
+        # The shoulder lock is needed only while minting; once the minter
+        # has returned, the identifiers are reserved.
+        if not _acquireIdentifierLock(
+            shoulder + '.shoulder_lock', user.username + '.shoulder_lock'
+        ):
+            log.badRequest(tid)
+            return "error: concurrency limit exceeded"
+        try:
+            identifiers = [
+                _qualifyMintedId(shoulder_model, m)
+                for m in mintOnShoulder(shoulder_model, count)
+            ]
+        except Exception, e:
+            log.error(tid, e)
+            return "error: internal server error"
+        finally:
+            _releaseIdentifierLock(
+                shoulder + '.shoulder_lock', user.username + '.shoulder_lock'
+            )
+    return _storeBatch(tid, identifiers, user, metadata)
+
+
+def _storeBatch(tid, identifiers, user, metadata):
+    # Stores minted identifiers; the return is as described in
+    # batchMintIdentifiers.  Each chunk is committed before its
+    # identifiers are reported as stored.
+    statuses = []
+    try:
+        for i in range(0, len(identifiers), _batchMintChunkSize):
+            siList = [
+                _newStoreIdentifier(identifier, user, metadata)
+                for identifier in identifiers[i : i + _batchMintChunkSize]
+            ]
+            enqueueTime = int(time.time())
+            with django.db.transaction.atomic():
+                ezidapp.models.StoreIdentifier.objects.bulk_create(siList)
+                ezidapp.models.UpdateQueue.objects.bulk_create(
+                    [
+                        ezidapp.models.UpdateQueue(
+                            enqueueTime=enqueueTime,
+                            identifier=si.identifier,
+                            object=si,
+                            operation=ezidapp.models.UpdateQueue.CREATE,
+                        )
+                        for si in siList
+                    ]
+                )
+            for si in siList:
+                if si.isDoi:
+                    statuses.append("success: %s | %s" % (si.identifier, si.arkAlias))
+                else:
+                    statuses.append("success: " + si.identifier)
+    except django.core.exceptions.ValidationError, e:
+        log.badRequest(tid)
+        error = "error: bad request - " + util.formatValidationError(e)
+    except _OwnershipChangeError:
+        log.badRequest(tid)
+        error = "error: bad request - ownership change prohibited"
+    except django.db.utils.IntegrityError as e:
+        logger.error(str(e))
+        log.badRequest(tid)
+        error = "error: bad request - identifier already exists"
+    except Exception, e:
+        log.error(tid, e)
+        error = "error: internal server error"
+    else:
+        log.success(tid, str(len(statuses)))
+        return statuses
+    unstored = identifiers[len(statuses) :]
+    # The minter has already advanced past these identifiers.
+    logger.error(
+        'Batch mint identifiers minted but not stored: {}'.format(" ".join(unstored))
+    )
+    if len(statuses) == 0:
+        return error
+    return statuses + [error] + ["unstored: " + identifier for identifier in unstored]
+
+
+class _OwnershipChangeError(Exception):
+    pass
+
+
+def _newStoreIdentifier(identifier, user, metadata):
+    # Returns a new, validated, unsaved StoreIdentifier as created by
+    # createIdentifier.
+    si = ezidapp.models.StoreIdentifier(
+        identifier=identifier,
+        owner=(None if user == ezidapp.models.AnonymousUser else user),
+    )
+    si.updateFromUntrustedLegacy(metadata, allowRestrictedSettings=user.isSuperuser)
+    _setRegistrationDefaults(si)
+    si.my_full_clean()
+    if si.owner != user:
+        if not policy.authorizeOwnershipChange(user, user, si.owner):
+            raise _OwnershipChangeError()
+    return si
+
+
+def _setRegistrationDefaults(si):
+    if si.isDoi:
+        s = ezidapp.models.getLongestShoulderMatch(si.identifier)
+        # Should never happen.
+        assert s != None, "no matching shoulder found"
+        if s.isDatacite:
+            if si.datacenter == None:
+                si.datacenter = s.datacenter
+        elif s.isCrossref:
+            if not si.isCrossref:
+                if si.isReserved:
+                    si.crossrefStatus = ezidapp.models.StoreIdentifier.CR_RESERVED
+                else:
+                    si.crossrefStatus = ezidapp.models.StoreIdentifier.CR_WORKING
+        else:
+            assert False, "unhandled case"
+
+
+def _getMinterLock(prefix):
+    with _minterLocksLock:
+        if prefix not in _minterLocks:
+            _minterLocks[prefix] = threading.Lock()
+        return _minterLocks[prefix]
+
+
+def mintOnShoulder(shoulder_model, count=1):
+    """
+  Mints 'count' identifiers on the given Shoulder and returns them as
+  a list of strings, as returned by the minter (i.e., without the
+  shoulder).  If the minter service is enabled, minting goes through
+  the service, which batches concurrent requests from all processes;
+  if the service is not running, the minter is opened directly under
+  an exclusive file lock.  Otherwise, minting goes through the
+  resident minter engine if it is enabled.  A minter left with a
+  journal by the engine or the service is likewise opened under the
+  file lock, so that the journal gets replayed.  Minting on any given
+  shoulder is serialized within the process.
+  """
+    bdb_path = ezidapp.models.getMinterPath(shoulder_model)
+    if _minterServiceEnabled:
+        try:
+            return minter_service.mint_by_bdb_path(
+                _minterServiceSocket, bdb_path, count, _minterServiceTimeout
+            )
+        except minter_service.MinterServiceUnavailable, e:
+            logger.warning("Minter service unavailable, minting locally: %s" % e)
+            with _getMinterLock(shoulder_model.prefix):
+                return minter_service.mint_with_file_lock(bdb_path, count)
+    with _getMinterLock(shoulder_model.prefix):
+        if _residentMinterEnabled:
+            return minter_engine.get_engine(
+                _minterCheckpointInterval, _minterCheckpointMaxAge
+            ).mint_by_bdb_path(bdb_path, count)
+        if minter_engine.journal_exists(bdb_path):
+            return minter_service.mint_with_file_lock(bdb_path, count)
+        return list(minter.mint_by_bdb_path(bdb_path, count))
+
+
 def createIdentifier(identifier, user, metadata=None, updateIfExists=False):
     """
   Creates an identifier having the given qualified name, e.g.,
@@ -277,21 +475,7 @@ def createIdentifier(identifier, user, metadata=None, updateIfExists=False):
             owner=(None if user == ezidapp.models.AnonymousUser else user),
         )
         si.updateFromUntrustedLegacy(metadata, allowRestrictedSettings=user.isSuperuser)
-        if si.isDoi:
-            s = ezidapp.models.getLongestShoulderMatch(si.identifier)
-            # Should never happen.
-            assert s != None, "no matching shoulder found"
-            if s.isDatacite:
-                if si.datacenter == None:
-                    si.datacenter = s.datacenter
-            elif s.isCrossref:
-                if not si.isCrossref:
-                    if si.isReserved:
-                        si.crossrefStatus = ezidapp.models.StoreIdentifier.CR_RESERVED
-                    else:
-                        si.crossrefStatus = ezidapp.models.StoreIdentifier.CR_WORKING
-            else:
-                assert False, "unhandled case"
+        _setRegistrationDefaults(si)
         si.my_full_clean()
         if si.owner != user:
             if not policy.authorizeOwnershipChange(user, user, si.owner):
@@ -0,0 +1,215 @@
+# =============================================================================
+#
+# EZID :: identifier_lock.py
+#
+# Identifier lock manager.
+#
+# Ensures that, in a multi-threaded environment, no given identifier
+# is operated on by two threads simultaneously, and enforces a
+# per-user throttle on concurrent operations.  A lock on an identifier
+# is granted only if the identifier is not locked, the user is below
+# the throttle, and the manager is not paused; otherwise the
+# requesting thread waits, unless the user already has too many
+# threads active or waiting, in which case the request is refused.
+#
+# Waiting threads are not woken to re-check their conditions.
+# Instead, each waiter has its own event and sits in two queues: the
+# FIFO queue of its user and the queue of the identifier it wants.
+# When a lock is released, the releasing thread grants the freed user
+# slot to the first waiter in the user's queue whose identifier is not
+# locked, and the freed identifier to the first waiter in the
+# identifier's queue whose user is below the throttle.  Only granted
+# waiters are woken.
+#
+# Identifiers are striped over a number of independently locked
+# tables, and each user's state has its own lock, so that operations
+# by different users on different identifiers do not contend.  Locks
+# are always taken in the order user, then stripe.  A waiter is only
+# granted while holding the locks of both its user and its
+# identifier's stripe, so whichever of two releases that together make
+# a waiter eligible comes last sees the waiter's conditions satisfied.
+#
+# License:
+#   Copyright (c) 2020, Regents of the University of California
+#   http://creativecommons.org/licenses/BSD/
+#
+# -----------------------------------------------------------------------------
+
+import collections
+import threading
+
+
+class _Waiter(object):
+    def __init__(self, identifier, user):
+        self.identifier = identifier
+        self.user = user
+        self.event = threading.Event()
+        self.granted = False
+
+
+class _UserState(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.queue = collections.deque()
+
+
+class _Stripe(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locked = set()
+        # Maps identifiers to deques of waiters.
+        self.waiters = {}
+
+
+class IdentifierLockManager(object):
+    def __init__(self, perUserThrottle, perUserThreadLimit, numStripes=64):
+        self._perUserThrottle = perUserThrottle
+        self._perUserThreadLimit = perUserThreadLimit
+        self._stripes = [_Stripe() for _ in range(numStripes)]
+        self._users = {}
+        self._usersLock = threading.Lock()
+        self._paused = False
+
+    def setLimits(self, perUserThrottle, perUserThreadLimit):
+        """
+    Sets the maximum number of concurrent operations per user and the
+    maximum number of active plus waiting threads per user.
+    """
+        self._perUserThrottle = perUserThrottle
+        self._perUserThreadLimit = perUserThreadLimit
+        self._grantAll()
+
+    def acquire(self, identifier, user):
+        """
+    Locks 'identifier' on behalf of 'user' (a local username), waiting
+    if necessary.  Returns False, without waiting, if the user already
+    has the maximum number of threads active or waiting.
+    """
+        us = self._getUserState(user)
+        s = self._getStripe(identifier)
+        with us.lock:
+            with s.lock:
+                if (
+                    not self._paused
+                    and us.active < self._perUserThrottle
+                    and identifier not in s.locked
+                ):
+                    s.locked.add(identifier)
+                    us.active += 1
+                    return True
+                if us.active + len(us.queue) >= self._perUserThreadLimit:
+                    return False
+                w = _Waiter(identifier, user)
+                s.waiters.setdefault(identifier, collections.deque()).append(w)
+                us.queue.append(w)
+        w.event.wait()
+        return True
+
+    def release(self, identifier, user):
+        """
+    Releases a lock obtained by acquire.
+    """
+        us = self._getUserState(user)
+        s = self._getStripe(identifier)
+        with us.lock:
+            with s.lock:
+                s.locked.remove(identifier)
+                us.active -= 1
+                candidates = list(s.waiters.get(identifier, ()))
+            self._grantUser(us)
+        for w in candidates:
+            if self._tryGrant(w):
+                break
+
+    def getStatus(self):
+        """
+    Returns a tuple (activeUsers, waitingUsers, paused) as described in
+    ezid.getStatus.
+    """
+        with self._usersLock:
+            users = list(self._users.items())
+        activeUsers = {}
+        waitingUsers = {}
+        for user, us in users:
+            with us.lock:
+                if us.active > 0:
+                    activeUsers[user] = us.active
+                if len(us.queue) > 0:
+                    waitingUsers[user] = len(us.queue)
+        return (activeUsers, waitingUsers, self._paused)
+
+    def pause(self, newValue):
+        """
+    Sets or unsets the paused flag and returns the flag's previous
+    value.  While paused, no locks are granted.
+    """
+        oldValue = self._paused
+        self._paused = newValue
+        if newValue:
+            # Wait out grants that started before the flag was set.
+            with self._usersLock:
+                users = list(self._users.values())
+            for us in users:
+                with us.lock:
+                    pass
+        else:
+            self._grantAll()
+        return oldValue
+
+    def _getUserState(self, user):
+        us = self._users.get(user)
+        if us is None:
+            with self._usersLock:
+                us = self._users.get(user)
+                if us is None:
+                    us = self._users[user] = _UserState()
+        return us
+
+    def _getStripe(self, identifier):
+        return self._stripes[hash(identifier) % len(self._stripes)]
+
+    def _grant(self, w, us, s):
+        # Requires the locks of both the waiter's user and stripe.
+        us.queue.remove(w)
+        q = s.waiters[w.identifier]
+        q.remove(w)
+        if len(q) == 0:
+            del s.waiters[w.identifier]
+        s.locked.add(w.identifier)
+        us.active += 1
+        w.granted = True
+        w.event.set()
+
+    def _grantUser(self, us):
+        # Grants free slots of a user to the user's first waiters whose
+        # identifiers are not locked.  Requires the user's lock.
+        for w in list(us.queue):
+            if self._paused or us.active >= self._perUserThrottle:
+                break
+            s = self._getStripe(w.identifier)
+            with s.lock:
+                if w.identifier not in s.locked:
+                    self._grant(w, us, s)
+
+    def _tryGrant(self, w):
+        # Grants a waiter its identifier if the waiter is eligible.
+        # Returns True if the identifier is no longer available to other
+        # waiters.
+        us = self._getUserState(w.user)
+        s = self._getStripe(w.identifier)
+        with us.lock:
+            with s.lock:
+                if w.granted or w.identifier in s.locked:
+                    return True
+                if self._paused or us.active >= self._perUserThrottle:
+                    return False
+                self._grant(w, us, s)
+                return True
+
+    def _grantAll(self):
+        with self._usersLock:
+            users = list(self._users.values())
+        for us in users:
+            with us.lock:
+                self._grantUser(us)
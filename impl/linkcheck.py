@@ -0,0 +1,514 @@
+# =============================================================================
+#
+# EZID :: linkcheck.py
+#
+# Daemon that checks EZID target URLs.  This is an in-server
+# alternative to the standalone link checker (tools/link-checker) and
+# follows the same design: the link checker table is periodically
+# updated from the search database; between table updates, limited
+# worksets consisting of the least recently checked links of each
+# owner are loaded and checked; and failed links are given priority
+# and rechecked sooner than good links.  Results are incorporated back
+# into the main EZID tables by linkcheck_update.py.
+#
+# Links are checked by a bounded pool of worker threads that visit
+# owners round-robin, so that an owner having many identifiers does
+# not delay the checks of other owners.  Politeness limits apply both
+# per owner and per host: at most one check against a given host is
+# in progress at any time, and successive checks against the same
+# owner, and against the same host, are separated by minimum
+# intervals.  Resources are read in chunks, up to a maximum number of
+# bytes, and are hashed as they are read.
+#
+# The standalone link checker's exclusion file is not supported; the
+# daemon should not be enabled while the standalone link checker is
+# running.
+#
+# This module should be imported at server startup so that its daemon
+# thread is started.
+#
+# License:
+#   Copyright (c) 2020, Regents of the University of California
+#   http://creativecommons.org/licenses/BSD/
+#
+# -----------------------------------------------------------------------------
+
+import cookielib
+import django.conf
+import django.db
+import hashlib
+import httplib
+import re
+import threading
+import time
+import urllib2
+import urlparse
+import uuid
+
+import config
+import ezidapp.models
+import log
+import util
+
+_enabled = None
+_threadName = None
+_tableUpdateCycle = None
+_goodRecheckMinInterval = None
+_badRecheckMinInterval = None
+_ownerRevisitMinInterval = None
+_hostRevisitMinInterval = None
+_numWorkers = None
+_worksetOwnerMaxLinks = None
+_checkTimeout = None
+_userAgent = None
+_maxRead = None
+
+_readChunkSize = 65536
+
+_statisticsLock = threading.Lock()
+_numChecked = 0
+_roundTime = 0.0
+
+
+class _OwnerWorkset(object):
+    # Links to check that belong to a single owner, in the order in
+    # which they are to be checked.  'nextIndex' points to the next
+    # unchecked link; while that link is being checked, 'isLocked' is
+    # True.  'lastCheckTime' is the time a check of one of the owner's
+    # links last completed.
+    def __init__(self, owner_id, links):
+        self.owner_id = owner_id
+        self.links = links
+        self.nextIndex = 0
+        self.isLocked = False
+        self.lastCheckTime = 0.0
+
+    def isFinished(self):
+        return self.nextIndex >= len(self.links)
+
+
+def _host(url):
+    try:
+        return urlparse.urlsplit(url).netloc.lower()
+    except Exception:
+        return ""
+
+
+class _Workset(object):
+    # A round of links to check, grouped by owner.  Worker threads
+    # repeatedly call getNextLink and, having checked the link
+    # returned, markLinkChecked.  Owners are visited round-robin; an
+    # owner is skipped while one of its links is being checked,
+    # within 'ownerRevisitInterval' seconds of its last check, or if
+    # the host of its next link is busy, i.e., if a check against that
+    # host is in progress or completed within 'hostRevisitInterval'
+    # seconds.
+
+    def __init__(self, ownerWorksets, ownerRevisitInterval, hostRevisitInterval):
+        self.ownerWorksets = ownerWorksets
+        self.ownerRevisitInterval = ownerRevisitInterval
+        self.hostRevisitInterval = hostRevisitInterval
+        self.busyHosts = set()
+        self.hostCheckTimes = {}
+        self.isStopped = False
+        self.condition = threading.Condition()
+
+    def numChecked(self):
+        return sum(ow.nextIndex for ow in self.ownerWorksets)
+
+    def stop(self):
+        self.condition.acquire()
+        try:
+            self.isStopped = True
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def _findNextLink(self, now):
+        # Returns (owner workset, link); or, if no link can be checked
+        # now, the number of seconds until one might be, 0 meaning that
+        # all remaining links are blocked by checks in progress; or None
+        # if all links have been checked.  Of the owners whose next
+        # links can be checked now, the owner that has waited longest
+        # goes first, which amounts to visiting owners round-robin.
+        best = None
+        wait = None
+        isFinished = True
+        for ow in self.ownerWorksets:
+            if ow.isFinished():
+                continue
+            isFinished = False
+            if ow.isLocked:
+                continue
+            if best is not None and ow.lastCheckTime >= best.lastCheckTime:
+                continue
+            h = _host(ow.links[ow.nextIndex].target)
+            if h in self.busyHosts:
+                continue
+            t = max(
+                ow.lastCheckTime + self.ownerRevisitInterval,
+                self.hostCheckTimes.get(h, 0) + self.hostRevisitInterval,
+            )
+            if t <= now:
+                best = ow
+            elif wait is None or t - now < wait:
+                wait = t - now
+        if best is not None:
+            return (best, best.links[best.nextIndex])
+        elif isFinished:
+            return None
+        else:
+            return wait or 0
+
+    def getNextLink(self):
+        """
+    Returns the next (owner workset, link) to check, waiting as
+    necessary, or None if all links have been checked or if the
+    workset has been stopped.
+    """
+        self.condition.acquire()
+        try:
+            while not self.isStopped:
+                r = self._findNextLink(time.time())
+                if r is None:
+                    return None
+                elif type(r) is tuple:
+                    ow, lc = r
+                    ow.isLocked = True
+                    self.busyHosts.add(_host(lc.target))
+                    return r
+                else:
+                    # Waiting threads are notified as checks complete.
+                    self.condition.wait(r if r > 0 else None)
+            return None
+        finally:
+            self.condition.release()
+
+    def markLinkChecked(self, ow, lc):
+        self.condition.acquire()
+        try:
+            now = time.time()
+            h = _host(lc.target)
+            self.busyHosts.discard(h)
+            self.hostCheckTimes[h] = now
+            ow.nextIndex += 1
+            ow.lastCheckTime = now
+            ow.isLocked = False
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+
+# We're a little conflicted as to how to deal with 401 (unauthorized)
+# and 403 (forbidden) errors.  As in the standalone link checker, we
+# consider them to be successes: *something* was at the URL, and
+# presumably with appropriate credentials the identified object would
+# have been returned.
+
+
+class _HTTPErrorProcessor(urllib2.HTTPErrorProcessor):
+    def http_response(self, request, response):
+        if response.code in [401, 403]:
+            return response
+        else:
+            return urllib2.HTTPErrorProcessor.http_response(self, request, response)
+
+    https_response = http_response
+
+
+def _checkLink(lc):
+    # Checks a link by performing a GET request on its target URL, and
+    # records the outcome in LinkChecker object 'lc' (which is not
+    # saved).  The returned resource is read in chunks, up to
+    # 'linkchecker.max_read' bytes, and its size and hash are computed
+    # as it is read.
+    # Some websites fall into infinite redirect loops if cookies are
+    # not utilized.
+    o = urllib2.build_opener(
+        urllib2.HTTPCookieProcessor(cookielib.CookieJar()), _HTTPErrorProcessor()
+    )
+    c = None
+    mimeType = "unknown"
+    md5 = hashlib.md5()
+    size = 0
+    tail = ""
+    try:
+        # urllib2 fails if the URL contains Unicode characters; encoding
+        # the URL as UTF-8 is sufficient.  Some websites require an
+        # Accept header.
+        c = o.open(
+            urllib2.Request(
+                lc.target.encode("UTF-8"),
+                headers={"User-Agent": _userAgent, "Accept": "*/*"},
+            ),
+            timeout=_checkTimeout,
+        )
+        mimeType = c.info().get("Content-Type", "unknown")
+        while _maxRead < 0 or size < _maxRead:
+            n = _readChunkSize
+            if _maxRead >= 0:
+                n = min(n, _maxRead - size)
+            try:
+                chunk = c.read(n)
+            except httplib.IncompleteRead, e:
+                md5.update(e.partial)
+                size += len(e.partial)
+                tail = (tail + e.partial)[-_readChunkSize:]
+                raise
+            if len(chunk) == 0:
+                break
+            md5.update(chunk)
+            size += len(chunk)
+            tail = (tail + chunk)[-_readChunkSize:]
+    except httplib.IncompleteRead, e:
+        # Some servers deliver a complete HTML document, but, apparently
+        # expecting further requests from a web browser that never
+        # arrive, hold the connection open and ultimately deliver a read
+        # failure.  We consider these cases successes.
+        if mimeType.startswith("text/html") and re.search(
+            "</\s*html\s*>\s*$", tail, re.I
+        ):
+            success = True
+        else:
+            success = False
+            returnCode = -1
+    except urllib2.HTTPError, e:
+        success = False
+        returnCode = e.code
+    except Exception, e:
+        success = False
+        returnCode = -1
+    else:
+        success = True
+    finally:
+        if c:
+            c.close()
+    if success:
+        lc.checkSucceededStreamed(mimeType, size, md5.hexdigest())
+    elif returnCode >= 0:
+        lc.checkFailed(returnCode)
+    else:
+        lc.checkFailed(returnCode, util.formatException(e))
+
+
+def _checkAndSaveLink(lc):
+    _checkLink(lc)
+    lc.full_clean(validate_unique=False)
+    lc.save()
+
+
+def _checkContinue(threadName):
+    return _enabled and threadName.split(".")[0] == _threadName
+
+
+def _worker(workset, check, threadName):
+    try:
+        while _checkContinue(threadName):
+            r = workset.getNextLink()
+            if r is None:
+                break
+            ow, lc = r
+            try:
+                check(lc)
+            finally:
+                workset.markLinkChecked(ow, lc)
+    except Exception, e:
+        log.otherError("linkcheck._worker", e)
+        workset.stop()
+    finally:
+        django.db.connections["search"].close()
+
+
+def _processWorkset(workset, check=_checkAndSaveLink, timeout=None):
+    # Checks the links in 'workset' using 'linkchecker.num_workers'
+    # worker threads, each of which applies function 'check' to links.
+    # If processing takes longer than 'timeout' seconds, it is stopped.
+    threadName = threading.currentThread().getName()
+    threads = []
+    for i in range(_numWorkers):
+        n = "%s.%d" % (threadName, i)
+        t = threading.Thread(target=_worker, args=(workset, check, n), name=n)
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+    if timeout is not None:
+        threads[0].join(timeout)
+        workset.stop()
+    for t in threads:
+        t.join()
+
+
+def _loadWorkset():
+    # Loads a workset consisting of, for each owner, its least recently
+    # checked links that are due to be rechecked: previously failed
+    # links first, then unvisited and good links.  Each query is
+    # satisfied by the (owner_id, isBad, lastCheckTime) index.
+    now = int(time.time())
+
+    def query(owner_id, isBad, timeBound, limit):
+        return list(
+            ezidapp.models.LinkChecker.objects.filter(
+                owner_id=owner_id, isBad=isBad, lastCheckTime__lt=timeBound
+            ).order_by("lastCheckTime")[:limit]
+        )
+
+    l = []
+    for owner_id in (
+        ezidapp.models.LinkChecker.objects.order_by("owner_id")
+        .values_list("owner_id", flat=True)
+        .distinct()
+    ):
+        links = query(
+            owner_id, True, now - _badRecheckMinInterval, _worksetOwnerMaxLinks
+        )
+        if len(links) < _worksetOwnerMaxLinks:
+            links.extend(
+                query(
+                    owner_id,
+                    False,
+                    now - _goodRecheckMinInterval,
+                    _worksetOwnerMaxLinks - len(links),
+                )
+            )
+        if len(links) > 0:
+            l.append(_OwnerWorkset(owner_id, links))
+    return _Workset(l, _ownerRevisitMinInterval, _hostRevisitMinInterval)
+
+
+def _harvest(model, only=None, filter=None):
+    lastIdentifier = ""
+    while True:
+        qs = model.objects.filter(identifier__gt=lastIdentifier).order_by("identifier")
+        if only != None:
+            qs = qs.only(*only)
+        qs = list(qs[:1000])
+        if len(qs) == 0:
+            break
+        for o in qs:
+            if filter == None or filter(o):
+                yield o
+        lastIdentifier = qs[-1].identifier
+    yield None
+
+
+def _updateTable(checkContinue):
+    # Updates the link checker table from the search database: adds
+    # public, real identifiers having non-default target URLs; removes
+    # identifiers that no longer qualify; and resets the history of
+    # identifiers whose owners or target URLs have changed.
+    lcGenerator = _harvest(ezidapp.models.LinkChecker)
+    siGenerator = _harvest(
+        ezidapp.models.SearchIdentifier,
+        ["identifier", "owner", "status", "target", "isTest"],
+        lambda si: si.isPublic and not si.isTest and si.target != si.defaultTarget,
+    )
+    lc = lcGenerator.next()
+    si = siGenerator.next()
+    while (lc != None or si != None) and checkContinue():
+        if lc != None and (si == None or lc.identifier < si.identifier):
+            lc.delete()
+            lc = lcGenerator.next()
+        elif si != None and (lc == None or si.identifier < lc.identifier):
+            nlc = ezidapp.models.LinkChecker(
+                identifier=si.identifier, target=si.target, owner_id=si.owner_id
+            )
+            nlc.full_clean(validate_unique=False)
+            nlc.save()
+            si = siGenerator.next()
+        else:
+            if lc.owner_id != si.owner_id or lc.target != si.target:
+                lc.owner_id = si.owner_id
+                lc.target = si.target
+                lc.clearHistory()
+                lc.full_clean(validate_unique=False)
+                lc.save()
+            lc = lcGenerator.next()
+            si = siGenerator.next()
+
+
+def _setStatistics(numChecked, roundTime):
+    global _numChecked, _roundTime
+    _statisticsLock.acquire()
+    try:
+        _numChecked = numChecked
+        _roundTime = roundTime
+    finally:
+        _statisticsLock.release()
+
+
+def getStatistics():
+    """
+  Returns a tuple (number of links checked, elapsed time in seconds)
+  describing the link checker daemon's most recent round of checking.
+  """
+    _statisticsLock.acquire()
+    try:
+        return (_numChecked, _roundTime)
+    finally:
+        _statisticsLock.release()
+
+
+def _linkcheckDaemon():
+    threadName = threading.currentThread().getName()
+    checkContinue = lambda: _checkContinue(threadName)
+    # We arbitrarily sleep 10 minutes to avoid putting a burden on the
+    # server near startup or reload.
+    time.sleep(600)
+    lastTableUpdate = 0
+    while checkContinue():
+        try:
+            if time.time() - lastTableUpdate >= _tableUpdateCycle:
+                lastTableUpdate = time.time()
+                _updateTable(checkContinue)
+            workset = _loadWorkset()
+            if len(workset.ownerWorksets) > 0:
+                # So that owners whose every check runs to the timeout
+                # limit do not hold up other owners' worksets for long,
+                # a round is allotted the time needed to process a
+                # nominal workset, i.e., an owner's maximum number of
+                # links, each checkable in 1 second.
+                start = time.time()
+                _processWorkset(
+                    workset,
+                    timeout=min(
+                        max(_tableUpdateCycle - (start - lastTableUpdate), 0),
+                        _worksetOwnerMaxLinks * (1 + _ownerRevisitMinInterval),
+                    ),
+                )
+                _setStatistics(workset.numChecked(), time.time() - start)
+            else:
+                time.sleep(60)
+        except Exception, e:
+            log.otherError("linkcheck._linkcheckDaemon", e)
+            time.sleep(60)
+        finally:
+            django.db.connections["search"].close()
+
+
+def loadConfig():
+    global _enabled, _threadName, _tableUpdateCycle, _goodRecheckMinInterval
+    global _badRecheckMinInterval, _ownerRevisitMinInterval, _hostRevisitMinInterval
+    global _numWorkers, _worksetOwnerMaxLinks, _checkTimeout, _userAgent, _maxRead
+    _enabled = (
+        django.conf.settings.DAEMON_THREADS_ENABLED
+        and config.get("daemons.linkcheck_enabled").lower() == "true"
+    )
+    _tableUpdateCycle = int(config.get("linkchecker.table_update_cycle"))
+    _goodRecheckMinInterval = int(config.get("linkchecker.good_recheck_min_interval"))
+    _badRecheckMinInterval = int(config.get("linkchecker.bad_recheck_min_interval"))
+    _ownerRevisitMinInterval = int(
+        config.get("linkchecker.owner_revisit_min_interval")
+    )
+    _hostRevisitMinInterval = float(
+        config.get("linkchecker.host_revisit_min_interval")
+    )
+    _numWorkers = int(config.get("linkchecker.num_workers"))
+    _worksetOwnerMaxLinks = int(config.get("linkchecker.workset_owner_max_links"))
+    _checkTimeout = int(config.get("linkchecker.check_timeout"))
+    _userAgent = config.get("linkchecker.user_agent")
+    _maxRead = int(config.get("linkchecker.max_read"))
+    if _enabled:
+        _threadName = uuid.uuid1().hex
+        t = threading.Thread(target=_linkcheckDaemon, name=_threadName)
+        t.setDaemon(True)
+        t.start()
@@ -5,6 +5,14 @@
 # Daemon that periodically pulls link checker results into the main
 # EZID tables.
 #
+# If incremental updating is enabled, each run considers only the link
+# checker rows saved since the previous run (per the rows' updateTime
+# field), and the full comparison of the link checker table against
+# the search database is run only once every so many days, as a
+# reconciliation.  The latter is still necessary because rows deleted
+# from the link checker table leave no trace.  In both cases changes
+# are applied to the search database with set-based bulk updates.
+#
 # This module should be imported at server startup so that its daemon
 # thread is started.
 #
@@ -28,12 +36,17 @@ import uuid
 import config
 import ezidapp.models
 import log
+import search_util
 
 _enabled = None
 _resultsUploadCycle = None
 _resultsUploadSameTimeOfDay = None
 _notificationThreshold = None
 _threadName = None
+_incremental = None
+_reconcileCycle = None
+
+_bulkUpdateSize = 1000
 
 
 def _sameTimeOfDayDelta():
@@ -61,7 +74,100 @@ def _harvest(model, only=None, filter=None):
     yield None
 
 
+def _applyChanges(broken, unbroken):
+    # Sets linkIsBroken for the identifiers in 'broken' and clears it
+    # for those in 'unbroken', in both cases updating hasIssues to
+    # match.  N.B.: the querysets below restate
+    # SearchIdentifier.computeHasIssues and must be kept in agreement
+    # with it.  Only identifiers
+    # whose linkIsBroken values actually change are updated.
+    # Identifiers that no longer exist are ignored.  Returns the number
+    # of identifiers updated.
+    n = 0
+    si = ezidapp.models.SearchIdentifier
+    for k in range(0, len(broken), _bulkUpdateSize):
+        with django.db.transaction.atomic(using="search"):
+            n += si.objects.filter(
+                identifier__in=broken[k : k + _bulkUpdateSize], linkIsBroken=False
+            ).update(linkIsBroken=True, hasIssues=True)
+    for k in range(0, len(unbroken), _bulkUpdateSize):
+        with django.db.transaction.atomic(using="search"):
+            q = si.objects.filter(
+                identifier__in=unbroken[k : k + _bulkUpdateSize], linkIsBroken=True
+            )
+            # Identifiers having no other issues...
+            n += (
+                q.filter(hasMetadata=True)
+                .exclude(crossrefStatus__in=[si.CR_WARNING, si.CR_FAILURE])
+                .update(linkIsBroken=False, hasIssues=False)
+            )
+            # ...and the rest.
+            n += q.update(linkIsBroken=False)
+    if n > 0:
+        search_util.noteSearchDatabaseUpdate()
+    return n
+
+
+def _isBroken(lc):
+    return lc.numFailures >= _notificationThreshold
+
+
+def _reconcile(checkContinue):
+    # Compares every search database identifier against the link
+    # checker table.  An identifier's link is broken if and only if the
+    # identifier has a link checker row having a notification-worthy
+    # number of failures.
+    broken = []
+    unbroken = []
+    siGenerator = _harvest(
+        ezidapp.models.SearchIdentifier, ["identifier", "linkIsBroken"]
+    )
+    lcGenerator = _harvest(
+        ezidapp.models.LinkChecker, ["identifier", "numFailures"], _isBroken
+    )
+    si = siGenerator.next()
+    lc = lcGenerator.next()
+    while si != None and checkContinue():
+        while lc != None and lc.identifier < si.identifier:
+            lc = lcGenerator.next()
+        if lc == None or lc.identifier > si.identifier:
+            if si.linkIsBroken:
+                unbroken.append(si.identifier)
+        else:
+            if not si.linkIsBroken:
+                broken.append(si.identifier)
+            lc = lcGenerator.next()
+        si = siGenerator.next()
+    if checkContinue():
+        _applyChanges(broken, unbroken)
+
+
+def _updateIncrementally(since, checkContinue):
+    # Propagates the results of link checker rows saved at or after
+    # time 'since'.
+    broken = []
+    unbroken = []
+    lastId = 0
+    while checkContinue():
+        l = list(
+            ezidapp.models.LinkChecker.objects.filter(
+                updateTime__gte=since, id__gt=lastId
+            )
+            .order_by("id")
+            .only("id", "identifier", "numFailures")[:_bulkUpdateSize]
+        )
+        if len(l) == 0:
+            break
+        for lc in l:
+            (broken if _isBroken(lc) else unbroken).append(lc.identifier)
+        lastId = l[-1].id
+    if checkContinue():
+        _applyChanges(broken, unbroken)
+
+
 def _linkcheckUpdateDaemon():
+    threadName = threading.currentThread().getName()
+    checkContinue = lambda: _enabled and threadName == _threadName
     if _resultsUploadSameTimeOfDay:
         django.db.connections["search"].close()
         time.sleep(_sameTimeOfDayDelta())
@@ -69,53 +175,26 @@ def _linkcheckUpdateDaemon():
         # We arbitrarily sleep 10 minutes to avoid putting a burden on the
         # server near startup or reload.
         time.sleep(600)
-    while _enabled and threading.currentThread().getName() == _threadName:
+    lastRun = None
+    lastReconcile = None
+    while checkContinue():
         start = time.time()
         try:
-            siGenerator = _harvest(
-                ezidapp.models.SearchIdentifier, ["identifier", "linkIsBroken"]
-            )
-            lcGenerator = _harvest(
-                ezidapp.models.LinkChecker,
-                ["identifier", "numFailures"],
-                lambda lc: lc.numFailures >= _notificationThreshold,
-            )
-            si = siGenerator.next()
-            lc = lcGenerator.next()
-            while (
-                si != None
-                and _enabled
-                and threading.currentThread().getName() == _threadName
+            # Rows saved while a run is in progress may or may not be
+            # seen by the run, so the next run starts from this run's
+            # start time.
+            if (
+                _incremental
+                and lastReconcile != None
+                and start - lastReconcile < _reconcileCycle
             ):
-                while lc != None and lc.identifier < si.identifier:
-                    lc = lcGenerator.next()
-                newValue = None
-                if lc == None or lc.identifier > si.identifier:
-                    if si.linkIsBroken:
-                        newValue = False
-                else:
-                    if not si.linkIsBroken:
-                        newValue = True
-                    lc = lcGenerator.next()
-                if newValue != None:
-                    # Before updating the SearchIdentifier, we carefully lock
-                    # the table and ensure that the object still exists.
-                    try:
-                        with django.db.transaction.atomic(using="search"):
-                            si2 = ezidapp.models.SearchIdentifier.objects.get(
-                                identifier=si.identifier
-                            )
-                            si2.linkIsBroken = newValue
-                            si2.computeHasIssues()
-                            si2.save(update_fields=["linkIsBroken", "hasIssues"])
-                    except ezidapp.models.SearchIdentifier.DoesNotExist:
-                        pass
-                si = siGenerator.next()
+                _updateIncrementally(int(lastRun), checkContinue)
+            else:
+                _reconcile(checkContinue)
+                lastReconcile = start
+            lastRun = start
         except Exception, e:
             log.otherError("linkcheck_update._linkcheckUpdateDaemon", e)
-        # Since we're going to be sleeping for potentially a long time,
-        # release any memory held.
-        siGenerator = lcGenerator = si = lc = si2 = None
         django.db.connections["search"].close()
         if _resultsUploadSameTimeOfDay:
             time.sleep(_sameTimeOfDayDelta())
@@ -125,7 +204,7 @@ def _linkcheckUpdateDaemon():
 
 def loadConfig():
     global _enabled, _resultsUploadCycle, _resultsUploadSameTimeOfDay
-    global _notificationThreshold, _threadName
+    global _notificationThreshold, _threadName, _incremental, _reconcileCycle
     _enabled = (
         django.conf.settings.DAEMON_THREADS_ENABLED
         and config.get("daemons.linkcheck_update_enabled").lower() == "true"
@@ -136,6 +215,10 @@ def loadConfig():
             config.get("linkchecker.results_upload_same_time_of_day").lower() == "true"
         )
         _notificationThreshold = int(config.get("linkchecker.notification_threshold"))
+        _incremental = (
+            config.get("linkchecker.results_upload_incremental").lower() == "true"
+        )
+        _reconcileCycle = int(config.get("linkchecker.results_reconcile_cycle"))
         _threadName = uuid.uuid1().hex
         t = threading.Thread(target=_linkcheckUpdateDaemon, name=_threadName)
         t.setDaemon(True)
@@ -171,59 +171,76 @@ def _text(n):
         return None
 
 
-def _mapDatacite(metadata):
+def _parse(metadata, key, parsedXml):
+    # Returns the parsed XML document in field 'key', caching it in
+    # 'parsedXml' if that is not None.
+    if parsedXml == None:
+        return util.parseXmlString(_get(metadata, key))
+    if key not in parsedXml:
+        parsedXml[key] = util.parseXmlString(_get(metadata, key))
+    return parsedXml[key]
+
+
+def _mapDataciteTree(root):
+    m = _rootTagRE.match(root.tag)
+    assert m != None
+    ns = {"N": m.group(1)}
+    # Concatenate all creators.
+    creator = " ; ".join(
+        _text(n)
+        for n in root.xpath("N:creators/N:creator/N:creatorName", namespaces=ns)
+        if _text(n) != None
+    )
+    if creator == "":
+        creator = None
+    # Take the first title only.
+    l = root.xpath("N:titles/N:title", namespaces=ns)
+    if len(l) > 0:
+        title = _text(l[0])
+    else:
+        title = None
+    l = root.xpath("N:publisher", namespaces=ns)
+    if len(l) > 0:
+        publisher = _text(l[0])
+    else:
+        publisher = None
+    l = root.xpath("N:publicationYear", namespaces=ns)
+    if len(l) > 0:
+        date = _text(l[0])
+    else:
+        date = None
+    l = root.xpath("N:resourceType", namespaces=ns)
+    if len(l) > 0:
+        if l[0].attrib.get("resourceTypeGeneral", "").strip() != "":
+            type = l[0].attrib["resourceTypeGeneral"].strip()
+            if _text(l[0]) != None:
+                type += "/" + _text(l[0])
+        else:
+            type = None
+    else:
+        type = None
+    return KernelMetadata(creator, title, publisher, date, type)
+
+
+def _mapDatacite(metadata, parsedXml):
     if _get(metadata, "datacite"):
         try:
-            root = util.parseXmlString(_get(metadata, "datacite"))
-            m = _rootTagRE.match(root.tag)
-            assert m != None
-            ns = {"N": m.group(1)}
-            # Concatenate all creators.
-            creator = " ; ".join(
-                _text(n)
-                for n in root.xpath("N:creators/N:creator/N:creatorName", namespaces=ns)
-                if _text(n) != None
-            )
-            if creator == "":
-                creator = None
-            # Take the first title only.
-            l = root.xpath("N:titles/N:title", namespaces=ns)
-            if len(l) > 0:
-                title = _text(l[0])
-            else:
-                title = None
-            l = root.xpath("N:publisher", namespaces=ns)
-            if len(l) > 0:
-                publisher = _text(l[0])
-            else:
-                publisher = None
-            l = root.xpath("N:publicationYear", namespaces=ns)
-            if len(l) > 0:
-                date = _text(l[0])
-            else:
-                date = None
-            l = root.xpath("N:resourceType", namespaces=ns)
-            if len(l) > 0:
-                if l[0].attrib.get("resourceTypeGeneral", "").strip() != "":
-                    type = l[0].attrib["resourceTypeGeneral"].strip()
-                    if _text(l[0]) != None:
-                        type += "/" + _text(l[0])
-                else:
-                    type = None
-            else:
-                type = None
-            return KernelMetadata(creator, title, publisher, date, type)
+            return _mapDataciteTree(_parse(metadata, "datacite", parsedXml))
         except:
             return _mapDataciteItemized(metadata)
     else:
         return _mapDataciteItemized(metadata)
 
 
-def _mapCrossref(metadata):
+def _mapCrossref(metadata, parsedXml):
     if _get(metadata, "crossref"):
         try:
-            return _mapDatacite(
-                {"datacite": datacite.crossrefToDatacite(_get(metadata, "crossref"))}
+            return _mapDataciteTree(
+                datacite.crossrefToDatacite(
+                    _parse(metadata, "crossref", parsedXml),
+                    parseString=False,
+                    returnString=False,
+                )
             )
         except:
             return KernelMetadata()
@@ -231,7 +248,7 @@ def _mapCrossref(metadata):
         return KernelMetadata()
 
 
-def map(metadata, profile=None, datacitePriority=False):
+def map(metadata, profile=None, datacitePriority=False, parsedXml=None):
     """
   Given 'metadata', a dictionary of citation metadata, returns mapped
   kernel metadata encapsulated in a KernelMetadata object (defined in
@@ -240,21 +257,25 @@ def map(metadata, profile=None, datacitePriority=False):
   the profile defaults to "erc".  If datacitePriority is True, the
   DataCite fields (the 'datacite' XML field and the datacite.*
   itemized fields) are examined and take precedence regardless of the
-  profile.  Note that this function is forgiving in nature, and does
-  not raise exceptions.
+  profile.  If 'parsedXml' is not None, it should be a dictionary, in
+  which the XML documents in the 'datacite' and 'crossref' fields are
+  cached as root element nodes as they are parsed, so that a caller
+  can reuse them and a document is parsed only once across calls.
+  Note that this function is forgiving in nature, and does not raise
+  exceptions.
   """
     if profile == None:
         profile = _get(metadata, "_profile", "_p")
     if profile == "dc":
         km = _mapDublinCore(metadata)
     elif profile == "datacite":
-        km = _mapDatacite(metadata)
+        km = _mapDatacite(metadata, parsedXml)
     elif profile == "crossref":
-        km = _mapCrossref(metadata)
+        km = _mapCrossref(metadata, parsedXml)
     else:
         km = _mapErc(metadata)
     if datacitePriority and profile != "datacite":
-        dm = _mapDatacite(metadata)
+        dm = _mapDatacite(metadata, parsedXml)
         for a in ["creator", "title", "publisher", "date", "type"]:
             if getattr(dm, a) != None:
                 setattr(km, a, getattr(dm, a))
@@ -0,0 +1,199 @@
+# =============================================================================
+#
+# EZID :: mint_reservoir.py
+#
+# Per-shoulder reservoirs of identifiers minted ahead of time.
+#
+# ezid.mintIdentifier takes an identifier from the reservoir of the
+# requested shoulder when one is available, and mints inline
+# otherwise.  A shoulder becomes active the first time an identifier
+# is requested on it; a daemon thread then refills the reservoir of
+# each active shoulder up to its high watermark whenever its depth
+# drops below its low watermark.
+#
+# Reservoirs are stored in the MintReservoir table, which is shared by
+# all server processes; depths are always computed from the table.
+# Taking an identifier reads the first few rows of the shoulder's
+# reservoir and deletes one of them by primary key.  The delete
+# doubles as a claim: if the row is already gone (taken by another
+# process), the next row is tried.  Refills lock the shoulder's row in
+# the Shoulder table, so that processes refilling the same reservoir
+# take turns rather than each topping it up.  The minter is advanced
+# before identifiers are inserted into the table, so an identifier is
+# never handed out twice; an interruption between the two steps can
+# only leave a gap in the minted sequence.
+#
+# This module should be imported at server startup so that its daemon
+# thread is started.
+#
+# License:
+#   Copyright (c) 2020, Regents of the University of California
+#   http://creativecommons.org/licenses/BSD/
+#
+# -----------------------------------------------------------------------------
+
+import logging
+import threading
+import uuid
+
+import django.conf
+import django.db
+import django.db.transaction
+
+import config
+import ezidapp.models
+import log
+
+# Deferred imports...
+"""
+import ezid
+"""
+
+_enabled = None
+_threadName = None
+_refillInterval = None
+_defaultWatermarks = None
+_watermarks = None
+_lock = threading.Lock()
+_activePrefixes = set()
+_refillEvent = threading.Event()
+
+# Number of rows read per attempt to take an identifier.
+_takeBatchSize = 5
+
+
+logger = logging.getLogger(__name__)
+
+
+def _getWatermarks(prefix):
+    return _watermarks.get(prefix, _defaultWatermarks)
+
+
+def _parseWatermarks(s):
+    # Parses space-separated "prefix=low,high" entries.
+    d = {}
+    for entry in s.split():
+        prefix, watermarks = entry.rsplit("=", 1)
+        low, high = watermarks.split(",")
+        d[prefix] = (int(low), int(high))
+    return d
+
+
+def take(prefix):
+    """
+  Takes an identifier from the reservoir of the shoulder having
+  prefix 'prefix', e.g., "ark:/99999/fk4".  Returns the identifier as
+  returned by the minter (i.e., without the shoulder), or None if the
+  reservoir is empty or reservoirs are disabled.  The shoulder is
+  registered as active, so that its reservoir gets refilled.
+  """
+    if not _enabled:
+        return None
+    if ezidapp.models.getExactShoulderMatch(prefix) is None:
+        return None
+    with _lock:
+        _activePrefixes.add(prefix)
+    if _getDepth(prefix) <= _getWatermarks(prefix)[0]:
+        _refillEvent.set()
+    while True:
+        rows = list(
+            ezidapp.models.MintReservoir.objects.filter(prefix=prefix)
+            .order_by("seq")
+            .values_list("seq", "mintedId")[:_takeBatchSize]
+        )
+        if len(rows) == 0:
+            return None
+        for seq, mintedId in rows:
+            if ezidapp.models.MintReservoir.objects.filter(seq=seq).delete()[0] == 1:
+                return mintedId
+
+
+def _getDepth(prefix):
+    return ezidapp.models.MintReservoir.objects.filter(prefix=prefix).count()
+
+
+def getDepths():
+    """
+  Returns a dictionary that maps the prefixes of active shoulders to
+  the number of identifiers in their reservoirs.
+  """
+    with _lock:
+        prefixes = list(_activePrefixes)
+    return dict((p, _getDepth(p)) for p in prefixes)
+
+
+def _load():
+    # Shoulders having identifiers in reservoirs are active.
+    prefixes = set(
+        ezidapp.models.MintReservoir.objects.values_list("prefix", flat=True).distinct()
+    )
+    with _lock:
+        _activePrefixes.clear()
+        _activePrefixes.update(prefixes)
+
+
+def _refill(prefix):
+    import ezid
+
+    shoulder_model = ezidapp.models.getExactShoulderMatch(prefix)
+    if shoulder_model is None or shoulder_model.isUuid or shoulder_model.minter == "":
+        with _lock:
+            _activePrefixes.discard(prefix)
+        return
+    low, high = _getWatermarks(prefix)
+    with django.db.transaction.atomic():
+        list(
+            ezidapp.models.Shoulder.objects.select_for_update().filter(
+                id=shoulder_model.id
+            )
+        )
+        n = high - _getDepth(prefix)
+        if n <= 0:
+            return
+        mintedIds = ezid.mintOnShoulder(shoulder_model, n)
+        ezidapp.models.MintReservoir.objects.bulk_create(
+            [ezidapp.models.MintReservoir(prefix=prefix, mintedId=m) for m in mintedIds]
+        )
+    logger.debug('Refilled mint reservoir. prefix="{}" count={}'.format(prefix, n))
+
+
+def _checkContinue():
+    return _enabled and threading.currentThread().getName() == _threadName
+
+
+def _reservoirDaemon():
+    while _checkContinue():
+        try:
+            _refillEvent.wait(_refillInterval)
+            _refillEvent.clear()
+            with _lock:
+                prefixes = list(_activePrefixes)
+            for p in prefixes:
+                if not _checkContinue():
+                    break
+                if _getDepth(p) < _getWatermarks(p)[0]:
+                    _refill(p)
+        except Exception, e:
+            log.otherError("mint_reservoir._reservoirDaemon", e)
+        django.db.connections["default"].close()
+
+
+def loadConfig():
+    global _enabled, _threadName, _refillInterval, _defaultWatermarks
+    global _watermarks
+    _enabled = (
+        django.conf.settings.DAEMON_THREADS_ENABLED
+        and config.get("daemons.mint_reservoir_enabled").lower() == "true"
+    )
+    if _enabled:
+        _refillInterval = int(config.get("reservoir.refill_interval"))
+        _defaultWatermarks = (
+            int(config.get("reservoir.low_watermark")),
+            int(config.get("reservoir.high_watermark")),
+        )
+        _watermarks = _parseWatermarks(config.get("reservoir.shoulder_watermarks"))
+        _load()
+        _threadName = uuid.uuid1().hex
+        t = threading.Thread(target=_reservoirDaemon, name=_threadName)
+        t.setDaemon(True)
+        t.start()
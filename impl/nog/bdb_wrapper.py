@@ -103,6 +103,28 @@ class BdbWrapper(object):
                 'Any minted IDs will be repeated.'
             )
             return
+        self._set_state()
+        self._bdb.__exit__(exc_type, exc_val, exc_tb)
+
+    def checkpoint(self):
+        """Write the current minter state back to the BerkeleyDB without closing it.
+
+        This is for long-lived minters that stay open between mints. Only values that
+        have changed since the last write are sent to the database.
+        """
+        self._set_state()
+        self._bdb.flush()
+
+    def close(self):
+        """Close the BerkeleyDB without writing back any pending state."""
+        self._bdb.close()
+
+    @property
+    def minted_count(self):
+        """Total number of identifiers minted since the minter was created."""
+        return self.base_count + self.combined_count
+
+    def _set_state(self):
         bdb = self._bdb
         bdb.set('basecount', self.base_count)
         bdb.set('oacounter', self.combined_count)
@@ -117,7 +139,6 @@ class BdbWrapper(object):
         for n, (top, value) in enumerate(self.counter_list):
             bdb.set('c{}/top'.format(n), top),
             bdb.set('c{}/value'.format(n), value),
-        self._bdb.__exit__(exc_type, exc_val, exc_tb)
 
     def as_hjson(self, compact=True):
         d = self.as_dict(compact)
@@ -178,10 +199,13 @@ class Bdb:
         self._dry_run = dry_run
         self._bdb_obj = None
         self._bdb_dict = None
+        # Keys that have been modified since the database was opened or last flushed.
+        self._dirty_set = set()
 
     def __enter__(self):
         self._bdb_obj = nog.bdb.open_bdb(self._bdb_path, self._is_new)
         self._bdb_dict = dict(self._bdb_obj)
+        self._dirty_set = set()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -196,11 +220,22 @@ class Bdb:
                 'Any minted IDs will be repeated.'
             )
             return
-        self._bdb_obj.update(self._bdb_dict)
-        self._bdb_obj.sync()
-        self._bdb_obj.close()
+        self.flush()
+        self.close()
         log.debug('BerkeleyDB updated: {}'.format(self._bdb_path.as_posix()))
 
+    def flush(self):
+        """Write modified keys from the holding area to the database file and sync."""
+        if self._dirty_set:
+            self._bdb_obj.update({k: self._bdb_dict[k] for k in self._dirty_set})
+            self._dirty_set = set()
+        self._bdb_obj.sync()
+
+    def close(self):
+        if self._bdb_obj is not None:
+            self._bdb_obj.close()
+            self._bdb_obj = None
+
     def as_dict(self):
         return self._bdb_dict
 
@@ -223,7 +258,9 @@ class Bdb:
         v = str(value)
         k = self._key(key_str)
         # assert k in self._bdb, 'Attempted to write unknown key: to key not present in BerkeleyDB'
-        self._bdb_dict[k] = v
+        if self._bdb_dict.get(k) != v:
+            self._bdb_dict[k] = v
+            self._dirty_set.add(k)
         if '/top' not in key_str and '/value' not in key_str:
             log.debug("BDB: {} <- {}".format(key_str, v))
 
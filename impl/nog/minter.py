@@ -74,6 +74,10 @@ XDIG_STR = "0123456789bcdfghjkmnpqrstvwxz"
 ALPHA_COUNT = len(XDIG_STR)
 DIGIT_COUNT = 10
 
+# Minimum number of identifiers for which Minter.mint_list() uses the vectorized
+# minter, if available. Below this, the overhead of setting up the arrays dominates.
+VECTOR_MIN_COUNT = 64
+
 log = logging.getLogger(__name__)
 
 
@@ -197,6 +201,36 @@ class Minter(nog.bdb_wrapper.BdbWrapper):
                 xdig_str += self._get_check_char(minted_id)
             yield xdig_str
 
+    def mint_list(self, id_count=1):
+        """Generate one or more identifiers, as a list.
+
+        Large counts are generated by :mod:`nog.minter_vector` when NumPy is available.
+        The identifiers and the resulting minter state are the same as with
+        :meth:`mint`.
+
+        Args:
+            id_count (int): Number of identifiers to return.
+        """
+        import nog.minter_vector
+
+        if id_count >= VECTOR_MIN_COUNT and nog.minter_vector.is_available():
+            return nog.minter_vector.mint_list(self, id_count)
+        return list(self.mint(id_count))
+
+    def skip(self, id_count):
+        """Step the minter forward by a number of identifiers without generating them.
+
+        Args:
+            id_count (int): Number of identifiers to skip.
+        """
+        import nog.minter_vector
+
+        if id_count >= VECTOR_MIN_COUNT and nog.minter_vector.is_available():
+            nog.minter_vector.skip(self, id_count)
+        else:
+            for _ in self.mint(id_count):
+                pass
+
     # noinspection PyAttributeOutsideInit
     def create(self, shoulder_str, mask_str='eedk'):
         """Set minter to initial, unused state."""
@@ -0,0 +1,315 @@
+"""Long-lived minter engine that keeps minter state resident in memory
+
+Minting with :func:`nog.minter.mint_ids` opens the shoulder's BerkeleyDB, copies the
+full database into memory, writes all the counters back and closes the database, for
+every call. The engine instead keeps a :class:`ResidentMinter` open for each active
+minter, and makes each mint durable by appending to a small write-ahead journal that is
+fsync'd before the minted identifiers are returned to the caller.
+
+Journal:
+
+- The journal is a text file named 'nog.journal', stored next to the 'nog.bdb' file of
+  the minter.
+- Each line holds the total number of identifiers that had been minted by the minter
+  (base_count + combined_count) after a completed mint.
+- The minter state is written back to the BerkeleyDB (checkpointed) after a given
+  number of mints, after a given amount of time, when the engine is closed and at
+  process exit. After a checkpoint, the journal is truncated.
+- When a minter is opened, journal entries that are higher than the total in the
+  BerkeleyDB are replayed by stepping the minter forward until the totals match. Since
+  the minter is deterministic, this recreates the exact state the minter was in when
+  the last journal entry was written. The replayed state is then checkpointed.
+
+Since the minter state is held in process memory, only one process may mint on a given
+minter while the engine is in use. The engine holds an exclusive lock on the journal
+while the minter is open, so a second process attempting to open the same minter
+through the engine fails instead of minting duplicates.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import atexit
+import fcntl
+import logging
+import os
+import threading
+import time
+
+import pathlib2
+
+import nog.bdb
+import nog.exc
+import nog.minter
+
+JOURNAL_FILENAME = 'nog.journal'
+
+DEFAULT_CHECKPOINT_INTERVAL = 1000
+DEFAULT_CHECKPOINT_MAX_AGE = 60
+
+log = logging.getLogger(__name__)
+
+
+class MinterEngine(object):
+    def __init__(
+        self,
+        checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+        checkpoint_max_age=DEFAULT_CHECKPOINT_MAX_AGE,
+    ):
+        """Hold a ResidentMinter for each minter that has been used since the engine
+        was created.
+
+        Args:
+            checkpoint_interval (int): Number of minted identifiers after which the
+                minter state is written back to the BerkeleyDB.
+            checkpoint_max_age (int): Number of seconds after which the minter state is
+                written back to the BerkeleyDB, if any identifiers have been minted.
+        """
+        self._checkpoint_interval = checkpoint_interval
+        self._checkpoint_max_age = checkpoint_max_age
+        self._lock = threading.Lock()
+        self._minter_dict = {}
+
+    def mint_ids(self, shoulder_model, mint_count=1):
+        """Mint identifiers on an existing ARK or DOI shoulder / namespace.
+
+        Returns (list of str): The minted identifiers, as described in
+            :func:`nog.minter.mint_id`. The minted sequence is identical to the one
+            returned by :func:`nog.minter.mint_ids`.
+        """
+        bdb_path = nog.bdb.get_bdb_path_by_shoulder_model(shoulder_model)
+        return self.mint_by_bdb_path(bdb_path, mint_count)
+
+    def mint_by_bdb_path(self, bdb_path, mint_count=1):
+        return self._get_minter(bdb_path).mint(mint_count)
+
+    def checkpoint_all(self):
+        for resident_minter in self._get_minter_list():
+            resident_minter.checkpoint()
+
+    def close_all(self):
+        """Checkpoint and close all open minters."""
+        with self._lock:
+            minter_list = list(self._minter_dict.values())
+            self._minter_dict.clear()
+        for resident_minter in minter_list:
+            resident_minter.close()
+
+    def get_open_count(self):
+        with self._lock:
+            return len(self._minter_dict)
+
+    def _get_minter_list(self):
+        with self._lock:
+            return list(self._minter_dict.values())
+
+    def _get_minter(self, bdb_path):
+        key_str = pathlib2.Path(bdb_path).as_posix()
+        with self._lock:
+            resident_minter = self._minter_dict.get(key_str)
+            if resident_minter is None:
+                resident_minter = ResidentMinter(
+                    bdb_path, self._checkpoint_interval, self._checkpoint_max_age
+                )
+                resident_minter.open()
+                self._minter_dict[key_str] = resident_minter
+            return resident_minter
+
+
+class ResidentMinter(object):
+    def __init__(
+        self,
+        bdb_path,
+        checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+        checkpoint_max_age=DEFAULT_CHECKPOINT_MAX_AGE,
+    ):
+        """A minter that stays open between mints, with a write-ahead journal.
+
+        Args:
+            bdb_path (str or pathlib2.Path): Path to an existing BerkeleyDB minter
+                database file.
+        """
+        self._bdb_path = pathlib2.Path(bdb_path)
+        self._journal_path = self._bdb_path.with_name(JOURNAL_FILENAME)
+        self._checkpoint_interval = checkpoint_interval
+        self._checkpoint_max_age = checkpoint_max_age
+        self._lock = threading.Lock()
+        self._minter = None
+        self._journal_file = None
+        self._uncheckpointed_count = 0
+        self._checkpoint_time = None
+
+    def open(self):
+        with self._lock:
+            self._open_journal()
+            try:
+                self._minter = nog.minter.Minter(self._bdb_path, dry_run=False)
+                self._minter.__enter__()
+                self._replay_journal()
+            except Exception:
+                self._minter = None
+                self._close_journal()
+                raise
+
+    def close(self):
+        with self._lock:
+            if self._minter is None:
+                return
+            self._checkpoint()
+            self._minter.close()
+            self._minter = None
+            self._close_journal()
+
+    def mint(self, mint_count=1):
+        """Mint identifiers and record the new minter state in the journal.
+
+        The identifiers are returned only after the journal entry has been written and
+        synced to disk, so the identifiers are never handed out again, even if the
+        process is terminated before the next checkpoint.
+
+        Returns (list of str): The minted identifiers.
+        """
+        with self._lock:
+            if self._minter is None:
+                raise nog.exc.MinterError(
+                    'Minter is not open: {}'.format(self._bdb_path.as_posix())
+                )
+            minted_list = self._minter.mint_list(mint_count)
+            self._append_journal(self._minter.minted_count)
+            self._uncheckpointed_count += mint_count
+            if (
+                self._uncheckpointed_count >= self._checkpoint_interval
+                or time.time() - self._checkpoint_time >= self._checkpoint_max_age
+            ):
+                self._checkpoint()
+            return minted_list
+
+    def checkpoint(self):
+        with self._lock:
+            if self._minter is not None:
+                self._checkpoint()
+
+    def _checkpoint(self):
+        """Write the minter state to the BerkeleyDB, then truncate the journal.
+
+        If the process is terminated between the two steps, the remaining journal entries
+        are at or below the total in the BerkeleyDB, and are ignored by the replay.
+        """
+        if self._uncheckpointed_count:
+            self._minter.checkpoint()
+            self._journal_file.seek(0)
+            self._journal_file.truncate()
+            self._sync_journal()
+            log.debug(
+                'Minter checkpointed. path="{}" minted_count={}'.format(
+                    self._bdb_path.as_posix(), self._minter.minted_count
+                )
+            )
+        self._uncheckpointed_count = 0
+        self._checkpoint_time = time.time()
+
+    def _replay_journal(self):
+        """Step the minter forward to the state recorded by the last journal entry."""
+        self._checkpoint_time = time.time()
+        journal_count = self._read_journal()
+        replay_count = journal_count - self._minter.minted_count
+        if replay_count <= 0:
+            return
+        log.info(
+            'Replaying minter journal. path="{}" replay_count={}'.format(
+                self._journal_path.as_posix(), replay_count
+            )
+        )
+        self._minter.skip(replay_count)
+        if self._minter.minted_count != journal_count:
+            raise nog.exc.MinterError(
+                'Minter journal replay did not reach the journaled state. '
+                'path="{}" journal_count={} minted_count={}'.format(
+                    self._journal_path.as_posix(),
+                    journal_count,
+                    self._minter.minted_count,
+                )
+            )
+        self._uncheckpointed_count = replay_count
+        self._checkpoint()
+
+    def _read_journal(self):
+        """Return the highest total recorded in the journal, or 0 if the journal is
+        empty. A partially written last line, left by an interrupted write, is ignored.
+        """
+        self._journal_file.seek(0)
+        journal_count = 0
+        for line_str in self._journal_file.read().splitlines():
+            try:
+                journal_count = max(journal_count, int(line_str))
+            except ValueError:
+                log.warning(
+                    'Ignored invalid minter journal entry. path="{}" entry="{}"'.format(
+                        self._journal_path.as_posix(), line_str
+                    )
+                )
+        self._journal_file.seek(0, os.SEEK_END)
+        return journal_count
+
+    def _append_journal(self, minted_count):
+        self._journal_file.write('{}\n'.format(minted_count))
+        self._sync_journal()
+
+    def _sync_journal(self):
+        self._journal_file.flush()
+        getattr(os, 'fdatasync', os.fsync)(self._journal_file.fileno())
+
+    def _open_journal(self):
+        self._journal_file = open(self._journal_path.as_posix(), 'a+')
+        try:
+            fcntl.flock(self._journal_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self._journal_file.close()
+            self._journal_file = None
+            raise nog.exc.MinterError(
+                'Minter is already open in another process: {}'.format(
+                    self._bdb_path.as_posix()
+                )
+            )
+
+    def _close_journal(self):
+        if self._journal_file is not None:
+            fcntl.flock(self._journal_file.fileno(), fcntl.LOCK_UN)
+            self._journal_file.close()
+            self._journal_file = None
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(checkpoint_interval=None, checkpoint_max_age=None):
+    """Get the process wide MinterEngine, creating it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = MinterEngine(
+                checkpoint_interval or DEFAULT_CHECKPOINT_INTERVAL,
+                checkpoint_max_age or DEFAULT_CHECKPOINT_MAX_AGE,
+            )
+        return _engine
+
+
+def close_engine():
+    """Checkpoint and close all minters held by the process wide MinterEngine."""
+    global _engine
+    with _engine_lock:
+        engine, _engine = _engine, None
+    if engine is not None:
+        engine.close_all()
+
+
+def journal_exists(bdb_path):
+    """Return True if the minter has a journal, i.e., it has been opened by a
+    :class:`ResidentMinter`. The journal may hold entries that have not been
+    checkpointed, so the minter must then not be opened by :class:`nog.minter.Minter`
+    directly.
+    """
+    return pathlib2.Path(bdb_path).with_name(JOURNAL_FILENAME).exists()
+
+
+atexit.register(close_engine)
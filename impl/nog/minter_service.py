@@ -0,0 +1,361 @@
+"""Minting service shared by all EZID processes on a host
+
+When EZID runs in several processes, such as multi-process mod_wsgi, locks held within a
+process cannot prevent two processes from opening the same minter BerkeleyDB and minting
+duplicate identifiers. The minter service is a single local process that owns the
+minters of all shoulders and mints on behalf of the other processes.
+
+- The service listens on a Unix domain socket. Each request and response is a single
+  line of JSON. A request holds the path of the minter BerkeleyDB and the number of
+  identifiers to mint, e.g., ``{"path": "/.../nog.bdb", "count": 1}``. A response holds
+  either the minted identifiers, e.g., ``{"ids": ["r70k2t"]}``, or an error message,
+  e.g., ``{"error": "..."}``.
+- Minters are held open by a :class:`nog.minter_engine.MinterEngine`, so each mint is
+  made durable by the minter journal before it is returned.
+- Requests for the same minter that arrive while a mint is in progress are batched. The
+  thread that completes a mint mints for all the requests that queued up in the meantime
+  in a single call to the minter, then splits the minted identifiers among them.
+
+If the service is not running, :func:`mint_with_file_lock` can be used instead. It
+serializes minting on a minter by holding an exclusive lock on a file next to the
+minter BerkeleyDB. It opens the minter through a
+:class:`nog.minter_engine.ResidentMinter`, so journal entries left by the service are
+replayed before minting, and minting fails instead of minting duplicates if the service
+still holds the minter open. For the same reason, EZID mints through
+:func:`mint_with_file_lock` whenever a minter has a journal, even if the service is
+disabled.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import pathlib2
+
+import nog.exc
+import nog.minter_engine
+
+try:
+    import socketserver
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    import SocketServer as socketserver
+
+LOCK_FILENAME = 'nog.lock'
+
+DEFAULT_TIMEOUT = 10
+
+# Only the service user and its group, e.g., the web server, may connect.
+DEFAULT_SOCKET_MODE = 0o660
+
+log = logging.getLogger(__name__)
+
+
+class MinterServiceUnavailable(nog.exc.MinterError):
+    """The minter service is not running, so no identifiers were minted."""
+
+    pass
+
+
+class MinterService(object):
+    def __init__(
+        self,
+        socket_path,
+        root_path,
+        checkpoint_interval=nog.minter_engine.DEFAULT_CHECKPOINT_INTERVAL,
+        checkpoint_max_age=nog.minter_engine.DEFAULT_CHECKPOINT_MAX_AGE,
+        socket_mode=DEFAULT_SOCKET_MODE,
+    ):
+        """Serve mint requests on a Unix domain socket.
+
+        Args:
+            socket_path (str or pathlib2.Path): Path at which to create the socket.
+            root_path (str or pathlib2.Path): Root of the minter BerkeleyDB tree. Only
+                minters below this path are served.
+            socket_mode (int): Permissions set on the socket after it is created.
+        """
+        self._socket_path = pathlib2.Path(socket_path)
+        self._socket_mode = socket_mode
+        self._root_path = pathlib2.Path(os.path.realpath(str(root_path)))
+        self._engine = nog.minter_engine.MinterEngine(
+            checkpoint_interval, checkpoint_max_age
+        )
+        self._lock = threading.Lock()
+        self._queue_dict = {}
+        self._server = None
+
+    def serve_forever(self):
+        """Serve requests until :meth:`shutdown` is called. All minters are then
+        checkpointed and closed.
+        """
+        self._remove_stale_socket()
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line_str in iter(self.rfile.readline, b''):
+                    response_dict = service._handle_request(line_str)
+                    self.wfile.write(json.dumps(response_dict).encode('utf-8') + b'\n')
+                    self.wfile.flush()
+
+        self._server = _Server(self._socket_path.as_posix(), Handler)
+        try:
+            os.chmod(self._socket_path.as_posix(), self._socket_mode)
+        except Exception:
+            self._server.server_close()
+            self._remove_socket()
+            raise
+        log.info(
+            'Minter service listening. socket="{}" root="{}"'.format(
+                self._socket_path.as_posix(), self._root_path.as_posix()
+            )
+        )
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self._remove_socket()
+            self._engine.close_all()
+            log.info('Minter service stopped')
+
+    def shutdown(self):
+        """Stop serving requests. Must be called from a thread other than the one
+        running :meth:`serve_forever`.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+
+    def mint(self, bdb_path, mint_count=1):
+        """Mint identifiers, batched with any concurrent requests for the same minter.
+
+        Returns (list of str): The minted identifiers.
+        """
+        bdb_path = pathlib2.Path(os.path.realpath(str(bdb_path)))
+        if self._root_path not in bdb_path.parents:
+            raise nog.exc.MinterError(
+                'Minter is outside of the minter root: {}'.format(bdb_path.as_posix())
+            )
+        request = _MintRequest(mint_count)
+        with self._lock:
+            queue = self._queue_dict.setdefault(bdb_path.as_posix(), _MintQueue())
+        queue.submit(request, lambda n: self._engine.mint_by_bdb_path(bdb_path, n))
+        if request.error is not None:
+            raise request.error
+        return request.minted_list
+
+    def _handle_request(self, line_str):
+        try:
+            request_dict = json.loads(line_str.decode('utf-8'))
+            mint_count = int(request_dict['count'])
+            if mint_count < 1:
+                raise ValueError('Invalid count: {}'.format(mint_count))
+            return {'ids': self.mint(request_dict['path'], mint_count)}
+        except Exception as e:
+            log.exception('Mint request failed. request="{}"'.format(line_str.strip()))
+            return {'error': '{}: {}'.format(e.__class__.__name__, str(e))}
+
+    def _remove_stale_socket(self):
+        """Remove a socket left behind by a service that was not shut down cleanly. Fail
+        if the socket belongs to a service that is still running.
+        """
+        if not self._socket_path.exists():
+            return
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(self._socket_path.as_posix())
+        except socket.error:
+            self._remove_socket()
+        else:
+            raise nog.exc.MinterError(
+                'Minter service is already running. socket="{}"'.format(
+                    self._socket_path.as_posix()
+                )
+            )
+        finally:
+            s.close()
+
+    def _remove_socket(self):
+        try:
+            self._socket_path.unlink()
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    # Web server processes may connect in bursts. Connections beyond the backlog are
+    # refused with EAGAIN.
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class _MintRequest(object):
+    def __init__(self, mint_count):
+        self.mint_count = mint_count
+        self.minted_list = None
+        self.error = None
+        self.done = False
+
+
+class _MintQueue(object):
+    def __init__(self):
+        """Pending mint requests for a single minter."""
+        self._cond = threading.Condition()
+        self._pending_list = []
+        self._is_busy = False
+
+    def submit(self, request, mint_fn):
+        """Wait for the request to be completed.
+
+        If no mint is in progress, the calling thread mints for its own request and for
+        all requests that queue up while it is minting. Otherwise, it waits for the
+        minting thread to complete its request.
+        """
+        with self._cond:
+            self._pending_list.append(request)
+            while self._is_busy and not request.done:
+                self._cond.wait()
+            if request.done:
+                return
+            self._is_busy = True
+        try:
+            while True:
+                with self._cond:
+                    batch_list, self._pending_list = self._pending_list, []
+                    if not batch_list:
+                        self._is_busy = False
+                        self._cond.notify_all()
+                        return
+                self._mint_batch(batch_list, mint_fn)
+                with self._cond:
+                    self._cond.notify_all()
+        except Exception:
+            with self._cond:
+                self._is_busy = False
+                self._cond.notify_all()
+            raise
+
+    @staticmethod
+    def _mint_batch(batch_list, mint_fn):
+        try:
+            minted_list = mint_fn(sum(r.mint_count for r in batch_list))
+        except Exception as e:
+            for r in batch_list:
+                r.error = e
+                r.done = True
+            return
+        if len(batch_list) > 1:
+            log.debug(
+                'Batched mint requests. request_count={} mint_count={}'.format(
+                    len(batch_list), len(minted_list)
+                )
+            )
+        i = 0
+        for r in batch_list:
+            r.minted_list = minted_list[i : i + r.mint_count]
+            r.done = True
+            i += r.mint_count
+
+
+def mint_by_bdb_path(socket_path, bdb_path, mint_count=1, timeout=DEFAULT_TIMEOUT):
+    """Mint identifiers through the minter service.
+
+    Args:
+        socket_path (str or pathlib2.Path): Path to the socket of the minter service.
+        bdb_path (str or pathlib2.Path): Path to the minter BerkeleyDB.
+        timeout (float): Number of seconds to wait for the service.
+
+    Returns (list of str): The minted identifiers, as described in
+        :func:`nog.minter.mint_id`.
+
+    Raises:
+        MinterServiceUnavailable: The service is not running. It is then safe to mint
+            with :func:`mint_with_file_lock` instead.
+        nog.exc.MinterError: The service failed, or did not respond in time. The
+            identifiers may or may not have been minted.
+    """
+    s = _connect(pathlib2.Path(socket_path).as_posix(), timeout)
+    try:
+        request_dict = {
+            'path': pathlib2.Path(bdb_path).as_posix(),
+            'count': mint_count,
+        }
+        try:
+            s.sendall(json.dumps(request_dict).encode('utf-8') + b'\n')
+            f = s.makefile('rb')
+            try:
+                line_str = f.readline()
+            finally:
+                f.close()
+        except socket.error as e:
+            raise nog.exc.MinterError(
+                'Minter service did not respond. error="{}"'.format(str(e))
+            )
+    finally:
+        s.close()
+    if not line_str:
+        raise nog.exc.MinterError('Minter service closed the connection')
+    response_dict = json.loads(line_str.decode('utf-8'))
+    if 'error' in response_dict:
+        raise nog.exc.MinterError(
+            'Minter service error: {}'.format(response_dict['error'])
+        )
+    return [str(id_str) for id_str in response_dict['ids']]
+
+
+def _connect(socket_path, timeout):
+    """Connect to the minter service, retrying while the backlog of the service is
+    full.
+    """
+    deadline = time.time() + timeout
+    while True:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(timeout)
+        try:
+            s.connect(socket_path)
+            return s
+        except socket.error as e:
+            s.close()
+            if e.errno == errno.EAGAIN and time.time() < deadline:
+                time.sleep(0.01)
+                continue
+            if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                raise MinterServiceUnavailable(
+                    'Minter service is not running. socket="{}" error="{}"'.format(
+                        socket_path, str(e)
+                    )
+                )
+            raise nog.exc.MinterError(
+                'Unable to connect to minter service. socket="{}" error="{}"'.format(
+                    socket_path, str(e)
+                )
+            )
+
+
+def mint_with_file_lock(bdb_path, mint_count=1):
+    """Mint identifiers directly, while holding an exclusive lock on the minter.
+
+    This is the fallback used when the minter service is not running. Processes that
+    mint with this function on the same minter are serialized by the lock.
+
+    Returns (list of str): The minted identifiers.
+    """
+    bdb_path = pathlib2.Path(bdb_path)
+    with open(bdb_path.with_name(LOCK_FILENAME).as_posix(), 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            resident_minter = nog.minter_engine.ResidentMinter(bdb_path)
+            resident_minter.open()
+            try:
+                return resident_minter.mint(mint_count)
+            finally:
+                resident_minter.close()
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,260 @@
+"""Vectorized stepping of N2T EggNog compatible minters
+
+:class:`nog.minter.Minter` steps the minter one identifier at a time: it seeds a fresh
+:class:`nog.minter._Drand48` with the combined count, selects an active counter,
+increments it and expands the compounded counter value to the minted string digit by
+digit. This module performs the same steps on blocks of consecutive combined counts as
+NumPy arrays. The resulting minter state and minted strings are identical to those of
+the scalar minter.
+
+The sequential part of the algorithm is the list of active counters, which only changes
+when a counter is exhausted. A block is therefore cut short at the first step that
+exhausts a counter, the counter is deactivated, and the next block starts with the
+updated list. Blocks are sized so that they are unlikely to be cut short, based on the
+headroom of the fullest active counter. Template extensions are handled by the scalar
+minter between blocks.
+
+NumPy is listed in requirements.txt. If it is nevertheless not installed,
+:func:`is_available` returns False and logs a warning the first time, and callers fall
+back to the scalar minter, which is much slower for large counts.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import re
+
+import nog.exc
+import nog.minter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Max number of identifiers stepped in a single block. Limits the size of the
+# temporary arrays.
+MAX_BLOCK_SIZE = 2 ** 16
+
+# Compounded counter values are handled as signed 64 bit integers.
+MAX_COMBINED_COUNT = 2 ** 63
+
+log = logging.getLogger(__name__)
+
+_is_fallback_logged = False
+
+
+def is_available():
+    """Return True if NumPy is installed, so that minters can be vectorized."""
+    global _is_fallback_logged
+    if np is None and not _is_fallback_logged:
+        log.warning(
+            'NumPy is not installed. Falling back to the scalar minter for large counts'
+        )
+        _is_fallback_logged = True
+    return np is not None
+
+
+def mint_list(minter, id_count):
+    """Mint identifiers with an open minter, as a list.
+
+    Args:
+        minter (nog.minter.Minter): An open minter. The minter state is stepped
+            forward by ``id_count`` identifiers, exactly as by ``minter.mint()``.
+        id_count (int): Number of identifiers to mint.
+
+    Returns (list of str): The minted identifiers, identical to the ones yielded by
+        ``minter.mint()``.
+    """
+    minted_list = []
+    for n_arr in _step(minter, id_count):
+        minted_list.extend(_format_block(minter, n_arr))
+    return minted_list
+
+
+def skip(minter, id_count):
+    """Step an open minter forward without generating the minted strings.
+
+    This is used for projecting a minter to a later state, such as when replaying a
+    journal or starting a slice at a given position.
+    """
+    for _ in _step(minter, id_count):
+        pass
+
+
+def _step(minter, id_count):
+    """Step the minter ``id_count`` times.
+
+    Yields (numpy.ndarray of int64): The compounded counter values of consecutive
+        blocks of steps, as returned one by one by ``minter._next_state()``.
+    """
+    _assert_available()
+    minter._assert_ezid_compatible_minter()
+    minter._assert_valid_combined_count()
+    minter._assert_mask_matches_template()
+
+    remaining_count = id_count
+    while remaining_count > 0:
+        if minter.combined_count == minter.max_combined_count:
+            minter._extend_template()
+        if minter.max_combined_count >= MAX_COMBINED_COUNT:
+            raise nog.exc.MinterError(
+                'Minter is too large to be vectorized. max_combined_count={}'.format(
+                    minter.max_combined_count
+                )
+            )
+        block_size = min(
+            remaining_count,
+            minter.max_combined_count - minter.combined_count,
+            _get_block_size(minter),
+        )
+        n_arr = _step_block(minter, block_size)
+        remaining_count -= len(n_arr)
+        yield n_arr
+
+
+def _get_block_size(minter):
+    """Get a block size for which the fullest active counter is expected to be
+    exhausted near the end of the block, if at all.
+
+    On average, each active counter is selected once per ``len(active_counter_list)``
+    steps.
+    """
+    headroom_int = min(
+        max_int - value_int
+        for max_int, value_int in (
+            minter.counter_list[int(c[1:])] for c in minter.active_counter_list
+        )
+    )
+    return max(1, min(MAX_BLOCK_SIZE, headroom_int * len(minter.active_counter_list)))
+
+
+def _step_block(minter, block_size):
+    """Step the minter up to ``block_size`` times, stopping after the first step that
+    exhausts a counter.
+
+    Returns (numpy.ndarray of int64): Compounded counter values for the completed steps.
+    """
+    active_count = len(minter.active_counter_list)
+    counter_idx_arr = np.array(
+        [int(c[1:]) for c in minter.active_counter_list], dtype=np.int64
+    )
+    max_arr = np.array(
+        [minter.counter_list[i][0] for i in counter_idx_arr], dtype=np.int64
+    )
+    value_arr = np.array(
+        [minter.counter_list[i][1] for i in counter_idx_arr], dtype=np.int64
+    )
+
+    # Position in the active counter list selected by each step. Matches
+    # int(_Drand48(combined_count).drand() * active_count). The 48 bit state is exactly
+    # representable as a float64, so the conversion to [0, 1) is exact.
+    combined_arr = np.arange(
+        minter.combined_count, minter.combined_count + block_size, dtype=np.uint64
+    )
+    state_arr = (
+        ((combined_arr << np.uint64(16)) + np.uint64(0x330E)) * np.uint64(25214903917)
+        + np.uint64(11)
+    ) & np.uint64(2 ** 48 - 1)
+    active_idx_arr = (
+        state_arr.astype(np.float64) / float(2 ** 48) * active_count
+    ).astype(np.int64)
+
+    # Number of times each counter has already been selected earlier in the block.
+    order_arr = np.argsort(active_idx_arr, kind='mergesort')
+    hit_arr = np.bincount(active_idx_arr, minlength=active_count)
+    start_arr = np.cumsum(hit_arr) - hit_arr
+    rank_arr = np.empty(block_size, dtype=np.int64)
+    rank_arr[order_arr] = np.arange(block_size, dtype=np.int64) - (
+        start_arr[active_idx_arr[order_arr]]
+    )
+    new_value_arr = value_arr[active_idx_arr] + rank_arr + 1
+
+    exhausted_arr = new_value_arr >= max_arr[active_idx_arr]
+    exhausted_idx = None
+    if exhausted_arr.any():
+        step_count = int(np.argmax(exhausted_arr)) + 1
+        exhausted_idx = int(active_idx_arr[step_count - 1])
+        active_idx_arr = active_idx_arr[:step_count]
+        new_value_arr = new_value_arr[:step_count]
+        hit_arr = np.bincount(active_idx_arr, minlength=active_count)
+
+    for i in np.nonzero(hit_arr)[0]:
+        counter_idx = int(counter_idx_arr[i])
+        max_int, value_int = minter.counter_list[counter_idx]
+        minter.counter_list[counter_idx] = max_int, value_int + int(hit_arr[i])
+    minter.combined_count += len(active_idx_arr)
+    if exhausted_idx is not None:
+        minter._deactivate_exhausted_counter(exhausted_idx)
+
+    return new_value_arr + counter_idx_arr[active_idx_arr] * minter.max_per_counter
+
+
+def _format_block(minter, n_arr):
+    """Expand compounded counter values to minted strings, as specified by the mask,
+    and add the NOID check characters. Matches ``minter._get_xdig_str()`` and
+    ``minter._get_check_char()``.
+    """
+    mask_str = minter.mask_str
+    digit_mask_str = mask_str.replace('k', '')
+    has_check_char = mask_str.endswith('k')
+    head_str, tail_str = re.split('{.*}', minter.template_str, maxsplit=1)
+
+    # XDIG_STR indexes of the minted characters, most significant first.
+    rem_arr = np.empty((len(n_arr), len(digit_mask_str)), dtype=np.int64)
+    is_empty_arr = np.zeros(len(n_arr), dtype=bool)
+    q_arr = n_arr.copy()
+    for i in range(len(digit_mask_str) - 1, -1, -1):
+        c = digit_mask_str[i]
+        if c in ('e', 'f'):
+            divider = nog.minter.ALPHA_COUNT
+        elif c == 'd':
+            divider = nog.minter.DIGIT_COUNT
+        else:
+            raise nog.exc.MinterError('Unsupported character in mask: {}'.format(c))
+        q_arr, rem_arr[:, i] = np.divmod(q_arr, divider)
+        if c == 'f':
+            is_empty_arr |= rem_arr[:, i] < nog.minter.DIGIT_COUNT
+
+    xdig_arr = np.frombuffer(nog.minter.XDIG_STR.encode('ascii'), dtype=np.uint8)
+    char_arr = xdig_arr[rem_arr]
+    if has_check_char:
+        # The value of an XDIG character is its index in XDIG_STR.
+        weight_arr = np.arange(
+            len(head_str) + 1, len(head_str) + len(digit_mask_str) + 1, dtype=np.int64
+        )
+        total_arr = (
+            _get_check_total(head_str, 0)
+            + rem_arr.dot(weight_arr)
+            + _get_check_total(tail_str, len(head_str) + len(digit_mask_str))
+        )
+        char_arr = np.hstack(
+            (char_arr, xdig_arr[total_arr % nog.minter.ALPHA_COUNT][:, np.newaxis])
+        )
+
+    minted_list = (
+        np.ascontiguousarray(char_arr)
+        .view('S{}'.format(char_arr.shape[1]))
+        .ravel()
+        .astype(str)
+        .tolist()
+    )
+    # An 'f' mask character that expands to a digit causes the scalar minter to yield
+    # an empty string, followed by the check character for the template without the
+    # generated part.
+    for i in np.nonzero(is_empty_arr)[0]:
+        minted_list[i] = ''
+        if has_check_char:
+            minted_list[i] += minter._get_check_char(head_str + tail_str)
+    return minted_list
+
+
+def _get_check_total(s, offset):
+    return sum(
+        (offset + i + 1) * nog.minter.XDIG_DICT.get(c, 0) for i, c in enumerate(s)
+    )
+
+
+def _assert_available():
+    if np is None:
+        raise nog.exc.MinterError('NumPy is required for vectorized minting')
@@ -142,3 +142,6 @@ def create_shoulder(
         raise django.core.management.CommandError(
             'Unable to create database record for shoulder. Error: {}'.format(str(e))
         )
+    # The path cache is also cleared in the running EZID process by the reload that is
+    # triggered after the shoulder has been created.
+    ezidapp.models.clearMinterPathCache()
@@ -19,6 +19,12 @@
 # names are not allowed.  Setting an empty value causes the element to
 # be deleted; as a consequence, empty values are never returned.
 #
+# Requests are issued over persistent (keep-alive) HTTP connections
+# that are kept in a pool and reused across calls and threads.
+# Operations on multiple identifiers are sent as many ":hx%" lines in
+# a single request body, split over several requests if the body
+# would exceed the configured maximum request size.
+#
 # Author:
 #   Greg Janee <gjanee@ucop.edu>
 #
@@ -29,9 +35,13 @@
 # -----------------------------------------------------------------------------
 
 import base64
+import httplib
 import re
+import socket
+import threading
 import time
 import urllib2
+import urlparse
 
 import config
 import util
@@ -45,52 +55,135 @@ _server = None
 _authorization = None
 _numAttempts = None
 _reattemptDelay = None
+_maxRequestSize = None
+
+_idleConnections = []
+_idleConnectionsLock = threading.Lock()
 
 
 def loadConfig():
     global _server, _authorization, _numAttempts, _reattemptDelay
+    global _maxRequestSize
     _server = config.get("binder.url")
     _authorization = "Basic " + base64.b64encode(
         config.get("binder.username") + ":" + config.get("binder.password")
     )
     _numAttempts = int(config.get("binder.num_attempts"))
     _reattemptDelay = int(config.get("binder.reattempt_delay"))
+    _maxRequestSize = int(config.get("binder.max_request_size"))
+    _closeIdleConnections()
+
+
+def _closeIdleConnections():
+    _idleConnectionsLock.acquire()
+    try:
+        while len(_idleConnections) > 0:
+            _idleConnections.pop().close()
+    finally:
+        _idleConnectionsLock.release()
+
+
+def _getConnection():
+    # Returns (connection, reused).
+    _idleConnectionsLock.acquire()
+    try:
+        if len(_idleConnections) > 0:
+            return _idleConnections.pop(), True
+    finally:
+        _idleConnectionsLock.release()
+    u = urlparse.urlparse(_server)
+    if u.scheme == "https":
+        return httplib.HTTPSConnection(u.netloc), False
+    else:
+        return httplib.HTTPConnection(u.netloc), False
+
+
+def _releaseConnection(c):
+    _idleConnectionsLock.acquire()
+    try:
+        _idleConnections.append(c)
+    finally:
+        _idleConnectionsLock.release()
+
+
+def _request(method, body):
+    # Performs one HTTP exchange and returns the response body as a
+    # list of lines.  A pooled connection may have been closed by the
+    # server since it was last used, so a failure on a reused
+    # connection is retried at once on a new connection.
+    headers = {"Authorization": _authorization}
+    if body != None:
+        headers["Content-Type"] = "text/plain"
+    path = urlparse.urlparse(_server).path + "?-"
+    while True:
+        c, reused = _getConnection()
+        try:
+            c.request(method, path, body, headers)
+            r = c.getresponse()
+            s = r.read()
+        except (httplib.HTTPException, socket.error):
+            c.close()
+            if reused:
+                continue
+            raise
+        if r.status != 200:
+            c.close()
+            raise urllib2.HTTPError(_server, r.status, r.reason, r.msg, None)
+        if r.will_close:
+            c.close()
+        else:
+            _releaseConnection(c)
+        return s.splitlines(True)
+
+
+def _encodeOperation(o):
+    # o = (identifier, operation [,element [, value]])
+    s = ":hx%% %s.%s" % (util.encode4(o[0]), o[1])
+    if len(o) > 2:
+        s += " " + util.encode4(o[2])
+    if len(o) > 3:
+        s += " " + util.encode3(o[3])
+    return s
 
 
 @stacklog
 def _issue(method, operations):
-    r = urllib2.Request(_server + "?-")
-    r.get_method = lambda: method
-    r.add_header("Authorization", _authorization)
     if len(operations) > 0:
-        r.add_header("Content-Type", "text/plain")
-        l = []
-        for o in operations:
-            # o = (identifier, operation [,element [, value]])
-            s = ":hx%% %s.%s" % (util.encode4(o[0]), o[1])
-            if len(o) > 2:
-                s += " " + util.encode4(o[2])
-            if len(o) > 3:
-                s += " " + util.encode3(o[3])
-            l.append(s)
-        r.add_data("\n".join(l))
+        body = "\n".join(_encodeOperation(o) for o in operations)
+    else:
+        body = None
     for i in range(_numAttempts):
-        c = None
         try:
-            c = urllib2.urlopen(r)
-            s = c.readlines()
+            s = _request(method, body)
         except:
             if i == _numAttempts - 1:
                 raise
         else:
             break
-        finally:
-            if c:
-                c.close()
         time.sleep(_reattemptDelay)
     return s
 
 
+def _issueInChunks(method, operations):
+    # Like _issue, but splits the operations over as many requests as
+    # are needed to keep each request body within the maximum request
+    # size.  Returns a list of outputs, one per request, in order.
+    outputs = []
+    chunk = []
+    size = 0
+    for o in operations:
+        n = len(_encodeOperation(o)) + 1
+        if len(chunk) > 0 and size + n > _maxRequestSize:
+            outputs.append(_issue(method, chunk))
+            chunk = []
+            size = 0
+        chunk.append(o)
+        size += n
+    if len(chunk) > 0:
+        outputs.append(_issue(method, chunk))
+    return outputs
+
+
 def _error(operation, s):
     return (
         "unexpected return from noid egg '%s' operation, " + "output follows\n%s"
@@ -150,8 +243,8 @@ def batchSetElements(batch):
                 l.append((identifier, "rm", e))
             else:
                 l.append((identifier, "set", e, v))
-    s = _issue("POST", l)
-    assert len(s) >= 2 and s[-2] == "egg-status: 0\n", _error("set/rm", s)
+    for s in _issueInChunks("POST", l):
+        assert len(s) >= 2 and s[-2] == "egg-status: 0\n", _error("set/rm", s)
 
 
 def getElements(identifier):
@@ -161,23 +254,60 @@ def getElements(identifier):
   "doi:10.1234/FOO"), or None if the identifier doesn't exist.  Raises
   an exception on error.
   """
+    return batchGetElements([identifier])[0]
+
+
+def batchGetElements(batch):
+    """
+  Similar to 'getElements' above, but operates on a list of
+  identifiers in as few requests as possible.  Returns a list of
+  dictionaries (or Nones), one per identifier, in order.
+  """
+    results = []
+    i = 0
+    for s in _issueInChunks("GET", [(identifier, "fetch") for identifier in batch]):
+        assert len(s) >= 2 and s[-2] == "egg-status: 0\n", _error("fetch", s)
+        for block in _splitFetchOutput(s):
+            assert i < len(batch), _error("fetch", s)
+            results.append(_parseFetchBlock(block, s))
+            i += 1
+    assert i == len(batch), "noid egg 'fetch' operation returned too few results"
+    return results
+
+
+def _splitFetchOutput(s):
+    # Splits the output of a request containing fetch operations into
+    # per-identifier blocks, each running from a "# id:" line through
+    # the matching "# elements bound under" line.  The trailing status
+    # lines and any blank lines between blocks are not included.
+    blocks = []
+    block = None
+    for l in s[:-2]:
+        if block == None:
+            if l.strip() == "":
+                continue
+            assert l.startswith("# id:"), _error("fetch", s)
+            block = [l]
+        else:
+            block.append(l)
+            if l.startswith("# elements bound under"):
+                blocks.append(block)
+                block = None
+    assert block == None, _error("fetch", s)
+    return blocks
+
+
+def _parseFetchBlock(block, s):
     # See the comment under 'identifierExists' above.
-    s = _issue("GET", [(identifier, "fetch")])
-    assert (
-        len(s) >= 4
-        and s[0].startswith("# id:")
-        and s[-3].startswith("# elements bound under")
-        and s[-2] == "egg-status: 0\n"
-    ), _error("fetch", s)
-    m = re.search(": (\d+)\n$", s[-3])
+    m = re.search(": (\d+)\n$", block[-1])
     assert m, _error("fetch", s)
     c = int(m.group(1))
-    assert len(s) == c + 4, _error("fetch", s)
+    assert len(block) == c + 2, _error("fetch", s)
     if c == 0:
         return None
     else:
         d = {}
-        for l in s[1 : len(s) - 3]:
+        for l in block[1:-1]:
             assert ":" in l, _error("fetch", s)
             if l.startswith("__") or l.startswith("_.e") or l.startswith("_,e"):
                 continue
@@ -216,8 +346,8 @@ def batchDeleteIdentifier(batch):
     # removed as 'deleteIdentifier' does above.  But that code is just a
     # guard against noid API changes, and having it in one place is
     # sufficient.
-    s = _issue("POST", [(identifier, "purge") for identifier in batch])
-    assert len(s) >= 2 and s[-2] == "egg-status: 0\n", _error("purge", s)
+    for s in _issueInChunks("POST", [(identifier, "purge") for identifier in batch]):
+        assert len(s) >= 2 and s[-2] == "egg-status: 0\n", _error("purge", s)
 
 
 def ping():
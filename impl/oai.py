@@ -16,10 +16,13 @@
 
 import django.conf
 import django.db.models
+import django.db.transaction
 import django.http
 import hashlib
 import lxml.etree
+import threading
 import time
+import uuid
 
 import config
 import datacite
@@ -31,15 +34,31 @@ _baseUrl = None
 _repositoryName = None
 _adminEmail = None
 _batchSize = None
+_recordCacheEnabled = None
+_listSizeCacheLifetime = None
+
+# Complete list sizes of recently started harvests: maps (from_, until)
+# to (list size, time computed).
+_listSizeCache = {}
+_listSizeCacheLock = threading.Lock()
+_maxListSizeCacheEntries = 1000
 
 
 def loadConfig():
     global _enabled, _baseUrl, _repositoryName, _adminEmail, _batchSize
+    global _recordCacheEnabled, _listSizeCacheLifetime
     _enabled = config.get("oai.enabled").lower() == "true"
     _baseUrl = config.get("DEFAULT.ezid_base_url")
     _repositoryName = config.get("oai.repository_name")
     _adminEmail = config.get("oai.admin_email")
     _batchSize = int(config.get("oai.batch_size"))
+    _recordCacheEnabled = config.get("oai.record_cache_enabled").lower() == "true"
+    _listSizeCacheLifetime = int(config.get("oai.list_size_cache_lifetime"))
+    _listSizeCacheLock.acquire()
+    try:
+        _listSizeCache.clear()
+    finally:
+        _listSizeCacheLock.release()
 
 
 def _q(elementName):
@@ -146,37 +165,77 @@ def _buildRequest(request):
     return r
 
 
-def _buildResumptionToken(from_, until, prefix, cursor, total):
+def _buildResumptionToken(from_, fromId, until, prefix, cursor, total):
     # The semantics of a resumption token: return identifiers whose
-    # update times are in the range (from_, until].  'until' may be None.
+    # update times are in the range (from_, until], and that, if their
+    # update time is from_, have database IDs greater than fromId.
+    # I.e., harvesting resumes after the keyset position (from_,
+    # fromId) in (updateTime, id) order.  'until' may be None.
     if until is not None:
         until = str(until)
     else:
         until = ""
     hash = hashlib.sha1(
-        "%d,%s,%s,%d,%d,%s"
-        % (from_, until, prefix, cursor, total, django.conf.settings.SECRET_KEY)
+        "%d,%d,%s,%s,%d,%d,%s"
+        % (from_, fromId, until, prefix, cursor, total, django.conf.settings.SECRET_KEY)
     ).hexdigest()[::4]
-    return "%d,%s,%s,%d,%d,%s" % (from_, until, prefix, cursor, total, hash)
+    return "%d,%d,%s,%s,%d,%d,%s" % (from_, fromId, until, prefix, cursor, total, hash)
 
 
 def _unpackResumptionToken(token):
+    # Returns (from_, fromId, until, prefix, cursor, total).  Tokens
+    # issued before keyset positions were introduced lack fromId; for
+    # those, fromId is returned as None, and harvesting resumes with
+    # the identifiers whose update times strictly follow from_.
     try:
-        from_, until, prefix, cursor, total, hash1 = token.split(",")
+        l = token.split(",")
+        if len(l) == 6:
+            l.insert(1, None)
+        from_, fromId, until, prefix, cursor, total, hash1 = l
+        if fromId is None:
+            s = "%s,%s,%s,%s,%s" % (from_, until, prefix, cursor, total)
+        else:
+            s = "%s,%s,%s,%s,%s,%s" % (from_, fromId, until, prefix, cursor, total)
         hash2 = hashlib.sha1(
-            "%s,%s,%s,%s,%s,%s"
-            % (from_, until, prefix, cursor, total, django.conf.settings.SECRET_KEY)
+            "%s,%s" % (s, django.conf.settings.SECRET_KEY)
         ).hexdigest()[::4]
         assert hash1 == hash2
+        if fromId is not None:
+            fromId = int(fromId)
         if len(until) > 0:
             until = int(until)
         else:
             until = None
-        return (int(from_), until, prefix, int(cursor), int(total))
+        return (int(from_), fromId, until, prefix, int(cursor), int(total))
     except:
         return None
 
 
+def _getCompleteListSize(from_, until, q):
+    # Returns the number of identifiers in query 'q', which selects the
+    # identifiers in the range (from_, until].  Sizes are cached for
+    # 'oai.list_size_cache_lifetime' seconds so that harvesters that
+    # repeatedly start the same (typically, full) harvest don't each
+    # incur a count over the entire range.  The size is advisory only.
+    now = time.time()
+    _listSizeCacheLock.acquire()
+    try:
+        t = _listSizeCache.get((from_, until))
+    finally:
+        _listSizeCacheLock.release()
+    if t is not None and now - t[1] < _listSizeCacheLifetime:
+        return t[0]
+    total = q.count()
+    _listSizeCacheLock.acquire()
+    try:
+        if len(_listSizeCache) >= _maxListSizeCacheEntries:
+            _listSizeCache.clear()
+        _listSizeCache[(from_, until)] = (total, now)
+    finally:
+        _listSizeCacheLock.release()
+    return total
+
+
 def _buildDublinCoreRecord(identifier):
     root = lxml.etree.Element(
         "{http://www.openarchives.org/OAI/2.0/oai_dc/}dc",
@@ -210,6 +269,115 @@ def _buildDublinCoreRecord(identifier):
     return root
 
 
+_metadataPrefixes = ["oai_dc", "datacite"]
+
+
+def _renderRecord(identifier, prefix):
+    # Returns the metadata record of SearchIdentifier 'identifier' in
+    # metadata format 'prefix' as an unencoded Unicode string.
+    if prefix == "oai_dc":
+        return lxml.etree.tostring(_buildDublinCoreRecord(identifier), encoding=unicode)
+    elif prefix == "datacite":
+        return datacite.upgradeDcmsRecord(identifier.dataciteMetadata())
+    else:
+        assert False, "unhandled case"
+
+
+def cacheRecords(identifiers):
+    """
+  Renders and caches the OAI-PMH metadata records of 'identifiers', a
+  list of SearchIdentifier objects that have just been added to or
+  updated in the search database.  Cached records of identifiers that
+  are not OAI-visible are removed.  Does nothing if the record cache
+  is disabled.
+  """
+    if not _recordCacheEnabled:
+        return
+    records = []
+    for i in identifiers:
+        if not i.oaiVisible:
+            continue
+        try:
+            oaiDc, dc = [_renderRecord(i, p) for p in _metadataPrefixes]
+        except Exception:
+            # The identifier's records are left uncached; the error
+            # will surface if and when they are harvested.
+            continue
+        records.append(
+            ezidapp.models.SearchOaiRecord(
+                identifier=i.identifier,
+                updateTime=i.updateTime,
+                oaiDc=oaiDc,
+                datacite=dc,
+            )
+        )
+    with django.db.transaction.atomic(using="search"):
+        uncacheRecords([i.identifier for i in identifiers])
+        ezidapp.models.SearchOaiRecord.objects.bulk_create(records)
+
+
+def uncacheRecords(identifiers):
+    """
+  Removes any cached OAI-PMH metadata records of 'identifiers', a list
+  of qualified, normalized identifiers.  Does nothing if the record
+  cache is disabled.
+  """
+    if not _recordCacheEnabled or len(identifiers) == 0:
+        return
+    ezidapp.models.SearchOaiRecord.objects.filter(identifier__in=identifiers).delete()
+
+
+def _getCachedRecords(identifiers):
+    # Returns a dictionary mapping the identifiers in 'identifiers', a
+    # list of SearchIdentifier objects, to dictionaries mapping metadata
+    # prefixes to their current cached records.  Identifiers lacking
+    # current cached records are omitted.
+    if not _recordCacheEnabled or len(identifiers) == 0:
+        return {}
+    updateTimes = dict((i.identifier, i.updateTime) for i in identifiers)
+    return dict(
+        (r.identifier, {"oai_dc": r.oaiDc, "datacite": r.datacite})
+        for r in ezidapp.models.SearchOaiRecord.objects.filter(
+            identifier__in=updateTimes.keys()
+        )
+        if r.updateTime == updateTimes[r.identifier]
+    )
+
+
+def _buildRecordResponse(oaiRequest, body, records):
+    # Builds a response as _buildResponse does, except that the
+    # metadata records in 'records', a list of unencoded Unicode
+    # strings, are substituted, in document order, for placeholder
+    # comments in 'body' created by _recordPlaceholder.  Records are
+    # thus serialized only once, when rendered, and are never parsed.
+    parts = _buildResponse(oaiRequest, body).split(
+        "<!--%s-->" % _recordPlaceholder.marker
+    )
+    assert len(parts) == len(records) + 1
+    l = [parts[0]]
+    for r, p in zip(records, parts[1:]):
+        l.append(r.encode("UTF-8"))
+        l.append(p)
+    return "".join(l)
+
+
+def _recordPlaceholder():
+    return lxml.etree.Comment(_recordPlaceholder.marker)
+
+
+_recordPlaceholder.marker = "record-" + uuid.uuid4().hex
+
+
+def _getRecord(identifier, prefix, cachedRecords):
+    # Returns the metadata record of SearchIdentifier 'identifier' in
+    # metadata format 'prefix' as an unencoded Unicode string, using the
+    # record in 'cachedRecords' (see _getCachedRecords) if there is one.
+    if identifier.identifier in cachedRecords:
+        return cachedRecords[identifier.identifier][prefix]
+    else:
+        return _renderRecord(identifier, prefix)
+
+
 def _doGetRecord(oaiRequest):
     id = util.normalizeIdentifier(oaiRequest[1]["identifier"])
     if id == None:
@@ -220,14 +388,11 @@ def _doGetRecord(oaiRequest):
         return _error(oaiRequest, "idDoesNotExist")
     if not identifier.oaiVisible:
         return _error(oaiRequest, "idDoesNotExist")
-    if oaiRequest[1]["metadataPrefix"] == "oai_dc":
-        me = _buildDublinCoreRecord(identifier)
-    elif oaiRequest[1]["metadataPrefix"] == "datacite":
-        me = datacite.upgradeDcmsRecord(
-            identifier.dataciteMetadata(), returnString=False
-        )
-    else:
+    if oaiRequest[1]["metadataPrefix"] not in _metadataPrefixes:
         return _error(oaiRequest, "cannotDisseminateFormat")
+    me = _getRecord(
+        identifier, oaiRequest[1]["metadataPrefix"], _getCachedRecords([identifier])
+    )
     root = lxml.etree.Element(_q("GetRecord"))
     r = lxml.etree.SubElement(root, _q("record"))
     h = lxml.etree.SubElement(r, _q("header"))
@@ -235,8 +400,8 @@ def _doGetRecord(oaiRequest):
     lxml.etree.SubElement(h, _q("datestamp")).text = util.formatTimestampZulu(
         identifier.updateTime
     )
-    lxml.etree.SubElement(r, _q("metadata")).append(me)
-    return _buildResponse(oaiRequest, root)
+    lxml.etree.SubElement(r, _q("metadata")).append(_recordPlaceholder())
+    return _buildRecordResponse(oaiRequest, root, [me])
 
 
 def _doIdentify(oaiRequest):
@@ -261,10 +426,10 @@ def _doHarvest(oaiRequest, batchSize, includeMetadata):
         r = _unpackResumptionToken(oaiRequest[1]["resumptionToken"])
         if r == None:
             return _error(oaiRequest, "badResumptionToken")
-        from_, until, prefix, cursor, total = r
+        from_, fromId, until, prefix, cursor, total = r
     else:
         prefix = oaiRequest[1]["metadataPrefix"]
-        if prefix not in ["oai_dc", "datacite"]:
+        if prefix not in _metadataPrefixes:
             return _error(oaiRequest, "cannotDisseminateFormat")
         if "set" in oaiRequest[1]:
             return _error(oaiRequest, "noSetHierarchy")
@@ -291,15 +456,30 @@ def _doHarvest(oaiRequest, batchSize, includeMetadata):
                     return _error(oaiRequest, "badArgument", "'until' precedes 'from'")
         else:
             until = None
+        fromId = None
         cursor = 0
         total = None
-    q = ezidapp.models.SearchIdentifier.objects.filter(oaiVisible=True).filter(
-        updateTime__gt=from_
-    )
+    # Identifiers are harvested in (updateTime, id) order, which the
+    # (oaiVisible, updateTime) index supplies directly, as InnoDB
+    # secondary indexes implicitly end with the primary key.  Each
+    # batch thus costs a single index range scan starting at the
+    # keyset position carried in the resumption token.
+    q = ezidapp.models.SearchIdentifier.objects.filter(oaiVisible=True)
+    if fromId == None:
+        q = q.filter(updateTime__gt=from_)
+    else:
+        q = q.filter(updateTime__gte=from_).filter(
+            django.db.models.Q(updateTime__gt=from_) | django.db.models.Q(id__gt=fromId)
+        )
     if until != None:
         q = q.filter(updateTime__lte=until)
-    q = q.select_related("profile").order_by("updateTime")
-    ids = list(q[:batchSize])
+    # We retrieve one identifier more than the batch size to determine
+    # whether any identifiers remain after this batch.
+    ids = list(
+        q.order_by("updateTime", "id").only("id", "identifier", "updateTime")[
+            : batchSize + 1
+        ]
+    )
     # Note a bug in the protocol itself: if a resumption token was
     # supplied, we are required to return a (possibly empty) token, but
     # the only way to return a resumption token is to return at least
@@ -309,65 +489,47 @@ def _doHarvest(oaiRequest, batchSize, includeMetadata):
     # we are left with no legal response.
     if len(ids) == 0:
         return _error(oaiRequest, "noRecordsMatch")
-    # Our algorithm is as follows.  If we received fewer records than we
-    # requested, then the harvest must be complete.  Otherwise, there
-    # may be more records.  In that case, let T be the update time of
-    # the last identifier received, and let I be the last identifier
-    # received whose update time strictly precedes T.  Then in this
-    # batch we return identifiers up through and including I, and use
-    # I's update time as the exclusive lower bound in the new resumption
-    # token.  Identifier update times in EZID are almost (but not quite)
-    # unique, and hence if the batch size is 100 we will typically
-    # return 99 identifiers; the 100th identifier will be returned as
-    # the first identifier in the next request.  What if every
-    # identifier in the batch has update time T?  Realistically that has
-    # no chance of happening, but for theoretical purity we repeat the
-    # process using a larger batch size.  In the limiting case the batch
-    # size would get so large that it would encompass every remaining
-    # identifier.
-    if len(ids) == batchSize:
-        last = None
-        for i in range(len(ids) - 2, -1, -1):
-            if ids[i].updateTime < ids[-1].updateTime:
-                last = i
-                break
-        if last == None:
-            # Truly exceptional case.
-            return _doHarvest(oaiRequest, batchSize * 2, includeMetadata)
-    else:
-        last = len(ids) - 1
+    more = len(ids) > batchSize
+    ids = ids[:batchSize]
+    records = []
+    if includeMetadata:
+        cachedRecords = _getCachedRecords(ids)
+        # Identifiers lacking current cached records are retrieved in
+        # full, in a single query, and rendered on the fly.
+        uncached = [i.id for i in ids if i.identifier not in cachedRecords]
+        if len(uncached) > 0:
+            d = dict(
+                (i.id, i)
+                for i in ezidapp.models.SearchIdentifier.objects.filter(
+                    id__in=uncached
+                ).select_related("profile")
+            )
+            ids = [d.get(i.id, i) for i in ids]
     e = lxml.etree.Element(_q(oaiRequest[0]))
-    for i in range(last + 1):
+    for i in ids:
         if includeMetadata:
             r = lxml.etree.SubElement(e, _q("record"))
             h = lxml.etree.SubElement(r, _q("header"))
         else:
             h = lxml.etree.SubElement(e, _q("header"))
-        lxml.etree.SubElement(h, _q("identifier")).text = ids[i].identifier
+        lxml.etree.SubElement(h, _q("identifier")).text = i.identifier
         lxml.etree.SubElement(h, _q("datestamp")).text = util.formatTimestampZulu(
-            ids[i].updateTime
+            i.updateTime
         )
         if includeMetadata:
-            if prefix == "oai_dc":
-                me = _buildDublinCoreRecord(ids[i])
-            elif prefix == "datacite":
-                me = datacite.upgradeDcmsRecord(
-                    ids[i].dataciteMetadata(), returnString=False
-                )
-            else:
-                assert False, "unhandled case"
-            lxml.etree.SubElement(r, _q("metadata")).append(me)
-    if "resumptionToken" in oaiRequest[1] or len(ids) == batchSize:
+            records.append(_getRecord(i, prefix, cachedRecords))
+            lxml.etree.SubElement(r, _q("metadata")).append(_recordPlaceholder())
+    if "resumptionToken" in oaiRequest[1] or more:
         if total == None:
-            total = q.count()
+            total = _getCompleteListSize(from_, until, q)
         rt = lxml.etree.SubElement(e, _q("resumptionToken"))
         rt.attrib["cursor"] = str(cursor)
         rt.attrib["completeListSize"] = str(total)
-        if len(ids) == batchSize:
+        if more:
             rt.text = _buildResumptionToken(
-                ids[last].updateTime, until, prefix, cursor + last + 1, total
+                ids[-1].updateTime, ids[-1].id, until, prefix, cursor + len(ids), total
             )
-    return _buildResponse(oaiRequest, e)
+    return _buildRecordResponse(oaiRequest, e, records)
 
 
 def _doListMetadataFormats(oaiRequest):
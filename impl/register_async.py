@@ -17,7 +17,6 @@
 import django.db
 import django.db.transaction
 import httplib
-import random
 import threading
 import time
 import urllib2
@@ -26,6 +25,49 @@ import ezidapp.models
 import log
 import util
 
+# Rows are loaded from the queue table into the in-memory cache, in
+# queue order, whenever the number of cached rows falls to the low
+# watermark; the cache is topped up to the high watermark.  When
+# operations are rate limited, the cache holds at most
+# '_perKeyRowLimit' rows for any one key, so that a burst of
+# operations for one key does not keep other keys' operations queued
+# behind it out of the cache.  To find those, up to '_scanLimit'
+# queue entries (rather than '_highWatermark') are scanned per load.
+_highWatermark = 1000
+_lowWatermark = 250
+_perKeyRowLimit = 100
+_scanLimit = 10000
+
+
+class _TokenBucket(object):
+    # A token bucket rate limiter.  Tokens accrue at 'rate' per second,
+    # up to 'burst' tokens, and each operation takes one.  Buckets are
+    # guarded by the state holder lock.
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.time = time.time()
+
+    def _refill(self, now):
+        if now > self.time:
+            self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate)
+            self.time = now
+
+    def take(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        else:
+            return False
+
+    def delay(self, now):
+        # Returns the time in seconds until a token is available.
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
 
 class _StateHolder(object):
     def __init__(
@@ -42,6 +84,11 @@ class _StateHolder(object):
         reattemptDelay,
         enabledFlagHolder,
         threadNameHolder,
+        minWorkerThreads=1,
+        maxWorkerThreads=1,
+        rateLimitKeyFunction=None,
+        rateLimit=0,
+        rateLimitBurst=1,
     ):
         # Configuration variables.
         self.registrar = registrar
@@ -63,12 +110,31 @@ class _StateHolder(object):
         self.reattemptDelay = reattemptDelay
         self.enabledFlagHolder = enabledFlagHolder
         self.threadNameHolder = threadNameHolder
+        self.minWorkerThreads = minWorkerThreads
+        self.maxWorkerThreads = maxWorkerThreads
+        self.rateLimitKeyFunction = rateLimitKeyFunction
+        self.rateLimit = rateLimit
+        self.rateLimitBurst = rateLimitBurst
         # State variables.  'loadedRows' is an in-memory cache of (a
-        # portion of) the queue table; permanent errors and duplicate
-        # identifiers have been removed.  Rows being actively processed by
-        # a worker thread have a 'beingProcessed' attribute added.
+        # portion of) the queue table, in queue order; permanent errors
+        # and duplicate identifiers have been removed.  Each row has a
+        # 'rateLimitKey' attribute added, and rows being actively
+        # processed by a worker thread have a 'beingProcessed' attribute
+        # added.  'buckets' maps rate limit keys to token buckets.  The
+        # worker counts and 'buckets' are guarded by 'lock' as well.
+        # 'rateLimitKeys' maps the seqs of rows fetched by the daemon
+        # thread to their rate limit keys, so that rows held back by the
+        # per-key limit need not be fetched again; it is used by the
+        # daemon thread only.
         self.loadedRows = []
+        self.buckets = {}
+        self.rateLimitKeys = {}
+        self.numWorkers = 0
+        self.numBusyWorkers = 0
+        self.nextWorkerIndex = 0
         self.lock = threading.Lock()
+        # Set by worker threads when the cache falls to the low watermark.
+        self.refillNeeded = threading.Event()
 
 
 class _AbortException(Exception):
@@ -113,56 +179,166 @@ def _loadedRowsLength(sh):
 
 
 @_lockLoadedRows
-def _setLoadedRows(sh, rows):
-    sh.loadedRows = rows
+def _loadedRowSeqs(sh):
+    return set(r.seq for r in sh.loadedRows)
+
+
+@_lockLoadedRows
+def _loadedRowKeyCounts(sh):
+    counts = {}
+    for r in sh.loadedRows:
+        counts[r.rateLimitKey] = counts.get(r.rateLimitKey, 0) + 1
+    return counts
+
+
+@_lockLoadedRows
+def _addLoadedRows(sh, rows):
+    seqs = set(r.seq for r in sh.loadedRows)
+    identifiers = set(r.identifier for r in sh.loadedRows)
+    for r in rows:
+        if len(sh.loadedRows) >= _highWatermark:
+            break
+        if r.seq not in seqs and r.identifier not in identifiers:
+            sh.loadedRows.append(r)
+            identifiers.add(r.identifier)
+    sh.loadedRows.sort(key=lambda r: r.seq)
+    return len(sh.loadedRows)
 
 
 @_lockLoadedRows
 def _deleteLoadedRows(sh, rows):
+    # Called by a worker thread when it has finished processing 'rows'.
+    n = len(sh.loadedRows)
     seqs = set(r.seq for r in rows)
     for i in range(len(sh.loadedRows) - 1, -1, -1):
         if sh.loadedRows[i].seq in seqs:
             del sh.loadedRows[i]
+    sh.numBusyWorkers -= 1
+    if n > _lowWatermark and len(sh.loadedRows) <= _lowWatermark:
+        sh.refillNeeded.set()
+
+
+def _bucket(sh, key):
+    if key == None:
+        return None
+    b = sh.buckets.get(key, None)
+    if b == None:
+        b = _TokenBucket(sh.rateLimit, sh.rateLimitBurst)
+        sh.buckets[key] = b
+    return b
 
 
 @_lockLoadedRows
 def _nextUnprocessedLoadedRows(sh):
+    # Returns (rows, delay).  A row is eligible only if a token can be
+    # taken from its rate limit key's bucket, so that rows for a key
+    # that has reached its rate limit are passed over in favor of rows
+    # for other keys.  If rows are waiting but none is eligible, 'delay'
+    # is the time in seconds until one will be; otherwise it is None.
     rows = []
+    delay = None
+    now = time.time()
     for r in sh.loadedRows:
         if not hasattr(r, "beingProcessed"):
             # We'll always return one row, if one can be found.  Multiple
             # rows will be returned only if they share the same operation
             # and the registrar supports the corresponding batch function.
-            if len(rows) == 0:
-                r.beingProcessed = True
-                rows.append(r)
-                if sh.functions["batch"][r.operation] == None:
-                    break
-            else:
-                if r.operation == rows[0].operation:
-                    r.beingProcessed = True
-                    rows.append(r)
-    return rows
-
-
-def _loadRows(sh, limit=1000):
-    qs = _queue(sh).objects.all().order_by("seq")[:limit]
+            if len(rows) > 0 and r.operation != rows[0].operation:
+                continue
+            b = _bucket(sh, r.rateLimitKey)
+            if b != None and not b.take(now):
+                if len(rows) == 0:
+                    d = b.delay(now)
+                    delay = d if delay == None else min(delay, d)
+                continue
+            r.beingProcessed = True
+            rows.append(r)
+            if sh.functions["batch"][r.operation] == None:
+                break
+    if len(rows) > 0:
+        sh.numBusyWorkers += 1
+        delay = None
+    return rows, delay
+
+
+def _rateLimitKey(sh, row):
+    # A row whose key cannot be computed (e.g., because its metadata
+    # is corrupt) is not rate limited; the worker that processes it
+    # will encounter and record the same error.
+    if sh.rateLimitKeyFunction == None or sh.rateLimit <= 0:
+        return None
+    try:
+        return sh.rateLimitKeyFunction(row.identifier, util.deblobify(row.metadata))
+    except Exception:
+        return None
+
+
+def _keyIsFull(counts, key):
+    return key != None and counts.get(key, 0) >= _perKeyRowLimit
+
+
+def _loadRows(sh, limit=None):
+    # Tops up the row cache.  To preserve the order of operations on an
+    # identifier, only the first row for an identifier (in queue order)
+    # is eligible to be loaded, and only if it has not encountered a
+    # permanent error.  Rows already loaded are left in place, and rows
+    # whose rate limit key already has its limit of rows loaded are
+    # passed over.  The queue is scanned by primary key and identifier
+    # only; full rows are then fetched for the eligible rows not
+    # already loaded, except those known to be passed over.
+    if limit == None:
+        if sh.rateLimitKeyFunction != None and sh.rateLimit > 0:
+            limit = _scanLimit
+        else:
+            limit = _highWatermark
+    entries = list(
+        _queue(sh)
+        .objects.order_by("seq")
+        .values_list("seq", "identifier", "errorIsPermanent")[:limit]
+    )
+    loaded = _loadedRowSeqs(sh)
     seen = set()
-    rows = []
-    for r in qs:
-        if r.identifier not in seen:
-            if not r.errorIsPermanent:
-                rows.append(r)
-            seen.add(r.identifier)
-    if len(rows) == 0 and len(qs) == limit:
+    seqs = []
+    for seq, identifier, errorIsPermanent in entries:
+        if identifier not in seen:
+            if not errorIsPermanent and seq not in loaded:
+                seqs.append(seq)
+            seen.add(identifier)
+    if len(seqs) == 0 and len(loaded) == 0 and len(entries) == limit:
         # Incredibly unlikely, but just in case: if our query returned a
         # full set of rows but we ended up selecting none (because they
         # all had permanent errors or are duplicates), try increasing the
         # limit.  In the limiting case, the entire table will be returned.
         return _loadRows(sh, limit * 2)
-    n = len(rows)
-    _setLoadedRows(sh, rows)
-    return n
+    keys = sh.rateLimitKeys
+    eligible = set(seqs)
+    for seq in keys.keys():
+        if seq not in eligible:
+            del keys[seq]
+    counts = _loadedRowKeyCounts(sh)
+    room = max(_highWatermark - len(loaded), 0)
+    rows = []
+    i = 0
+    while i < len(seqs) and len(rows) < room:
+        chunk = []
+        while i < len(seqs) and len(chunk) < 500:
+            if not (seqs[i] in keys and _keyIsFull(counts, keys[seqs[i]])):
+                chunk.append(seqs[i])
+            i += 1
+        # Rows finished since the scan above are not fetched: they have
+        # been deleted or marked as permanent errors.
+        for r in (
+            _queue(sh)
+            .objects.filter(seq__in=chunk, errorIsPermanent=False)
+            .order_by("seq")
+        ):
+            if r.seq not in keys:
+                keys[r.seq] = _rateLimitKey(sh, r)
+            r.rateLimitKey = keys[r.seq]
+            if len(rows) < room and not _keyIsFull(counts, r.rateLimitKey):
+                counts[r.rateLimitKey] = counts.get(r.rateLimitKey, 0) + 1
+                rows.append(r)
+    return _addLoadedRows(sh, rows)
 
 
 def _sleep(sh, duration=None):
@@ -170,17 +346,66 @@ def _sleep(sh, duration=None):
     time.sleep(duration or sh.idleSleep)
 
 
+def _startWorker(sh, i):
+    t = threading.Thread(
+        target=lambda: _workerThread(sh), name="%s.%d" % (sh.threadNameHolder[0], i)
+    )
+    t.setDaemon(True)
+    t.start()
+
+
+def _adjustWorkers(sh):
+    # Starts worker threads so that there is one for each row that is
+    # being processed or waiting to be, within the minimum and maximum
+    # numbers of workers.  Surplus workers retire on their own once
+    # they find themselves idle (cf. _retireWorker).
+    sh.lock.acquire()
+    try:
+        _checkAbort(sh)
+        numWaiting = len([r for r in sh.loadedRows if not hasattr(r, "beingProcessed")])
+        n = max(
+            min(
+                max(sh.numBusyWorkers + numWaiting, sh.minWorkerThreads),
+                sh.maxWorkerThreads,
+            )
+            - sh.numWorkers,
+            0,
+        )
+        indexes = range(sh.nextWorkerIndex, sh.nextWorkerIndex + n)
+        sh.nextWorkerIndex += n
+        sh.numWorkers += n
+    finally:
+        sh.lock.release()
+    for i in indexes:
+        _startWorker(sh, i)
+
+
+@_lockLoadedRows
+def _retireWorker(sh):
+    # Called by a worker that has been idle for an idle sleep; returns
+    # True if the worker should exit.
+    if sh.numWorkers > sh.minWorkerThreads:
+        sh.numWorkers -= 1
+        return True
+    else:
+        return False
+
+
 def _daemonThread(sh):
+    # The daemon thread keeps the row cache topped up and scales the
+    # worker threads to the amount of work loaded.  It wakes up early
+    # when the workers drain the cache to the low watermark.
     _sleep(sh)
     while True:
         try:
-            while True:
-                n = _loadRows(sh)
-                if n > 0:
-                    break
-                _sleep(sh)
-            while _loadedRowsLength(sh) > 0:
+            sh.refillNeeded.clear()
+            if _loadedRowsLength(sh) <= _lowWatermark:
+                _loadRows(sh)
+            _adjustWorkers(sh)
+            if _loadedRowsLength(sh) == 0:
                 _sleep(sh)
+            else:
+                sh.refillNeeded.wait(sh.idleSleep)
         except _AbortException:
             break
         except Exception, e:
@@ -220,16 +445,22 @@ def callWrapper(sh, rows, methodName, function, *args):
 
 
 def _workerThread(sh):
-    # Sleep between 1x and 2x the idle sleep, to give the main daemon a
-    # chance to load the row cache and to prevent the workers from
-    # running synchronously.
-    time.sleep(sh.idleSleep * (random.random() + 1))
+    # Workers are started by the daemon thread once it has loaded the
+    # row cache.
     while True:
         try:
+            idle = False
             while True:
-                rows = _nextUnprocessedLoadedRows(sh)
+                rows, delay = _nextUnprocessedLoadedRows(sh)
                 if len(rows) > 0:
                     break
+                if delay != None:
+                    # Rows are waiting on their rate limits.
+                    time.sleep(min(delay, sh.idleSleep))
+                    continue
+                if idle and _retireWorker(sh):
+                    return
+                idle = True
                 _sleep(sh)
             try:
                 if len(rows) == 1:
@@ -284,13 +515,20 @@ def enqueueIdentifier(model, identifier, operation, blob):
   "delete".  'blob' is the identifier's metadata dictionary in blob
   form.
   """
-    e = model(
+    newQueueEntry(model, identifier, operation, blob).save()
+
+
+def newQueueEntry(model, identifier, operation, blob):
+    """
+  Returns a new, unsaved entry for the asynchronous registration queue
+  named by 'model'.  The arguments are as in enqueueIdentifier.
+  """
+    return model(
         enqueueTime=int(time.time()),
         identifier=identifier,
         metadata=blob,
         operation=ezidapp.models.RegistrationQueue.operationLabelToCode(operation),
     )
-    e.save()
 
 
 def launch(
@@ -307,6 +545,10 @@ def launch(
     reattemptDelay,
     enabledFlagHolder,
     threadNameHolder,
+    minWorkerThreads=1,
+    rateLimitKeyFunction=None,
+    rateLimit=0,
+    rateLimitBurst=1,
 ):
     """
   Launches a registration thread (and subservient worker threads).
@@ -325,6 +567,16 @@ def launch(
   'enabledFlagHolder' is a singleton list containing a boolean flag
   that indicates if the thread is enabled.  'threadNameHolder' is a
   singleton list containing the string name of the current thread.
+
+  Worker threads are started and retired with the amount of queued
+  work, between 'minWorkerThreads' and 'numWorkerThreads'.  If
+  'rateLimitKeyFunction' is not None and 'rateLimit' is positive,
+  operations are rate limited per key: the function should accept
+  arguments (identifier, metadata) and return a key (e.g., a DataCite
+  allocator) or None, and operations for each key are limited to
+  'rateLimit' per second with bursts of up to 'rateLimitBurst'.  An
+  operation that would exceed its key's limit is deferred, and other
+  keys' operations are processed in the meantime.
   """
     sh = _StateHolder(
         registrar,
@@ -339,12 +591,12 @@ def launch(
         reattemptDelay,
         enabledFlagHolder,
         threadNameHolder,
+        min(minWorkerThreads, numWorkerThreads),
+        numWorkerThreads,
+        rateLimitKeyFunction,
+        rateLimit,
+        rateLimitBurst,
     )
-    name = threadNameHolder[0]
-    t = threading.Thread(target=lambda: _daemonThread(sh), name=name)
+    t = threading.Thread(target=lambda: _daemonThread(sh), name=threadNameHolder[0])
     t.setDaemon(True)
     t.start()
-    for i in range(numWorkerThreads):
-        t = threading.Thread(target=lambda: _workerThread(sh), name="%s.%d" % (name, i))
-        t.setDaemon(True)
-        t.start()
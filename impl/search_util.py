@@ -13,7 +13,9 @@
 #
 # -----------------------------------------------------------------------------
 
+import collections
 import django.conf
+import django.core.signing
 import django.db
 import django.db.models
 import django.db.utils
@@ -36,12 +38,26 @@ _minimumWordLength = None
 _stopwords = None
 _maxTargetLength = None
 _numActiveSearches = 0
+_countCache = collections.OrderedDict()
+_countCacheSize = None
+_countCacheTtl = None
+_countEstimateThreshold = None
+_updateGeneration = 0
 
 
 def loadConfig():
     global _reconnectDelay, _fulltextSupported, _minimumWordLength
     global _stopwords, _maxTargetLength
+    global _countCacheSize, _countCacheTtl, _countEstimateThreshold
     _reconnectDelay = int(config.get("databases.reconnect_delay"))
+    _countCacheSize = int(config.get("search.count_cache_size"))
+    _countCacheTtl = int(config.get("search.count_cache_ttl"))
+    _countEstimateThreshold = int(config.get("search.count_estimate_threshold"))
+    _lock.acquire()
+    try:
+        _countCache.clear()
+    finally:
+        _lock.release()
     _fulltextSupported = django.conf.settings.DATABASES["search"][
         "fulltextSearchSupported"
     ]
@@ -489,7 +505,129 @@ def formulateQuery(
             orderBy = "searchableResourceType"
         else:
             assert False, "column does not support ordering"
-        qs = qs.order_by(prefix + orderBy)
+        if orderBy in defer:
+            # The ordering column is needed to make cursors.
+            qs = qs.defer(None).defer(*[f for f in defer if f != orderBy])
+        if orderBy in _keysetColumns and orderBy != "identifier":
+            # Break ties by ID so that the ordering is total, as keyset
+            # pagination requires.  (In MySQL, secondary indexes
+            # implicitly end with the primary key, so the ordering is
+            # still supported by the indexes declared in SearchIdentifier.)
+            qs = qs.order_by(prefix + orderBy, prefix + "id")
+        else:
+            qs = qs.order_by(prefix + orderBy)
+    return qs
+
+
+# Columns (after mapping as in formulateQuery) that support keyset
+# pagination.  Excluded are nullable columns and columns in related
+# tables.
+_keysetColumns = [
+    "identifier",
+    "createTime",
+    "updateTime",
+    "status",
+    "exported",
+    "isTest",
+    "hasMetadata",
+    "publicSearchVisible",
+    "linkIsBroken",
+    "hasIssues",
+    "resourceCreatorPrefix",
+    "resourceTitlePrefix",
+    "resourcePublisherPrefix",
+    "searchableResourceType",
+]
+
+_cursorSalt = "search_util.cursor"
+
+
+def _keysetColumn(orderBy):
+    # Returns (descending, column) for an orderBy value as accepted by
+    # formulateQuery, or None if the ordering does not support keyset
+    # pagination.
+    if orderBy == None:
+        return None
+    descending = orderBy.startswith("-")
+    column = orderBy.lstrip("-")
+    column = {
+        "identifierType": "identifier",
+        "resourceCreator": "resourceCreatorPrefix",
+        "resourceTitle": "resourceTitlePrefix",
+        "resourcePublisher": "resourcePublisherPrefix",
+        "resourceType": "searchableResourceType",
+    }.get(column, column)
+    if column not in _keysetColumns:
+        return None
+    return (descending, column)
+
+
+def supportsCursor(orderBy):
+    """
+  Returns True if search results in the ordering 'orderBy' (as in
+  formulateQuery) can be paginated by cursor; see makeCursor.
+  """
+    return _keysetColumn(orderBy) != None
+
+
+def makeCursor(identifier, orderBy, forward=True, data=None):
+    """
+  Returns an opaque cursor for keyset pagination.  Passed to
+  executeSearch, the cursor selects the results that follow
+  (forward=True) or precede (forward=False) 'identifier', a
+  SearchIdentifier object, in the ordering 'orderBy'.  'data' is an
+  arbitrary JSON-serializable value that is carried along in the
+  cursor and can be retrieved with getCursorData, e.g., a page number.
+  The ordering must support cursors; see supportsCursor.
+  """
+    descending, column = _keysetColumn(orderBy)
+    key = [getattr(identifier, column)]
+    if column != "identifier":
+        key.append(identifier.id)
+    return django.core.signing.dumps(
+        [orderBy, forward, key, data], salt=_cursorSalt, compress=True
+    )
+
+
+def _decodeCursor(cursor, orderBy):
+    # Returns (forward, key, data), or None if the cursor is invalid or
+    # was made for a different ordering.
+    try:
+        o, forward, key, data = django.core.signing.loads(cursor, salt=_cursorSalt)
+    except Exception:
+        return None
+    if o != orderBy:
+        return None
+    return (forward, key, data)
+
+
+def getCursorData(cursor, orderBy):
+    """
+  Returns the data carried in a cursor (see makeCursor), or None if
+  the cursor is invalid or was made for an ordering other than
+  'orderBy'.
+  """
+    c = _decodeCursor(cursor, orderBy)
+    return c[2] if c != None else None
+
+
+def _applyCursor(qs, orderBy, forward, key):
+    # Restricts a QuerySet ordered by 'orderBy' to the results after
+    # (or before) a cursor position, and, for backward cursors, reverses
+    # the ordering.
+    descending, column = _keysetColumn(orderBy)
+    op = "lt" if descending == forward else "gt"
+    if column == "identifier":
+        qs = qs.filter(**{("identifier__" + op): key[0]})
+    else:
+        # The redundant bound on the column lets MySQL use a range scan.
+        qs = qs.filter(
+            django.db.models.Q(**{(column + "__" + op + "e"): key[0]}),
+            django.db.models.Q(**{(column + "__" + op): key[0]})
+            | django.db.models.Q(**{column: key[0], ("id__" + op): key[1]}),
+        )
+    if not forward:
+        qs = qs.reverse()
     return qs
 
 
@@ -520,18 +658,125 @@ def _isMysqlFulltextError(exception):
     )
 
 
+def _normalizeConstraints(constraints):
+    # Returns a hashable form of a constraints dictionary in which
+    # equivalent constraints compare equal.
+    def normalize(v):
+        if isinstance(v, list):
+            return tuple(sorted(v))
+        elif isinstance(v, basestring):
+            return v.strip()
+        else:
+            return v
+
+    return tuple(sorted((k, normalize(v)) for k, v in constraints.items()))
+
+
+def noteSearchDatabaseUpdate():
+    """
+  Records that the search database has been updated, invalidating
+  cached counts (see executeSearchCountOnly).  To be called by
+  daemons that update the search database.
+  """
+    global _updateGeneration
+    _lock.acquire()
+    try:
+        _updateGeneration += 1
+    finally:
+        _lock.release()
+
+
+def _getUpdateHighWaterMark():
+    # Returns a token that changes when the search database may have
+    # changed.  Updates made in this process are counted by
+    # noteSearchDatabaseUpdate.  Updates made by the background
+    # processing daemon in another process are detected through the
+    # update queue: an identifier change is enqueued, changing the
+    # queue's maximum sequence number, and once processed is deleted,
+    # which changes the queue's minimum sequence number when the head of
+    # the queue is processed.  Both are read off the primary key index.
+    # Other updates made in other processes (e.g., by the link checker
+    # update daemon) are not detected, and are reflected in counts only
+    # once cache entries expire.
+    r = ezidapp.models.UpdateQueue.objects.aggregate(
+        django.db.models.Max("seq"), django.db.models.Min("seq")
+    )
+    return (r["seq__max"], r["seq__min"], _updateGeneration)
+
+
+def _getCachedCount(key, hwm, approximate):
+    _lock.acquire()
+    try:
+        e = _countCache.get(key)
+        if e == None:
+            return None
+        if e[0] != hwm or e[1] < time.time() - _countCacheTtl:
+            del _countCache[key]
+            return None
+        if not approximate and not e[3]:
+            return None
+        # Move the entry to the most-recently-used end.
+        del _countCache[key]
+        _countCache[key] = e
+        return e[2]
+    finally:
+        _lock.release()
+
+
+def _cacheCount(key, hwm, count, exact):
+    _lock.acquire()
+    try:
+        _countCache.pop(key, None)
+        _countCache[key] = (hwm, time.time(), count, exact)
+        while len(_countCache) > _countCacheSize:
+            _countCache.popitem(last=False)
+    finally:
+        _lock.release()
+
+
+def isEstimate(count):
+    """
+  Returns True if 'count', as returned by executeSearchCountOnly with
+  approximate=True, is an estimate, i.e., if the number of results is
+  known only to be greater than getCountEstimateThreshold().
+  """
+    return _countEstimateThreshold > 0 and count > _countEstimateThreshold
+
+
+def getCountEstimateThreshold():
+    """
+  Returns the result count beyond which approximate counts are
+  estimates.
+  """
+    return _countEstimateThreshold
+
+
 def executeSearchCountOnly(
-    user, constraints, selectRelated=defaultSelectRelated, defer=defaultDefer
+    user,
+    constraints,
+    selectRelated=defaultSelectRelated,
+    defer=defaultDefer,
+    approximate=False,
 ):
     """
   Executes a search database query, returning just the number of
   results.  'user' is the requestor, and should be an authenticated
   StoreUser object or AnonymousUser.  'constraints', 'selectRelated',
   and 'defer' are as in formulateQuery above.
+
+  If 'approximate' is True, counting stops once the count estimate
+  threshold is exceeded, and the returned count may be an estimate;
+  see isEstimate.
+
+  Counts are cached by user and constraints until the search database
+  is updated (or, since not all updates can be detected, until the
+  cache entry expires).
   """
     tid = uuid.uuid1()
     try:
         _modifyActiveCount(1)
+        key = (user.pid, _normalizeConstraints(constraints))
+        hwm = _getUpdateHighWaterMark()
         qs = formulateQuery(constraints, selectRelated=selectRelated, defer=defer)
         log.begin(
             tid,
@@ -545,7 +790,13 @@ def executeSearchCountOnly(
                 operator.__concat__, [[k, unicode(v)] for k, v in constraints.items()]
             )
         )
-        c = qs.count()
+        c = _getCachedCount(key, hwm, approximate)
+        if c == None:
+            if approximate and _countEstimateThreshold > 0:
+                c = qs[: _countEstimateThreshold + 1].count()
+            else:
+                c = qs.count()
+            _cacheCount(key, hwm, c, not (approximate and isEstimate(c)))
     except Exception, e:
         # MySQL's FULLTEXT engine chokes on a too-frequently-occurring
         # word (call it a "bad" word) that is not on its own stopword
@@ -563,7 +814,9 @@ def executeSearchCountOnly(
                 if f in constraints2:
                     constraints2[f] = constraints2[f].replace('"', " ")
             log.success(tid, "-1")
-            return executeSearchCountOnly(user, constraints2, selectRelated, defer)
+            return executeSearchCountOnly(
+                user, constraints2, selectRelated, defer, approximate
+            )
         else:
             log.error(tid, e)
             raise
@@ -582,6 +835,7 @@ def executeSearch(
     orderBy=None,
     selectRelated=defaultSelectRelated,
     defer=defaultDefer,
+    cursor=None,
 ):
     """
   Executes a search database query, returning an evaluated QuerySet.
@@ -589,6 +843,11 @@ def executeSearch(
   object or AnonymousUser.  'from_' and 'to' are range bounds, and
   must be supplied.  'constraints', 'orderBy', 'selectRelated', and
   'defer' are as in formulateQuery above.
+
+  If 'cursor' is supplied and valid for 'orderBy' (see makeCursor),
+  keyset pagination is used instead: the results are the (to-from_)
+  results that follow or precede the cursor position, and 'from_' is
+  otherwise unused.  In this case the return is a list.
   """
     tid = uuid.uuid1()
     try:
@@ -611,7 +870,14 @@ def executeSearch(
                 operator.__concat__, [[k, unicode(v)] for k, v in constraints.items()]
             )
         )
-        qs = qs[from_:to]
+        c = _decodeCursor(cursor, orderBy) if cursor != None else None
+        if c != None:
+            forward, key, data = c
+            qs = list(_applyCursor(qs, orderBy, forward, key)[: to - from_])
+            if not forward:
+                qs.reverse()
+        else:
+            qs = qs[from_:to]
         c = len(qs)
     except Exception, e:
         # MySQL's FULLTEXT engine chokes on a too-frequently-occurring
@@ -631,7 +897,7 @@ def executeSearch(
                     constraints2[f] = constraints2[f].replace('"', " ")
             log.success(tid, "-1")
             return executeSearch(
-                user, constraints2, from_, to, orderBy, selectRelated, defer
+                user, constraints2, from_, to, orderBy, selectRelated, defer, cursor
             )
         else:
             log.error(tid, e)
@@ -17,6 +17,10 @@ class Startup(django.apps.AppConfig):
             import config
             config.load()
 
+            import cm_codec
+            cm_codec.loadConfig()
+            config.registerReloadListener(cm_codec.loadConfig)
+
             import ezidapp.models.shoulder
             ezidapp.models.shoulder.loadConfig()
             config.registerReloadListener(ezidapp.models.shoulder.loadConfig)
@@ -66,6 +70,10 @@ class Startup(django.apps.AppConfig):
         ezid.loadConfig()
         config.registerReloadListener(ezid.loadConfig)
 
+        import linkcheck
+        linkcheck.loadConfig()
+        config.registerReloadListener(linkcheck.loadConfig)
+
         import linkcheck_update
         linkcheck_update.loadConfig()
         config.registerReloadListener(linkcheck_update.loadConfig)
@@ -74,6 +82,10 @@ class Startup(django.apps.AppConfig):
         metadata.loadConfig()
         config.registerReloadListener(metadata.loadConfig)
 
+        import mint_reservoir
+        mint_reservoir.loadConfig()
+        config.registerReloadListener(mint_reservoir.loadConfig)
+
         import newsfeed
         newsfeed.loadConfig()
         config.registerReloadListener(newsfeed.loadConfig)
@@ -12,6 +12,20 @@
 # changes on statistics would require knowledge of an identifier's
 # pre-change state, which is not recorded.
 #
+# If incremental maintenance is enabled, the background processing
+# daemon (backproc.py) does track the effects of identifier changes,
+# using the search database's copy of an identifier as its pre-change
+# state: the identifier's statistics class is looked up before and
+# after the search database is updated, and the difference is applied
+# to the Statistics table.  Changes to users and groups are not
+# tracked, and the search database and Statistics table are not
+# updated atomically, so the full recomputation is still run, but only
+# every so many days, as a reconciliation.  If the background
+# processing daemon fails to apply changes after having updated the
+# search database, the changes cannot be recomputed from the search
+# database on a retry, and so it requests an early reconciliation
+# (see requestReconciliation).
+#
 # Author:
 #   Greg Janee <gjanee@ucop.edu>
 #
@@ -25,6 +39,7 @@ import datetime
 import django.db
 import django.db.models
 import django.db.transaction
+import django.db.utils
 import threading
 import time
 import uuid
@@ -37,6 +52,13 @@ _enabled = None
 _computeCycle = None
 _computeSameTimeOfDay = None
 _threadName = None
+_incremental = None
+_reconcileCycle = None
+_reconciliationRequested = threading.Event()
+
+# The identifier types (see _identifierType) computed by the grouped
+# statistics query.
+_identifierSchemes = ["ark", "doi", "uuid"]
 
 
 def _sameTimeOfDayDelta():
@@ -56,6 +78,42 @@ def _identifierType(id):
     return id.split(":")[0].upper()
 
 
+def _monthCase(minTime, maxTime):
+    # Returns an expression that maps an identifier's creation time to
+    # its month, for creation times in the range [minTime, maxTime].
+    # Month boundaries are computed here, in local time, so that the
+    # result agrees with _timestampToMonth.
+    whens = []
+    y, m = [int(c) for c in _timestampToMonth(minTime).split("-")]
+    while True:
+        month = "%04d-%02d" % (y, m)
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+        end = int(time.mktime((y, m, 1, 0, 0, 0, 0, 0, -1)))
+        whens.append(
+            django.db.models.When(
+                createTime__lt=end, then=django.db.models.Value(month)
+            )
+        )
+        if end > maxTime:
+            break
+    return django.db.models.Case(
+        *whens, output_field=django.db.models.CharField()
+    )
+
+
+def _typeCase():
+    return django.db.models.Case(
+        *[
+            django.db.models.When(
+                identifier__startswith=(s + ":"),
+                then=django.db.models.Value(s.upper()),
+            )
+            for s in _identifierSchemes
+        ],
+        output_field=django.db.models.CharField()
+    )
+
+
 def recomputeStatistics():
     """
   Recomputes and stores identifier statistics.  The old statistics are
@@ -68,69 +126,202 @@ def recomputeStatistics():
                 "group", "realm"
             )
         }
-        counts = {}
-        lastIdentifier = ""
-        while True:
-            qs = (
-                ezidapp.models.SearchIdentifier.objects.filter(
-                    identifier__gt=lastIdentifier
+        qs = ezidapp.models.SearchIdentifier.objects.filter(
+            isTest=False, owner__isnull=False
+        )
+        r = qs.aggregate(
+            minTime=django.db.models.Min("createTime"),
+            maxTime=django.db.models.Max("createTime"),
+        )
+        counts = []
+        if r["minTime"] != None:
+            counts = (
+                qs.annotate(
+                    statMonth=_monthCase(r["minTime"], r["maxTime"]),
+                    statType=_typeCase(),
                 )
-                .only("identifier", "owner_id", "createTime", "isTest", "hasMetadata")
-                .order_by("identifier")
+                .values("statMonth", "owner_id", "statType", "hasMetadata")
+                .annotate(statCount=django.db.models.Count("id"))
+                .order_by()
             )
-            qs = list(qs[:1000])
-            if len(qs) == 0:
-                break
-            for id in qs:
-                if not id.isTest and id.owner_id in users:
-                    t = (
-                        _timestampToMonth(id.createTime),
-                        id.owner_id,
-                        _identifierType(id.identifier),
-                        id.hasMetadata,
-                    )
-                    counts[t] = counts.get(t, 0) + 1
-            lastIdentifier = qs[-1].identifier
+        l = []
+        for c in counts:
+            if c["owner_id"] in users and c["statType"] != None:
+                s = ezidapp.models.Statistics(
+                    month=c["statMonth"],
+                    owner=users[c["owner_id"]][0],
+                    ownergroup=users[c["owner_id"]][1],
+                    realm=users[c["owner_id"]][2],
+                    type=c["statType"],
+                    hasMetadata=c["hasMetadata"],
+                    count=c["statCount"],
+                )
+                s.full_clean(validate_unique=False)
+                l.append(s)
         with django.db.transaction.atomic():
             ezidapp.models.Statistics.objects.all().delete()
-            for t, v in counts.items():
-                c = ezidapp.models.Statistics(
-                    month=t[0],
-                    owner=users[t[1]][0],
-                    ownergroup=users[t[1]][1],
-                    realm=users[t[1]][2],
-                    type=t[2],
-                    hasMetadata=t[3],
-                    count=v,
-                )
-                c.full_clean(validate_unique=False)
-                c.save(force_insert=True)
+            ezidapp.models.Statistics.objects.bulk_create(l, batch_size=1000)
     except Exception, e:
         log.otherError("stats.recomputeStatistics", e)
 
 
+def isIncremental():
+    """
+  Returns True if statistics are to be maintained incrementally by
+  the background processing daemon.
+  """
+    # The background processing daemon may start before this module's
+    # configuration is loaded.
+    if _incremental == None:
+        return config.get("daemons.statistics_incremental_enabled").lower() == "true"
+    return _incremental
+
+
+def getStatisticsKey(identifier):
+    """
+  Returns the key of the statistics class to which a SearchIdentifier
+  belongs, or None if the identifier is not counted in statistics.
+  Keys are the tuples
+
+    (month, owner ID, type, hasMetadata)
+
+  in which the owner is given by database ID.
+  """
+    if identifier.isTest or identifier.owner_id == None:
+        return None
+    return (
+        _timestampToMonth(identifier.createTime),
+        identifier.owner_id,
+        _identifierType(identifier.identifier),
+        identifier.hasMetadata,
+    )
+
+
+def getStatisticsKeys(identifiers):
+    """
+  Returns a dictionary that maps each of a list of identifiers (e.g.,
+  "ark:/99999/fk4foo") to the key of the statistics class to which
+  the identifier currently belongs as recorded in the search database
+  (see getStatisticsKey).  Identifiers not in the search database are
+  not included.
+  """
+    return {
+        i.identifier: getStatisticsKey(i)
+        for i in ezidapp.models.SearchIdentifier.objects.filter(
+            identifier__in=identifiers
+        ).only("identifier", "owner_id", "createTime", "isTest", "hasMetadata")
+    }
+
+
+def addDelta(deltas, oldKey, newKey):
+    """
+  Records in 'deltas', a dictionary that maps statistics keys to count
+  changes, the move of an identifier from statistics class 'oldKey' to
+  class 'newKey'.  Either key may be None.
+  """
+    if oldKey == newKey:
+        return
+    if oldKey != None:
+        deltas[oldKey] = deltas.get(oldKey, 0) - 1
+    if newKey != None:
+        deltas[newKey] = deltas.get(newKey, 0) + 1
+
+
+def applyDeltas(deltas):
+    """
+  Applies count changes as recorded by addDelta to the stored
+  identifier statistics.  Classes whose counts drop to zero are
+  removed.
+  """
+    deltas = {k: v for k, v in deltas.items() if v != 0}
+    if len(deltas) == 0:
+        return
+    users = {
+        u.id: (u.pid, u.group.pid, u.realm.name)
+        for u in ezidapp.models.SearchUser.objects.filter(
+            id__in=set(k[1] for k in deltas)
+        ).select_related("group", "realm")
+    }
+    with django.db.transaction.atomic():
+        for k, v in deltas.items():
+            if k[1] not in users:
+                continue
+            qs = ezidapp.models.Statistics.objects.filter(
+                month=k[0], owner=users[k[1]][0], type=k[2], hasMetadata=k[3]
+            )
+            if qs.update(count=django.db.models.F("count") + v) == 0:
+                if v < 0:
+                    continue
+                try:
+                    with django.db.transaction.atomic():
+                        ezidapp.models.Statistics(
+                            month=k[0],
+                            owner=users[k[1]][0],
+                            ownergroup=users[k[1]][1],
+                            realm=users[k[1]][2],
+                            type=k[2],
+                            hasMetadata=k[3],
+                            count=v,
+                        ).save(force_insert=True)
+                except django.db.utils.IntegrityError:
+                    # The class was inserted concurrently.
+                    qs.update(count=django.db.models.F("count") + v)
+            elif v < 0:
+                qs.filter(count__lte=0).delete()
+
+
+def requestReconciliation():
+    """
+  Requests that the statistics be recomputed as soon as possible,
+  rather than at the end of the reconciliation cycle.  To be called
+  when statistics changes (see addDelta) have been lost.
+  """
+    _reconciliationRequested.set()
+
+
+def _sleep(duration):
+    # Sleeps, but wakes up early if a reconciliation is requested.
+    _reconciliationRequested.wait(duration)
+
+
 def _statisticsDaemon():
     if _computeSameTimeOfDay:
         django.db.connections["default"].close()
         django.db.connections["search"].close()
-        time.sleep(_sameTimeOfDayDelta())
+        _sleep(_sameTimeOfDayDelta())
     else:
         # We arbitrarily sleep 10 minutes to avoid putting a burden on the
         # server near startup or reload.
-        time.sleep(600)
+        _sleep(600)
+    lastRecompute = None
     while _enabled and threading.currentThread().getName() == _threadName:
         start = time.time()
-        recomputeStatistics()
+        # Under incremental maintenance the full recomputation is only a
+        # reconciliation.  The slack allows for drift in the start time.
+        if (
+            not _incremental
+            or lastRecompute == None
+            or start - lastRecompute >= _reconcileCycle - 3600
+            or _reconciliationRequested.isSet()
+        ):
+            _reconciliationRequested.clear()
+            recomputeStatistics()
+            lastRecompute = start
         django.db.connections["default"].close()
         django.db.connections["search"].close()
         if _computeSameTimeOfDay:
-            time.sleep(_sameTimeOfDayDelta())
+            _sleep(_sameTimeOfDayDelta())
         else:
-            time.sleep(max(_computeCycle - (time.time() - start), 0))
+            _sleep(max(_computeCycle - (time.time() - start), 0))
 
 
 def loadConfig():
     global _enabled, _computeCycle, _computeSameTimeOfDay, _threadName
+    global _incremental, _reconcileCycle
+    _incremental = (
+        config.get("daemons.statistics_incremental_enabled").lower() == "true"
+    )
+    _reconcileCycle = int(config.get("daemons.statistics_reconcile_cycle"))
     _enabled = (
         django.conf.settings.DAEMON_THREADS_ENABLED
         and config.get("daemons.statistics_enabled").lower() == "true"
@@ -32,7 +32,9 @@ import datacite_async
 import download
 import ezid
 import ezidapp.models
+import linkcheck
 import log
+import mint_reservoir
 import search_util
 
 # Deferred imports...
@@ -69,8 +71,14 @@ def _statusDaemon():
             bql = binder_async.getQueueLength()
             daql = datacite_async.getQueueLength()
             cqs = crossref.getQueueStatistics()
+            css = crossref.getSchedulerStatistics()
+            lcs = linkcheck.getStatistics()
             doql = download.getQueueLength()
             as_ = search_util.numActiveSearches()
+            mrd = mint_reservoir.getDepths()
+            mph, mpm = ezidapp.models.getMinterPathCacheStatistics()
+            sps = datacite.getSchemaPoolStatistics()
+            dcs = datacite.getConnectionStatistics()
             no = log.getOperationCount()
             log.resetOperationCount()
             log.status(
@@ -85,8 +93,18 @@ def _statusDaemon():
                 "dataciteQueueLength=%d" % daql,
                 "crossrefQueue:archived/unsubmitted/submitted=%d/%d/%d"
                 % (cqs[2] + cqs[3], cqs[0], cqs[1]),
+                "crossrefCycle:time/deposits/polls/pollsScheduled=%.3f/%d/%d/%d"
+                % css,
                 "downloadQueueLength=%d" % doql,
+                "linkcheck:checked/roundTime=%d/%.1f" % lcs,
                 "activeSearches=%d" % as_,
+                "mintReservoirDepth=%d%s"
+                % (sum(mrd.values()), _formatUserCountList(mrd)),
+                "minterPathCache:hits/misses=%d/%d" % (mph, mpm),
+                "dataciteSchemas:compiled/validations/waits/waitTime=%d/%d/%d/%.3f"
+                % sps,
+                "dataciteConnections:requests/reused/reattempts/requestTime="
+                + "%d/%d/%d/%.3f" % dcs,
                 "operationCount=%d" % no,
             )
             if _cloudwatchEnabled:
@@ -107,6 +125,7 @@ def _statusDaemon():
                         "CrossrefQueueLength": cqs[0] + cqs[1],
                         "DownloadQueueLength": doql,
                         "ActiveSearches": as_,
+                        "MintReservoirDepth": sum(mrd.values()),
                         "OperationRate": float(no) / _reportingInterval,
                     }
                     r = c.put_metric_data(
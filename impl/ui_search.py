@@ -134,7 +134,7 @@ def queryDict(request):
     queries = {}
     c = request.GET.copy()
     for key in c:
-        if not key.startswith('c_') and not key == 'p':
+        if not key.startswith('c_') and not key in ('p', 'c'):
             queries[key] = c[key]
     return queries if queries else {}
 
@@ -248,30 +248,78 @@ def search(d, request, noConstraintsReqd=False, s_type="public"):
                 ezidapp.models.Identifier.CR_WARNING,
                 ezidapp.models.Identifier.CR_FAILURE,
             ]
-        d['total_results'] = search_util.executeSearchCountOnly(
-            userauth.getUser(request, returnAnonymous=True), c
-        )
-        d['total_results_str'] = format(d['total_results'], "n")
-        d['total_pages'] = int(math.ceil(float(d['total_results']) / float(d['ps'])))
-        if d['p'] > d['total_pages']:
-            d['p'] = d['total_pages']
-        d['p'] = max(d['p'], 1)
         if d['order_by']:
             orderColumn = FIELDS_MAPPED[d['order_by']][0]
             if IS_ASCENDING[d['sort']]:
                 orderColumn = "-" + orderColumn
         else:
             orderColumn = None
+        # Next/previous links carry a cursor (see search_util.makeCursor)
+        # holding the target page, page size, and result count.  If the
+        # request is for that page, the page is retrieved by keyset
+        # rather than by offset, and the count, which may be slightly
+        # stale, is reused rather than recomputed.
+        cursor = request.GET.get('c')
+        cursorData = None
+        if cursor and search_util.supportsCursor(orderColumn):
+            cursorData = search_util.getCursorData(cursor, orderColumn)
+            if cursorData is None or cursorData[:2] != [d['p'], d['ps']]:
+                cursorData = None
+        if cursorData is not None:
+            d['total_results'] = cursorData[2]
+        else:
+            cursor = None
+            d['total_results'] = search_util.executeSearchCountOnly(
+                userauth.getUser(request, returnAnonymous=True), c, approximate=True
+            )
+        # If the count is only an estimate ("more than N"), the number of
+        # pages is unknown, and paging continues for as long as pages are
+        # full.
+        isEstimate = search_util.isEstimate(d['total_results'])
+        if isEstimate:
+            d['total_results_str'] = (
+                _("more than")
+                + " "
+                + format(search_util.getCountEstimateThreshold(), "n")
+            )
+        else:
+            d['total_results_str'] = format(d['total_results'], "n")
+        d['total_pages'] = int(math.ceil(float(d['total_results']) / float(d['ps'])))
+        if isEstimate:
+            d['total_pages'] = max(d['total_pages'], d['p'])
+        if d['p'] > d['total_pages']:
+            d['p'] = d['total_pages']
+        d['p'] = max(d['p'], 1)
         d['results'] = []
         rec_beg = (d['p'] - 1) * d['ps']
         rec_end = d['p'] * d['ps']
-        for id in search_util.executeSearch(
+        ids = search_util.executeSearch(
             userauth.getUser(request, returnAnonymous=True),
             c,
             rec_beg,
             rec_end,
             orderColumn,
-        ):
+            cursor=cursor,
+        )
+        if isEstimate and len(ids) == d['ps']:
+            d['total_pages'] = max(d['total_pages'], d['p'] + 1)
+        d['prev_cursor'] = d['next_cursor'] = ''
+        if len(ids) > 0 and search_util.supportsCursor(orderColumn):
+            if d['p'] > 1:
+                d['prev_cursor'] = search_util.makeCursor(
+                    ids[0],
+                    orderColumn,
+                    False,
+                    [d['p'] - 1, d['ps'], d['total_results']],
+                )
+            if d['p'] < d['total_pages']:
+                d['next_cursor'] = search_util.makeCursor(
+                    ids[len(ids) - 1],
+                    orderColumn,
+                    True,
+                    [d['p'] + 1, d['ps'], d['total_results']],
+                )
+        for id in ids:
             if s_type in ('public', 'manage'):
                 result = {
                     "c_create_time": id.createTime,
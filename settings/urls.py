@@ -96,6 +96,7 @@ urlpatterns = i18n_patterns(
     ),
     # API
     url("^shoulder/", api.mintIdentifier, name="api.mintIdentifier"),
+    url("^batch_mint/", api.batchMintIdentifiers, name="api.batchMintIdentifiers"),
     url("^status$", api.getStatus, name="api.getStatus"),
     url("^version$", api.getVersion, name="api.getVersion"),
     url(
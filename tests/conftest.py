@@ -159,6 +159,16 @@ def disable_log_to_console(mocker):
 # See also: https://pytest-django.readthedocs.io/en/latest/helpers.html#fixtures
 
 
+@pytest.fixture()
+def search_db_rollback():
+    """Roll back changes made through the "search" DB connection. Only the default
+    DB connection is covered by the per-test transactions set up by pytest-django.
+    """
+    with django.db.transaction.atomic(using='search'):
+        yield
+        django.db.transaction.set_rollback(True, using='search')
+
+
 @pytest.fixture(scope='function')
 def reloaded():
     """Refresh EZID's in-memory caches of the database. In the test, additional reloads
@@ -2,6 +2,9 @@ import logging
 
 import freezegun
 
+import ezid
+import ezidapp.models
+
 import tests.util.anvl as anvl
 import tests.util.sample as sample
 import tests.util.util
@@ -55,3 +58,75 @@ class TestAPI:
             if '_created' in result_dict:
                 result_list.append(result_dict)
         sample.assert_match(result_list, 'view')
+
+    def test_1020(self, ez_admin, tmp_bdb_root, minters):
+        """Test /batch_mint"""
+        for ns, arg_tup in minters:
+            response = ez_admin.post(
+                "/batch_mint/{}?count=5".format(tests.util.util.encode(str(ns))),
+                data=anvl.format_request(["_status", "reserved"]).encode('utf-8'),
+                content_type="text/plain; charset=UTF-8",
+            )
+            assert response.status_code == 201
+            line_list = b''.join(response.streaming_content).splitlines()
+            assert len(line_list) == 5
+            assert all(s.startswith(b'success: ') for s in line_list)
+            assert len(set(line_list)) == 5
+
+    def test_1030(self, ez_admin, tmp_bdb_root, minters):
+        """Test that /batch_mint stores the identifiers, and releases the shoulder
+        lock, before responding"""
+        ns, arg_tup = minters[0]
+        store_count = ezidapp.models.StoreIdentifier.objects.count()
+        response = ez_admin.post(
+            "/batch_mint/{}?count=5".format(tests.util.util.encode(str(ns))),
+            data=anvl.format_request(["_status", "reserved"]).encode('utf-8'),
+            content_type="text/plain; charset=UTF-8",
+        )
+        assert response.status_code == 201
+        assert not any(
+            user.endswith('.shoulder_lock') for user in ezid.getStatus()[0]
+        )
+        assert ezidapp.models.StoreIdentifier.objects.count() == store_count + 5
+        line_list = b''.join(response.streaming_content).splitlines()
+        assert ezidapp.models.StoreIdentifier.objects.filter(
+            identifier__in=[s.split(b': ', 1)[1] for s in line_list]
+        ).count() == 5
+
+    def test_1040(self, admin_admin, tmp_bdb_root, minters, monkeypatch):
+        """Test that a batch mint that fails part way reports the identifiers that
+        were stored, and those that were minted but not stored"""
+        bulk_create = ezidapp.models.UpdateQueue.objects.bulk_create
+        call_list = []
+
+        def fail_second_chunk(obj_list):
+            call_list.append(len(obj_list))
+            if len(call_list) == 2:
+                raise Exception('chunk failed')
+            return bulk_create(obj_list)
+
+        monkeypatch.setattr(ezid, '_batchMintChunkSize', 2)
+        monkeypatch.setattr(
+            ezidapp.models.UpdateQueue.objects, 'bulk_create', fail_second_chunk
+        )
+        user = ezidapp.models.getUserByUsername('admin')
+        ns, arg_tup = minters[0]
+        status_list = ezid.batchMintIdentifiers(
+            str(ns), user, 5, {'_status': 'reserved'}
+        )
+        assert [s.split(':')[0] for s in status_list] == (
+            ['success'] * 2 + ['error'] + ['unstored'] * 3
+        )
+        id_list = [s.split(': ', 1)[1] for s in status_list]
+        assert ezidapp.models.StoreIdentifier.objects.filter(
+            identifier__in=id_list[:2]
+        ).count() == 2
+        assert not ezidapp.models.StoreIdentifier.objects.filter(
+            identifier__in=id_list[3:]
+        ).exists()
+        # A batch that fails before anything is stored is an error.
+        del call_list[:]
+        call_list.append(0)
+        assert ezid.batchMintIdentifiers(str(ns), user, 1) == (
+            'error: internal server error'
+        )
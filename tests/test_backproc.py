@@ -0,0 +1,102 @@
+"""Test batched and partitioned processing of the update queue
+"""
+import threading
+import zlib
+
+import pytest
+
+import backproc
+import ezidapp.models
+import ezidapp.models.update_queue
+
+ENTRY_COUNT = 12
+BATCH_SIZE = 5
+
+
+class _Failure(Exception):
+    pass
+
+
+@pytest.fixture()
+def backproc_config(monkeypatch):
+    """Let the test thread pass as the backproc daemon thread, and keep the
+    search database out of it."""
+    monkeypatch.setattr(backproc, '_enabled', True)
+    monkeypatch.setattr(backproc, '_threadName', threading.currentThread().getName())
+    monkeypatch.setattr(backproc, '_batchSize', BATCH_SIZE)
+    monkeypatch.setattr(backproc, '_numWorkers', 1)
+
+
+def _enqueue(count=ENTRY_COUNT):
+    for si in ezidapp.models.StoreIdentifier.objects.filter(owner__isnull=False)[
+        :count
+    ]:
+        ezidapp.models.update_queue.enqueue(si, 'update', updateExternalServices=False)
+    return list(ezidapp.models.UpdateQueue.objects.all().order_by('seq'))
+
+
+def _queued_identifiers(model):
+    return set(model.objects.values_list('identifier', flat=True))
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestBackproc:
+    def test_1000(self, backproc_config, monkeypatch):
+        """Batches are processed in bulk, and a batch with a bad entry falls back to
+        processing its entries one at a time. The error from the bad entry reaches
+        the daemon, and the entries before it are processed."""
+        update_list = _enqueue()
+        assert len(update_list) == ENTRY_COUNT
+        bad_identifier = update_list[BATCH_SIZE + 2].identifier
+        batch_list = []
+
+        def update_batch(final_operations):
+            batch_list.append(sorted(final_operations))
+            if bad_identifier in final_operations:
+                raise _Failure('bad batch')
+            return {}
+
+        def update_single(identifier, operation, metadata, blob):
+            if identifier == bad_identifier:
+                raise _Failure('bad entry')
+            return {}
+
+        monkeypatch.setattr(backproc, '_updateSearchDatabaseBatch', update_batch)
+        monkeypatch.setattr(backproc, '_updateSearchDatabase', update_single)
+        with pytest.raises(_Failure):
+            backproc._processChunk(update_list, backproc._checkContinue)
+        processed_list = update_list[: BATCH_SIZE + 2]
+        assert batch_list[0] == sorted(u.identifier for u in update_list[:BATCH_SIZE])
+        assert _queued_identifiers(ezidapp.models.UpdateQueue) == set(
+            u.identifier for u in update_list[BATCH_SIZE + 2 :]
+        )
+        assert _queued_identifiers(ezidapp.models.BinderQueue) >= set(
+            u.identifier for u in processed_list if not u.actualObject.isReserved
+        )
+
+    def test_1010(self, backproc_config, monkeypatch):
+        """Entries are partitioned among the workers by the CRC-32 of the
+        identifier, in queue order, and an error in any worker is raised in the
+        daemon once all workers have finished."""
+        monkeypatch.setattr(backproc, '_numWorkers', 3)
+        update_list = [
+            ezidapp.models.UpdateQueue(seq=i, identifier='ark:/99999/fk4{}'.format(i))
+            for i in range(ENTRY_COUNT)
+        ]
+        lock = threading.Lock()
+        partition_list = []
+
+        def process_partition(update_list, checkContinue):
+            with lock:
+                partition_list.append([u.seq for u in update_list])
+            if update_list[0].seq == 0:
+                raise _Failure()
+            return True
+
+        monkeypatch.setattr(backproc, '_processPartition', process_partition)
+        with pytest.raises(_Failure):
+            backproc._processChunk(update_list, backproc._checkContinue)
+        expected_list = [[] for _ in range(3)]
+        for u in update_list:
+            expected_list[(zlib.crc32(u.identifier) & 0xFFFFFFFF) % 3].append(u.seq)
+        assert sorted(partition_list) == sorted(p for p in expected_list if p)
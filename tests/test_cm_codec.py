@@ -0,0 +1,152 @@
+"""Test the citation metadata codec and benchmark it against plain zlib
+"""
+import json
+import logging
+import random
+import time
+import zlib
+
+import cm_codec
+
+RECORD_COUNT = 1000
+WORD_LIST = (
+    'ocean climate soil sample data analysis river model genome survey california '
+    'species water temperature sediment archive collection image study field'
+).split()
+
+log = logging.getLogger(__name__)
+
+
+def _sample_record_list(seed=1):
+    """Return citation metadata dicts shaped like those stored by EZID: DataCite XML
+    records, Crossref journal articles, ERC and DataCite profile elements, and empty
+    metadata."""
+    rnd = random.Random(seed)
+
+    def words(n_min, n_max):
+        return ' '.join(
+            rnd.choice(WORD_LIST) for _ in range(rnd.randint(n_min, n_max))
+        ).capitalize()
+
+    def datacite():
+        return {
+            '_profile': 'datacite',
+            'datacite': (
+                '<?xml version="1.0"?>\n'
+                '<resource xmlns="http://datacite.org/schema/kernel-4" '
+                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:schemaLocation="http://datacite.org/schema/kernel-4 '
+                'http://schema.datacite.org/meta/kernel-4/metadata.xsd">\n'
+                '  <identifier identifierType="DOI">10.5072/FK2{}</identifier>\n'
+                '  <creators>\n    <creator>\n'
+                '      <creatorName>{}, {}</creatorName>\n'
+                '    </creator>\n  </creators>\n'
+                '  <titles>\n    <title>{}</title>\n  </titles>\n'
+                '  <publisher>University of California</publisher>\n'
+                '  <publicationYear>{}</publicationYear>\n'
+                '  <resourceType resourceTypeGeneral="Dataset">Dataset</resourceType>\n'
+                '  <descriptions>\n'
+                '    <description descriptionType="Abstract">{}</description>\n'
+                '  </descriptions>\n'
+                '</resource>'
+            ).format(
+                rnd.randrange(10 ** 6),
+                words(1, 1),
+                words(1, 1),
+                words(3, 12),
+                rnd.randint(1990, 2020),
+                words(20, 60),
+            ),
+        }
+
+    def crossref():
+        return {
+            '_profile': 'crossref',
+            'crossref': (
+                '<?xml version="1.0"?>\n'
+                '<journal xmlns="http://www.crossref.org/schema/4.4.0" '
+                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:schemaLocation="http://www.crossref.org/schema/4.4.0 '
+                'http://www.crossref.org/schema/deposit/crossref4.4.0.xsd">\n'
+                '  <journal_metadata language="en">\n'
+                '    <full_title>{}</full_title>\n'
+                '  </journal_metadata>\n'
+                '  <journal_article publication_type="full_text">\n'
+                '    <titles>\n      <title>{}</title>\n    </titles>\n'
+                '    <doi_data>\n      <doi>(:tba)</doi>\n'
+                '      <resource>(:tba)</resource>\n    </doi_data>\n'
+                '  </journal_article>\n'
+                '</journal>'
+            ).format(words(2, 5), words(5, 15)),
+        }
+
+    def erc():
+        return {
+            'erc.who': words(1, 3),
+            'erc.what': words(3, 10),
+            'erc.when': str(rnd.randint(1900, 2020)),
+        }
+
+    def datacite_elements():
+        return {
+            'datacite.creator': words(1, 3),
+            'datacite.title': words(3, 10),
+            'datacite.publisher': words(1, 4),
+            'datacite.publicationyear': str(rnd.randint(1990, 2020)),
+            'datacite.resourcetype': 'Dataset',
+        }
+
+    factory_list = [datacite, datacite, crossref, erc, erc, datacite_elements, dict]
+    return [rnd.choice(factory_list)() for _ in range(RECORD_COUNT)]
+
+
+def _json_list():
+    return [json.dumps(d, separators=(',', ':')) for d in _sample_record_list()]
+
+
+# noinspection PyClassHasNoInit
+class TestCmCodec:
+    def test_1000(self):
+        """Values round trip in both formats, and values in the legacy format, as
+        written by plain zlib, remain readable."""
+        for json_str in _json_list():
+            assert cm_codec.decompress(cm_codec.compress(json_str, False)) == json_str
+            assert cm_codec.decompress(cm_codec.compress(json_str, True)) == json_str
+            assert cm_codec.decompress(zlib.compress(json_str)) == json_str
+
+    def test_1010(self):
+        """The format is selected by the header."""
+        blob = cm_codec.compress('{}', True)
+        assert blob.startswith(cm_codec.FORMAT_PRESET_DICTIONARY + '\x01')
+        assert cm_codec.compress('{}', False) == zlib.compress('{}')
+
+    def test_1020(self):
+        """Benchmark: Storage size and decode time, legacy vs. preset dictionary."""
+        json_list = _json_list()
+        legacy_list = [cm_codec.compress(s, False) for s in json_list]
+        preset_list = [cm_codec.compress(s, True) for s in json_list]
+
+        def decode_sec(blob_list):
+            start = time.time()
+            for blob in blob_list:
+                json.loads(cm_codec.decompress(blob))
+            return time.time() - start
+
+        legacy_bytes = sum(len(b) for b in legacy_list)
+        preset_bytes = sum(len(b) for b in preset_list)
+        log.info(
+            'cm storage, {} records: json={} legacy={} preset={} '
+            '({:.0%} of legacy)'.format(
+                RECORD_COUNT,
+                sum(len(s) for s in json_list),
+                legacy_bytes,
+                preset_bytes,
+                float(preset_bytes) / legacy_bytes,
+            )
+        )
+        log.info(
+            'cm decode, {} records: legacy={:.4f}s preset={:.4f}s'.format(
+                RECORD_COUNT, decode_sec(legacy_list), decode_sec(preset_list)
+            )
+        )
+        assert preset_bytes < legacy_bytes * 0.75
@@ -0,0 +1,71 @@
+"""Test the scheduling of Crossref deposits and polls
+"""
+import threading
+import time
+
+import pytest
+
+import crossref
+
+ENTRY_COUNT = 50
+
+
+class _Entry(object):
+    def __init__(self, seq, submit_time=0):
+        self.seq = seq
+        self.submitTime = submit_time
+
+
+@pytest.fixture()
+def daemon_thread(monkeypatch):
+    """Let the test thread pass as the Crossref daemon thread."""
+    monkeypatch.setattr(crossref, '_daemonEnabled', True)
+    monkeypatch.setattr(crossref, '_threadName', threading.currentThread().getName())
+    monkeypatch.setattr(crossref, '_numWorkers', 4)
+    monkeypatch.setattr(crossref, '_idleSleep', 60)
+    monkeypatch.setattr(crossref, '_pollMaxInterval', 3600)
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestCrossrefScheduler:
+    def test_1000(self):
+        """All but the most recent entry for each identifier are superseded."""
+        assert crossref._supersededEntries(
+            [(1, 'doi:A'), (2, 'doi:B'), (3, 'doi:A'), (4, 'doi:C'), (5, 'doi:A')]
+        ) == [1, 3]
+
+    def test_1010(self, daemon_thread):
+        """The poll interval grows with the age of the deposit, within bounds."""
+        now = time.time()
+        assert crossref._pollInterval(_Entry(1, now), now) == 60
+        assert crossref._pollInterval(_Entry(1, now - 600), now) == 600
+        assert crossref._pollInterval(_Entry(1, now - 86400), now) == 3600
+
+    def test_1020(self, daemon_thread):
+        """Entries are processed by a bounded pool of worker threads, each of which
+        passes the daemon's abort check."""
+        lock = threading.Lock()
+        seen_list = []
+        active = [0, 0]
+
+        def process(r):
+            crossref._checkAbort()
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.001)
+            with lock:
+                active[0] -= 1
+                seen_list.append(r.seq)
+
+        entry_list = [_Entry(i) for i in range(ENTRY_COUNT)]
+        assert crossref._runWorkers(process, entry_list) == ENTRY_COUNT
+        assert sorted(seen_list) == list(range(ENTRY_COUNT))
+        assert 1 <= active[1] <= 4
+
+    def test_1030(self, daemon_thread, monkeypatch):
+        """An abort in a worker thread is raised in the daemon thread."""
+        entry_list = [_Entry(i) for i in range(ENTRY_COUNT)]
+        monkeypatch.setattr(crossref, '_daemonEnabled', False)
+        with pytest.raises(crossref._AbortException):
+            crossref._runWorkers(lambda r: crossref._checkAbort(), entry_list)
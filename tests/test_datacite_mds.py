@@ -0,0 +1,105 @@
+"""Test the DataCite MDS client against a local MDS stand-in
+"""
+import base64
+import urllib2
+
+import pytest
+
+import datacite
+import tests.util.http_stand_in
+import tests.util.mds_server
+
+DOI = '10.5072/FK2TEST'
+URL_A = 'https://a.example.org'
+URL_B = 'https://b.example.org'
+RECORD = u"""<?xml version="1.0" encoding="UTF-8"?>
+<resource xmlns="http://datacite.org/schema/kernel-4">
+  <identifier identifierType="DOI">10.5072/FK2TEST</identifier>
+</resource>
+"""
+
+
+@pytest.fixture()
+def mds_server(monkeypatch):
+    with tests.util.mds_server.MdsServer() as server:
+        tests.util.http_stand_in.patch_module(
+            monkeypatch,
+            datacite,
+            _enabled=True,
+            _doiUrl=server.doi_url,
+            _metadataUrl=server.metadata_url,
+            _numAttempts=3,
+            _reattemptDelay=0,
+            _maxReattemptDelay=0,
+            _timeout=5,
+            _poolSize=2,
+            _idleTimeout=60,
+            _allocators={'CDL': 'secret'},
+            _authorizations={},
+        )
+        datacite._closeConnectionPools()
+        yield server
+        datacite._closeConnectionPools()
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestDataciteMds:
+    def test_1000(self, mds_server):
+        """DOIs are registered, updated and deactivated over a single keep-alive
+        connection, with a precomputed Authorization header."""
+        requests, reused = datacite.getConnectionStatistics()[:2]
+        assert datacite.registerIdentifier(DOI, URL_A, 'CDL.CDL') is None
+        assert datacite.getTargetUrl(DOI, 'CDL.CDL') == URL_A
+        assert datacite.setTargetUrl(DOI, URL_B, 'CDL.CDL') is None
+        assert datacite.getTargetUrl(DOI, 'CDL.CDL') == URL_B
+        assert (
+            datacite.uploadMetadata(DOI, {}, {'datacite': RECORD}, True, 'CDL.CDL')
+            is None
+        )
+        assert DOI in mds_server.active_set
+        assert datacite.deactivate(DOI, 'CDL.CDL') is None
+        assert DOI not in mds_server.active_set
+        assert mds_server.connection_count == 1
+        assert mds_server.authorization_set == {
+            'Basic ' + base64.b64encode('CDL.CDL:secret')
+        }
+        assert datacite._authorizations.keys() == ['CDL.CDL']
+        statistics = datacite.getConnectionStatistics()
+        assert statistics[0] - requests == 6
+        assert statistics[1] - reused == 5
+
+    def test_1010(self, mds_server):
+        """Server errors and rate limiting are reattempted, up to the configured
+        number of attempts."""
+        reattempts = datacite.getConnectionStatistics()[2]
+        mds_server.error_list = [503, 429]
+        assert datacite.registerIdentifier(DOI, URL_A, 'CDL.CDL') is None
+        assert mds_server.target_dict == {DOI: URL_A}
+        assert mds_server.request_count == 3
+        assert datacite.getConnectionStatistics()[2] - reattempts == 2
+        mds_server.error_list = [500, 502, 503]
+        with pytest.raises(urllib2.HTTPError) as e:
+            datacite.getTargetUrl(DOI, 'CDL.CDL')
+        assert e.value.code == 503
+        assert mds_server.request_count == 6
+
+    def test_1020(self, mds_server):
+        """Client errors are not reattempted, and are reported as each operation
+        reports them."""
+        assert datacite.registerIdentifier(DOI, 'ftp://a.example.org', 'CDL.CDL') == (
+            '[url] malformed URL'
+        )
+        assert datacite.getTargetUrl(DOI, 'CDL.CDL') is None
+        # Deactivating a DOI that has no metadata first uploads placeholder metadata.
+        assert datacite.deactivate(DOI, 'CDL.CDL') is None
+        assert 'inactive' in mds_server.metadata_dict[DOI]
+        assert DOI not in mds_server.active_set
+        assert mds_server.request_count == 5
+
+    def test_1030(self, mds_server, monkeypatch):
+        """Connections idle for longer than the idle timeout are not reused."""
+        monkeypatch.setattr(datacite, '_idleTimeout', -1)
+        datacite._closeConnectionPools()
+        datacite.registerIdentifier(DOI, URL_A, 'CDL.CDL')
+        datacite.getTargetUrl(DOI, 'CDL.CDL')
+        assert mds_server.connection_count == 2
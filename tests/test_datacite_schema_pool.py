@@ -0,0 +1,72 @@
+"""Test the pool of compiled DataCite XML schemas
+"""
+import threading
+import time
+
+import lxml.etree
+
+import datacite
+import nog.filesystem
+
+SCHEMA_PATH = nog.filesystem.abs_path('../xsd/datacite-kernel-4/metadata.xsd')
+THREAD_COUNT = 8
+VALIDATION_COUNT = 10
+
+RECORD = (
+    '<resource xmlns="http://datacite.org/schema/kernel-4">'
+    '<identifier identifierType="DOI">10.1234/X</identifier>'
+    '<creators><creator><creatorName>Creator</creatorName></creator></creators>'
+    '<titles><title>Title</title></titles>'
+    '<publisher>Publisher</publisher>'
+    '<publicationYear>2020</publicationYear>'
+    '<resourceType resourceTypeGeneral="Dataset"/>'
+    '</resource>'
+)
+
+
+def _validate_concurrently(pool):
+    error_list = []
+    root = lxml.etree.XML(RECORD)
+
+    def worker():
+        for _ in range(VALIDATION_COUNT):
+            schema = pool.acquire()
+            try:
+                if not schema.validate(root):
+                    error_list.append(str(schema.error_log))
+            finally:
+                pool.release(schema)
+
+    thread_list = [threading.Thread(target=worker) for _ in range(THREAD_COUNT)]
+    for t in thread_list:
+        t.start()
+    for t in thread_list:
+        t.join()
+    return error_list
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestDataciteSchemaPool:
+    def test_1000(self):
+        """Schemas are compiled on demand, up to the pool size."""
+        pool = datacite._SchemaPool(SCHEMA_PATH, 3)
+        assert pool.getStatistics() == (0, 0, 0, 0.0)
+        assert _validate_concurrently(pool) == []
+        compiled, validations, _, _ = pool.getStatistics()
+        assert 1 <= compiled <= 3
+        assert validations == THREAD_COUNT * VALIDATION_COUNT
+
+    def test_1010(self):
+        """Threads wait for a schema when the pool is exhausted, and the wait is
+        recorded."""
+        pool = datacite._SchemaPool(SCHEMA_PATH, 1)
+        schema = pool.acquire()
+        thread = threading.Thread(target=lambda: pool.release(pool.acquire()))
+        thread.start()
+        while pool.getStatistics()[2] == 0:
+            time.sleep(0.001)
+        pool.release(schema)
+        thread.join()
+        compiled, validations, waits, wait_time = pool.getStatistics()
+        assert (compiled, validations, waits) == (1, 2, 1)
+        assert wait_time > 0
@@ -0,0 +1,123 @@
+"""Test the gzip and zip containers written for batch download requests
+"""
+import gzip
+import struct
+import zipfile
+import zlib
+
+import pytest
+
+import download
+import ezidapp.models
+
+LINE_LIST = ['line {}\n'.format(i) for i in range(1000)]
+
+
+class _Request(object):
+    """Stand-in for the download request fields used by the container writer."""
+
+    def __init__(self, compression):
+        self.compression = compression
+        self.format = ezidapp.models.DownloadQueue.CSV
+        self.filename = 'batch'
+        self.requestTime = 1500000000
+        self.crc32 = 0
+        self.uncompressedSize = 0
+        self.fileSize = None
+
+
+def _write(r, path, line_list, resume=False, garbage=''):
+    """Write a container as _createFile and _harvest do. If resume is set, the
+    file is re-opened and truncated at the last checkpoint first."""
+    if resume:
+        f = open(path, 'r+b')
+        f.seek(r.fileSize)
+        f.truncate()
+    else:
+        f = open(path, 'wb')
+        download._writeContainerHeader(r, f)
+    try:
+        cf = download._CompressedFile(r, f)
+        for i, s in enumerate(line_list):
+            cf.write(s)
+            if i % 100 == 99:
+                cf.checkpoint()
+        if garbage:
+            # Simulate a harvest interrupted after its last checkpoint.
+            cf.write(garbage)
+            f.write(cf.compressor.flush(zlib.Z_SYNC_FLUSH))
+            f.write('\xff' * 17)
+            return
+        cf.finish()
+    finally:
+        f.close()
+
+
+def _read(r, path):
+    if r.compression == ezidapp.models.DownloadQueue.GZIP:
+        f = gzip.open(path, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+    z = zipfile.ZipFile(path)
+    try:
+        assert z.testzip() is None
+        assert z.namelist() == ['batch.csv']
+        return z.read('batch.csv')
+    finally:
+        z.close()
+
+
+@pytest.fixture(
+    params=[ezidapp.models.DownloadQueue.GZIP, ezidapp.models.DownloadQueue.ZIP]
+)
+def request_(request):
+    return _Request(request.param)
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestDownloadContainer:
+    def test_1000(self, request_, tmp_path):
+        """A container written in one run reads back intact."""
+        path = str(tmp_path / 'batch')
+        _write(request_, path, LINE_LIST)
+        assert _read(request_, path) == ''.join(LINE_LIST)
+
+    def test_1010(self, request_, tmp_path):
+        """A container resumed from a checkpoint after an interrupted run reads
+        back intact, without the data written after the checkpoint."""
+        path = str(tmp_path / 'batch')
+        _write(request_, path, LINE_LIST[:500], garbage='lost\n' * 50)
+        assert request_.uncompressedSize == len(''.join(LINE_LIST[:500]))
+        _write(request_, path, LINE_LIST[500:], resume=True)
+        assert request_.uncompressedSize == len(''.join(LINE_LIST))
+        assert _read(request_, path) == ''.join(LINE_LIST)
+
+    def test_1020(self, request_, tmp_path):
+        """An empty container reads back as empty."""
+        path = str(tmp_path / 'batch')
+        _write(request_, path, [])
+        assert _read(request_, path) == ''
+
+    def test_1030(self, tmp_path, monkeypatch):
+        """A zip container whose sizes and offsets require ZIP64 extensions reads
+        back intact, and its local header and data descriptor declare them."""
+        monkeypatch.setattr(download, '_zip64Limit', 1000)
+        r = _Request(ezidapp.models.DownloadQueue.ZIP)
+        path = str(tmp_path / 'batch')
+        _write(r, path, LINE_LIST)
+        assert _read(r, path) == ''.join(LINE_LIST)
+        with open(path, 'rb') as f:
+            data = f.read()
+        header = download._zipLocalHeader(r, True)
+        assert data.startswith(header)
+        assert struct.unpack('<H', header[4:6]) == (45,)
+        content = ''.join(LINE_LIST)
+        i = data.rindex(struct.pack('<I', 0x08074B50))
+        assert struct.unpack('<IIQQ', data[i : i + 24]) == (
+            0x08074B50,
+            zlib.crc32(content) & 0xFFFFFFFF,
+            i - len(header),
+            len(content),
+        )
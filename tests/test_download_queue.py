@@ -0,0 +1,116 @@
+"""Test the claiming of batch download requests by worker threads
+"""
+import contextlib
+import threading
+import time
+
+import pytest
+
+import download
+import ezidapp.models
+
+LARGE_THRESHOLD = 100
+CLAIM_TIMEOUT = 600
+
+
+@pytest.fixture()
+def estimate_list(monkeypatch):
+    """Run the test thread as a download worker, with sizes estimated from the
+    toHarvest field, and record the estimates made."""
+    estimate_list = []
+
+    def estimate_size(to_harvest, constraints):
+        estimate_list.append(to_harvest)
+        return int(to_harvest.split('-')[1])
+
+    monkeypatch.setattr(download, '_daemonEnabled', True)
+    monkeypatch.setattr(download, '_threadName', 'gen')
+    monkeypatch.setattr(download, '_previousGenerations', {'oldgen'})
+    monkeypatch.setattr(download, '_claimTimeout', CLAIM_TIMEOUT)
+    monkeypatch.setattr(download, '_numWorkers', 3)
+    monkeypatch.setattr(download, '_largeThreshold', LARGE_THRESHOLD)
+    monkeypatch.setattr(download, '_estimateSize', estimate_size)
+    ezidapp.models.DownloadQueue.objects.all().delete()
+    return estimate_list
+
+
+@contextlib.contextmanager
+def _as_worker(i):
+    t = threading.currentThread()
+    name = t.getName()
+    t.setName('gen.{}'.format(i))
+    try:
+        yield
+    finally:
+        t.setName(name)
+
+
+def _claim(i):
+    with _as_worker(i):
+        r = download._claimRequest()
+    return r and r.toHarvest
+
+
+def _enqueue(requestor, size, claimant='', claim_time=None):
+    return ezidapp.models.DownloadQueue.objects.create(
+        requestTime=0,
+        rawRequest='',
+        requestor=requestor,
+        format=ezidapp.models.DownloadQueue.CSV,
+        compression=ezidapp.models.DownloadQueue.GZIP,
+        toHarvest='{}-{}'.format(requestor, size),
+        claimant=claimant,
+        claimTime=claim_time,
+    )
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestDownloadQueue:
+    def test_1000(self, estimate_list):
+        """Each request is estimated once. Requestors with nothing in progress go
+        first, and a large request never takes the last free worker."""
+        r_dict = {
+            r.toHarvest: r
+            for r in [
+                _enqueue('a', 1),
+                _enqueue('a', 2),
+                _enqueue('b', 1000),
+                _enqueue('c', 3),
+            ]
+        }
+        assert [_claim(0), _claim(1), _claim(2)] == ['a-1', 'c-3', 'a-2']
+        assert sorted(estimate_list) == sorted(r_dict)
+        r_dict['a-2'].delete()
+        assert _claim(2) is None
+        r_dict['c-3'].delete()
+        assert _claim(1) == 'b-1000'
+        assert sorted(estimate_list) == sorted(r_dict)
+
+    def test_1010(self, estimate_list):
+        """Requests claimed by a previous generation of workers are claimed
+        again."""
+        r = _enqueue('a', 1, claimant='oldgen.0', claim_time=int(time.time()))
+        r.estimatedSize = 1
+        r.save()
+        assert _claim(0) == 'a-1'
+        assert ezidapp.models.DownloadQueue.objects.get(seq=r.seq).claimant == 'gen.0'
+        assert _claim(1) is None
+        assert estimate_list == []
+
+    def test_1020(self, estimate_list, tmp_path):
+        """Requests claimed by another server process are not claimed again until
+        their claims expire, and claims are renewed at checkpoints."""
+        now = int(time.time())
+        r = _enqueue('a', 1, claimant='othergen.0', claim_time=now - 10)
+        _enqueue('b', 1, claimant='othergen.1', claim_time=now - CLAIM_TIMEOUT)
+        ezidapp.models.DownloadQueue.objects.update(estimatedSize=1)
+        assert _claim(0) == 'b-1'
+        assert _claim(1) is None
+        r = ezidapp.models.DownloadQueue.objects.get(seq=r.seq)
+        r.claimTime = now - CLAIM_TIMEOUT
+        with open(str(tmp_path / 'batch'), 'wb') as f:
+            download._CompressedFile(r, f).checkpoint()
+        assert r.claimTime >= now
+        r.save()
+        assert _claim(1) is None
+        assert estimate_list == []
@@ -0,0 +1,163 @@
+"""Test the identifier lock manager and benchmark it against a single Condition
+"""
+import logging
+import random
+import threading
+import time
+
+import identifier_lock
+
+THREAD_COUNT = 400
+USER_COUNT = 4
+IDENTIFIER_COUNT = 1000
+OPERATION_COUNT = 20
+PER_USER_THROTTLE = 2
+PER_USER_THREAD_LIMIT = 1000
+
+log = logging.getLogger(__name__)
+
+
+class _ConditionLockManager(object):
+    """The lock mechanism that was used before the lock manager was introduced."""
+
+    def __init__(self, perUserThrottle, perUserThreadLimit):
+        self._perUserThrottle = perUserThrottle
+        self._perUserThreadLimit = perUserThreadLimit
+        self._lockedIdentifiers = set()
+        self._activeUsers = {}
+        self._waitingUsers = {}
+        self._lock = threading.Condition()
+
+    def acquire(self, identifier, user):
+        with self._lock:
+            while (
+                identifier in self._lockedIdentifiers
+                or self._activeUsers.get(user, 0) >= self._perUserThrottle
+            ):
+                if (
+                    self._activeUsers.get(user, 0) + self._waitingUsers.get(user, 0)
+                    >= self._perUserThreadLimit
+                ):
+                    return False
+                self._waitingUsers[user] = self._waitingUsers.get(user, 0) + 1
+                self._lock.wait()
+                self._waitingUsers[user] -= 1
+            self._activeUsers[user] = self._activeUsers.get(user, 0) + 1
+            self._lockedIdentifiers.add(identifier)
+            return True
+
+    def release(self, identifier, user):
+        with self._lock:
+            self._lockedIdentifiers.remove(identifier)
+            self._activeUsers[user] -= 1
+            self._lock.notifyAll()
+
+
+def _run(manager, checker=None):
+    """Run THREAD_COUNT threads that each lock random identifiers for random users.
+    Returns the elapsed time."""
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        for _ in range(OPERATION_COUNT):
+            identifier = 'ark:/99999/fk4{}'.format(rnd.randrange(IDENTIFIER_COUNT))
+            user = 'user{}'.format(rnd.randrange(USER_COUNT))
+            assert manager.acquire(identifier, user)
+            if checker:
+                checker.enter(identifier, user)
+            time.sleep(0.0001)
+            if checker:
+                checker.exit(identifier, user)
+            manager.release(identifier, user)
+
+    thread_list = [threading.Thread(target=worker, args=(i,)) for i in range(THREAD_COUNT)]
+    start = time.time()
+    for t in thread_list:
+        t.start()
+    for t in thread_list:
+        t.join()
+    return time.time() - start
+
+
+class _Checker(object):
+    """Record violations of the exclusion and throttle guarantees."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = set()
+        self._active = {}
+        self.error_list = []
+
+    def enter(self, identifier, user):
+        with self._lock:
+            if identifier in self._held:
+                self.error_list.append('Identifier locked twice: {}'.format(identifier))
+            self._held.add(identifier)
+            self._active[user] = self._active.get(user, 0) + 1
+            if self._active[user] > PER_USER_THROTTLE:
+                self.error_list.append('Throttle exceeded: {}'.format(user))
+
+    def exit(self, identifier, user):
+        with self._lock:
+            self._held.remove(identifier)
+            self._active[user] -= 1
+
+
+# noinspection PyClassHasNoInit
+class TestIdentifierLock:
+    def test_1000(self):
+        """No identifier is locked twice and no user exceeds the throttle."""
+        manager = identifier_lock.IdentifierLockManager(
+            PER_USER_THROTTLE, PER_USER_THREAD_LIMIT
+        )
+        checker = _Checker()
+        _run(manager, checker)
+        assert checker.error_list == []
+        assert manager.getStatus() == ({}, {}, False)
+
+    def test_1010(self):
+        """Requests beyond the per-user thread limit are refused, and no locks are
+        granted while paused."""
+        manager = identifier_lock.IdentifierLockManager(1, 2)
+        assert manager.acquire('ark:/99999/fk4a', 'u')
+        acquired_list = []
+        t = threading.Thread(
+            target=lambda: acquired_list.append(manager.acquire('ark:/99999/fk4b', 'u'))
+        )
+        t.start()
+        while manager.getStatus()[1] != {'u': 1}:
+            time.sleep(0.001)
+        assert not manager.acquire('ark:/99999/fk4c', 'u')
+        assert manager.getStatus() == ({'u': 1}, {'u': 1}, False)
+        assert manager.pause(True) is False
+        manager.release('ark:/99999/fk4a', 'u')
+        time.sleep(0.01)
+        assert acquired_list == []
+        assert manager.getStatus() == ({}, {'u': 1}, True)
+        assert manager.pause(False) is True
+        t.join()
+        assert acquired_list == [True]
+        assert manager.getStatus() == ({'u': 1}, {}, False)
+
+    def test_1020(self):
+        """Micro-benchmark: Lock manager vs. single Condition with {THREAD_COUNT}
+        contending threads."""
+        condition_sec = _run(
+            _ConditionLockManager(PER_USER_THROTTLE, PER_USER_THREAD_LIMIT)
+        )
+        manager_sec = _run(
+            identifier_lock.IdentifierLockManager(
+                PER_USER_THROTTLE, PER_USER_THREAD_LIMIT
+            )
+        )
+        log.info(
+            'Identifier locks, {} threads x {} operations: '
+            'condition={:.4f}s manager={:.4f}s speedup={:.1f}x'.format(
+                THREAD_COUNT,
+                OPERATION_COUNT,
+                condition_sec,
+                manager_sec,
+                condition_sec / max(manager_sec, 1e-9),
+            )
+        )
+        assert manager_sec < condition_sec
@@ -0,0 +1,114 @@
+"""Test the link checker daemon against a local HTTP stand-in
+"""
+import hashlib
+import itertools
+import threading
+
+import pytest
+
+import ezidapp.models
+import linkcheck
+import tests.util.http_stand_in
+import tests.util.link_server
+
+OWNER_COUNT = 3
+LINKS_PER_OWNER = 4
+
+
+@pytest.fixture()
+def link_server(monkeypatch):
+    with tests.util.link_server.LinkServer() as server:
+        tests.util.http_stand_in.patch_module(
+            monkeypatch,
+            linkcheck,
+            _enabled=True,
+            _threadName=threading.currentThread().getName(),
+            _numWorkers=4,
+            _checkTimeout=5,
+            _userAgent='EZID test',
+            _maxRead=1000000,
+        )
+        yield server
+
+
+def _link(url, owner_id=1):
+    return ezidapp.models.LinkChecker(
+        identifier='ark:/99999/fk4test', owner_id=owner_id, target=url
+    )
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestLinkcheck:
+    def test_1000(self, link_server):
+        """The size, hash and MIME type of a resource are recorded."""
+        lc = _link(link_server.url('/ok/1000'))
+        linkcheck._checkLink(lc)
+        assert lc.returnCode == 200
+        assert lc.numFailures == 0
+        assert lc.mimeType == 'text/html; charset=UTF-8'
+        assert lc.size == 1000
+        assert lc.hash == hashlib.md5(tests.util.link_server.page(1000)).hexdigest()
+
+    def test_1010(self, link_server, monkeypatch):
+        """At most the maximum number of bytes is read, and hashed."""
+        monkeypatch.setattr(linkcheck, '_maxRead', 100000)
+        lc = _link(link_server.url('/ok/1000000'))
+        linkcheck._checkLink(lc)
+        assert lc.returnCode == 200
+        assert lc.size == 100000
+        assert (
+            lc.hash
+            == hashlib.md5(tests.util.link_server.page(1000000)[:100000]).hexdigest()
+        )
+
+    def test_1020(self, link_server):
+        """Error responses are failures, except 401 and 403."""
+        lc = _link(link_server.url('/status/404'))
+        linkcheck._checkLink(lc)
+        assert (lc.returnCode, lc.numFailures, lc.size) == (404, 1, None)
+        lc = _link(link_server.url('/status/403'))
+        linkcheck._checkLink(lc)
+        assert (lc.returnCode, lc.numFailures, lc.size) == (200, 0, 0)
+        lc = _link('http://127.0.0.1:1/')
+        linkcheck._checkLink(lc)
+        assert lc.returnCode == -1
+        assert lc.error != ''
+
+    def test_1030(self, link_server):
+        """Links are checked concurrently, but with at most one check per host in
+        progress at any time, and owners sharing a host are visited in turn."""
+        # Owners 1 and 2 share a host; owner 3 has a host of its own.
+        host_dict = {1: '127.0.0.1', 2: '127.0.0.1', 3: 'localhost'}
+        workset = linkcheck._Workset(
+            [
+                linkcheck._OwnerWorkset(
+                    owner_id,
+                    [
+                        _link(
+                            link_server.url(
+                                '/slow/{}'.format(owner_id * 100 + i),
+                                host_dict[owner_id],
+                            ),
+                            owner_id,
+                        )
+                        for i in range(LINKS_PER_OWNER)
+                    ],
+                )
+                for owner_id in range(1, OWNER_COUNT + 1)
+            ],
+            0,
+            0,
+        )
+        linkcheck._processWorkset(workset, check=linkcheck._checkLink)
+        assert workset.numChecked() == OWNER_COUNT * LINKS_PER_OWNER
+        assert link_server.max_concurrent_dict == {'127.0.0.1': 1, 'localhost': 1}
+        # Checks against the two hosts overlapped in time.
+        assert link_server.request_list[1][0] != link_server.request_list[0][0]
+        shared_host_owners = [
+            int(path.split('/')[-1]) // 100
+            for host, path, _ in link_server.request_list
+            if host == '127.0.0.1'
+        ]
+        assert [k for k, _ in itertools.groupby(shared_host_owners)] == [1, 2] * 4
+        for ow in workset.ownerWorksets:
+            assert all(lc.returnCode == 200 for lc in ow.links)
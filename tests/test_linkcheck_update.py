@@ -0,0 +1,121 @@
+"""Test the propagation of link checker results into the search database
+"""
+import time
+
+import pytest
+
+import ezidapp.models
+import ezidapp.models.search_identifier
+import linkcheck_update
+
+SAMPLE_SIZE = 20
+
+
+@pytest.fixture()
+def linkcheck_update_config(monkeypatch, search_db_rollback):
+    monkeypatch.setattr(linkcheck_update, '_notificationThreshold', 3)
+
+
+def _link_checker(identifier, num_failures=0):
+    lc = ezidapp.models.LinkChecker(
+        identifier=identifier,
+        owner_id=1,
+        target='http://example.org/',
+        numFailures=num_failures,
+    )
+    lc.save()
+    return lc
+
+
+def _search_identifier_list():
+    """Return a sample of identifiers with and without metadata."""
+    qs = ezidapp.models.SearchIdentifier.objects.filter(linkIsBroken=False)
+    si_list = list(qs.filter(hasMetadata=True)[: SAMPLE_SIZE // 2]) + list(
+        qs.filter(hasMetadata=False)[: SAMPLE_SIZE // 2]
+    )
+    assert si_list
+    return si_list
+
+
+def _assert_has_issues_computed(identifier_list):
+    for si in ezidapp.models.SearchIdentifier.objects.filter(
+        identifier__in=identifier_list
+    ):
+        has_issues = si.hasIssues
+        si.computeHasIssues()
+        assert si.hasIssues == has_issues
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestLinkcheckUpdate:
+    def test_1000(self, linkcheck_update_config):
+        """Saving a link checker row sets its update time, including when only
+        some fields are saved."""
+        start = int(time.time())
+        lc = _link_checker('ark:/99999/fk4lcu1000')
+        assert lc.updateTime >= start
+        ezidapp.models.LinkChecker.objects.filter(id=lc.id).update(updateTime=0)
+        lc.numFailures = 1
+        lc.save(update_fields=['numFailures'])
+        assert ezidapp.models.LinkChecker.objects.get(id=lc.id).updateTime >= start
+
+    def test_1010(self, linkcheck_update_config, monkeypatch):
+        """An incremental run considers only the rows saved since the last run."""
+        old_lc = _link_checker('ark:/99999/fk4lcu1010a', 5)
+        ezidapp.models.LinkChecker.objects.filter(id=old_lc.id).update(updateTime=100)
+        since = int(time.time())
+        _link_checker('ark:/99999/fk4lcu1010b', 5)
+        _link_checker('ark:/99999/fk4lcu1010c', 1)
+        change_list = []
+        monkeypatch.setattr(
+            linkcheck_update,
+            '_applyChanges',
+            lambda broken, unbroken: change_list.append((broken, unbroken)),
+        )
+        linkcheck_update._updateIncrementally(since, lambda: True)
+        assert change_list == [(['ark:/99999/fk4lcu1010b'], ['ark:/99999/fk4lcu1010c'])]
+
+    def test_1020(self, linkcheck_update_config):
+        """Setting and clearing broken links in bulk leaves hasIssues as
+        SearchIdentifier.computeHasIssues computes it."""
+        identifier_list = [si.identifier for si in _search_identifier_list()]
+        assert linkcheck_update._applyChanges(identifier_list, []) == len(
+            identifier_list
+        )
+        assert all(
+            ezidapp.models.SearchIdentifier.objects.filter(
+                identifier__in=identifier_list
+            ).values_list('linkIsBroken', flat=True)
+        )
+        _assert_has_issues_computed(identifier_list)
+        assert linkcheck_update._applyChanges([], identifier_list) == len(
+            identifier_list
+        )
+        assert not any(
+            ezidapp.models.SearchIdentifier.objects.filter(
+                identifier__in=identifier_list
+            ).values_list('linkIsBroken', flat=True)
+        )
+        _assert_has_issues_computed(identifier_list)
+
+    def test_1030(self, linkcheck_update_config):
+        """Updating an identifier from the update queue keeps its broken link."""
+        store_list = list(
+            ezidapp.models.StoreIdentifier.objects.filter(
+                identifier__in=[si.identifier for si in _search_identifier_list()]
+            )[:2]
+        )
+        assert len(store_list) == 2
+        identifier_list = [s.identifier for s in store_list]
+        linkcheck_update._applyChanges(identifier_list, [])
+        ezidapp.models.search_identifier.updateFromLegacy(
+            store_list[0].identifier, store_list[0].toLegacy()
+        )
+        ezidapp.models.search_identifier.updateFromLegacyBatch(
+            [(store_list[1].identifier, store_list[1].toLegacy())]
+        )
+        for si in ezidapp.models.SearchIdentifier.objects.filter(
+            identifier__in=identifier_list
+        ):
+            assert si.linkIsBroken
+            assert si.hasIssues
@@ -0,0 +1,118 @@
+"""Test reuse of parsed XML between metadata mapping and keyword extraction, and
+benchmark it on large DataCite 4 records
+"""
+import logging
+import time
+
+import mapping
+import util
+
+RECORD_COUNT = 50
+CREATOR_COUNT = 200
+SUBJECT_COUNT = 200
+
+log = logging.getLogger(__name__)
+
+
+def _datacite_record(i):
+    return (
+        u'<?xml version="1.0"?>\n'
+        u'<resource xmlns="http://datacite.org/schema/kernel-4" '
+        u'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        u'xsi:schemaLocation="http://datacite.org/schema/kernel-4 '
+        u'http://schema.datacite.org/meta/kernel-4/metadata.xsd">\n'
+        u'  <identifier identifierType="DOI">10.5072/FK2{0}</identifier>\n'
+        u'  <creators>\n{1}  </creators>\n'
+        u'  <titles>\n    <title>Large record {0}</title>\n  </titles>\n'
+        u'  <publisher>University of California</publisher>\n'
+        u'  <publicationYear>2020</publicationYear>\n'
+        u'  <resourceType resourceTypeGeneral="Dataset">Survey</resourceType>\n'
+        u'  <subjects>\n{2}  </subjects>\n'
+        u'  <descriptions>\n'
+        u'    <description descriptionType="Abstract">{3}</description>\n'
+        u'  </descriptions>\n'
+        u'</resource>'
+    ).format(
+        i,
+        u''.join(
+            u'    <creator>\n'
+            u'      <creatorName>Creator{0}, Given{0}</creatorName>\n'
+            u'      <affiliation>Affiliation {0}</affiliation>\n'
+            u'    </creator>\n'.format(j)
+            for j in range(CREATOR_COUNT)
+        ),
+        u''.join(
+            u'    <subject subjectScheme="keywords">subject {}</subject>\n'.format(j)
+            for j in range(SUBJECT_COUNT)
+        ),
+        u'Abstract text. ' * 200,
+    )
+
+
+def _kernel_tuple(km):
+    return km.creator, km.title, km.publisher, km.date, km.type, km.validatedType
+
+
+def _index_separately(cm):
+    """The computation of kernel metadata and keywords before parsed XML was
+    reused."""
+    km = mapping.map(cm, profile='datacite')
+    return _kernel_tuple(km), util.extractXmlContent(cm['datacite'])
+
+
+def _index_shared(cm):
+    parsed_xml = {}
+    km = mapping.map(cm, profile='datacite', parsedXml=parsed_xml)
+    return _kernel_tuple(km), util.extractXmlContent(parsed_xml['datacite'])
+
+
+# noinspection PyClassHasNoInit
+class TestMapping:
+    def test_1000(self):
+        """Mapping and keyword extraction give the same results whether or not the
+        parsed XML is shared."""
+        cm = {'datacite': _datacite_record(0)}
+        assert _index_shared(cm) == _index_separately(cm)
+
+    def test_1010(self):
+        """Crossref records map the same from a string and from a parsed tree."""
+        cm = {
+            'crossref': (
+                u'<?xml version="1.0"?>\n'
+                u'<journal xmlns="http://www.crossref.org/schema/4.3.4">'
+                u'<journal_metadata><full_title>Journal</full_title>'
+                u'</journal_metadata><journal_article publication_type="full_text">'
+                u'<titles><title>Article</title></titles>'
+                u'<contributors><person_name sequence="first" '
+                u'contributor_role="author"><given_name>A</given_name>'
+                u'<surname>Author</surname></person_name></contributors>'
+                u'<publication_date><year>2019</year></publication_date>'
+                u'<doi_data><doi>10.5072/FK2X</doi><resource>http://x.org/</resource>'
+                u'</doi_data></journal_article></journal>'
+            )
+        }
+        parsed_xml = {}
+        assert _kernel_tuple(
+            mapping.map(cm, profile='crossref', parsedXml=parsed_xml)
+        ) == _kernel_tuple(mapping.map(cm, profile='crossref'))
+        assert 'crossref' in parsed_xml
+
+    def test_1020(self):
+        """Benchmark: Kernel metadata and keywords for large DataCite 4 records, with
+        and without sharing the parsed XML."""
+        cm_list = [{'datacite': _datacite_record(i)} for i in range(RECORD_COUNT)]
+
+        def run(index_fn):
+            start = time.time()
+            for cm in cm_list:
+                index_fn(cm)
+            return time.time() - start
+
+        separate_sec = run(_index_separately)
+        shared_sec = run(_index_shared)
+        log.info(
+            'Index computation, {} records: separate={:.4f}s shared={:.4f}s'.format(
+                RECORD_COUNT, separate_sec, shared_sec
+            )
+        )
+        assert shared_sec < separate_sec
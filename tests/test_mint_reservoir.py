@@ -0,0 +1,147 @@
+"""Test the per-shoulder reservoirs of identifiers minted ahead of time
+"""
+import threading
+
+import pytest
+
+import ezid
+import ezidapp.models
+import mint_reservoir
+
+PREFIX = 'ark:/99999/fk4'
+
+
+class _Shoulder(object):
+    id = 0
+    isUuid = False
+    minter = 'https://n2t.net/a/ezid/m/ark/99999/fk4'
+
+
+@pytest.fixture()
+def reservoir(monkeypatch):
+    """Enable reservoirs, with watermarks of 2 and 5, empty reservoirs and no
+    active shoulders, and without starting the daemon thread."""
+    monkeypatch.setattr(mint_reservoir, '_enabled', True)
+    monkeypatch.setattr(mint_reservoir, '_defaultWatermarks', (2, 5))
+    monkeypatch.setattr(mint_reservoir, '_watermarks', {})
+    monkeypatch.setattr(mint_reservoir, '_activePrefixes', set())
+    monkeypatch.setattr(mint_reservoir, '_refillEvent', threading.Event())
+    ezidapp.models.MintReservoir.objects.all().delete()
+
+
+@pytest.fixture()
+def minted_list(reservoir, monkeypatch):
+    """Stand in for the minter of a shoulder having prefix PREFIX, and record the
+    identifiers minted."""
+    minted_list = []
+
+    def mint_on_shoulder(shoulder_model, count=1):
+        new_list = ['m{:04d}'.format(len(minted_list) + i) for i in range(count)]
+        minted_list.extend(new_list)
+        return new_list
+
+    monkeypatch.setattr(
+        ezidapp.models,
+        'getExactShoulderMatch',
+        lambda prefix: _Shoulder() if prefix == PREFIX else None,
+    )
+    monkeypatch.setattr(ezid, 'mintOnShoulder', mint_on_shoulder)
+    return minted_list
+
+
+def _fill(prefix, minted_id_list):
+    ezidapp.models.MintReservoir.objects.bulk_create(
+        [
+            ezidapp.models.MintReservoir(prefix=prefix, mintedId=m)
+            for m in minted_id_list
+        ]
+    )
+    mint_reservoir._load()
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestMintReservoir:
+    def test_1000(self, reservoir, monkeypatch):
+        """Per-shoulder watermarks override the defaults."""
+        assert mint_reservoir._parseWatermarks('') == {}
+        watermarks = mint_reservoir._parseWatermarks(
+            'ark:/99999/fk4=500,5000  doi:10.5072/FK2=1,2'
+        )
+        assert watermarks == {
+            'ark:/99999/fk4': (500, 5000),
+            'doi:10.5072/FK2': (1, 2),
+        }
+        monkeypatch.setattr(mint_reservoir, '_watermarks', watermarks)
+        assert mint_reservoir._getWatermarks('doi:10.5072/FK2') == (1, 2)
+        assert mint_reservoir._getWatermarks('ark:/99999/fk5') == (2, 5)
+
+    def test_1010(self, minted_list, monkeypatch):
+        """Identifiers claimed by another process are skipped, including one
+        claimed after it was read, and a reservoir at its low watermark is flagged
+        for refill."""
+        _fill(PREFIX, ['a1', 'a2', 'a3', 'a4', 'a5'])
+        ezidapp.models.MintReservoir.objects.filter(mintedId='a1').delete()
+        filter_ = ezidapp.models.MintReservoir.objects.filter
+        a2_seq = filter_(mintedId='a2').get().seq
+
+        def filter_claimed_by_other(**kwargs):
+            if kwargs == {'seq': a2_seq}:
+                filter_(seq=a2_seq).delete()
+            return filter_(**kwargs)
+
+        monkeypatch.setattr(
+            ezidapp.models.MintReservoir.objects, 'filter', filter_claimed_by_other
+        )
+        assert mint_reservoir.take(PREFIX) == 'a3'
+        assert not mint_reservoir._refillEvent.is_set()
+        assert mint_reservoir.take(PREFIX) == 'a4'
+        assert mint_reservoir._refillEvent.is_set()
+        assert mint_reservoir.take(PREFIX) == 'a5'
+        assert mint_reservoir.take(PREFIX) is None
+        assert mint_reservoir.getDepths() == {PREFIX: 0}
+        assert minted_list == []
+
+    def test_1020(self, minted_list):
+        """A reservoir is refilled up to its high watermark, in minting order."""
+        _fill(PREFIX, ['a1'])
+        mint_reservoir._refill(PREFIX)
+        assert minted_list == ['m0000', 'm0001', 'm0002', 'm0003']
+        assert mint_reservoir.getDepths() == {PREFIX: 5}
+        mint_reservoir._refill(PREFIX)
+        assert len(minted_list) == 4
+        assert [mint_reservoir.take(PREFIX) for _ in range(6)] == [
+            'a1',
+            'm0000',
+            'm0001',
+            'm0002',
+            'm0003',
+            None,
+        ]
+        mint_reservoir._refill('ark:/99999/fk5')
+        assert 'ark:/99999/fk5' not in mint_reservoir.getDepths()
+
+    def test_1025(self, minted_list):
+        """Identifiers added to a reservoir by another process are handed out, and
+        count towards the depth up to which the reservoir is refilled."""
+        assert mint_reservoir.take(PREFIX) is None
+        ezidapp.models.MintReservoir.objects.bulk_create(
+            [ezidapp.models.MintReservoir(prefix=PREFIX, mintedId='o1')]
+        )
+        mint_reservoir._refill(PREFIX)
+        assert len(minted_list) == 4
+        assert mint_reservoir.getDepths() == {PREFIX: 5}
+        assert mint_reservoir.take(PREFIX) == 'o1'
+
+    def test_1030(self, reservoir, admin_admin, minters, monkeypatch):
+        """ezid.mintIdentifier takes identifiers from the shoulder's reservoir
+        without minting inline."""
+        prefix = str(minters[0][0])
+        _fill(prefix, ['r0001'])
+
+        def mint_on_shoulder(shoulder_model, count=1):
+            assert False, 'minted inline'
+
+        monkeypatch.setattr(ezid, 'mintOnShoulder', mint_on_shoulder)
+        user = ezidapp.models.getUserByUsername('admin')
+        assert ezid.mintIdentifier(prefix, user) == 'success: {}r0001'.format(prefix)
+        assert not ezidapp.models.MintReservoir.objects.exists()
@@ -0,0 +1,96 @@
+import shutil
+
+import backports.lzma as lzma
+
+import nog.minter
+import nog.minter_engine
+import nog.minter_service
+import tests.test_nog_minter
+
+MINT_COUNT = 1000
+
+PERL_MINTED_PATH = tests.test_nog_minter.PERL_MINTED_PATH
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestNogMinterEngine:
+    def _copy_bdb(self, test_docs, tmp_path, bdb_name='77913_r7.bdb'):
+        bdb_path = tmp_path / 'nog.bdb'
+        shutil.copy(test_docs.joinpath(bdb_name).as_posix(), bdb_path.as_posix())
+        return bdb_path
+
+    def test_1000(self, test_docs, tmp_path):
+        """Resident minter yields identifiers matching N2T, both when minting one ID at
+        a time and in batches, across checkpoints.
+        """
+        bdb_path = self._copy_bdb(test_docs, tmp_path)
+        engine = nog.minter_engine.MinterEngine(checkpoint_interval=100)
+        minted_list = []
+        for _ in range(MINT_COUNT // 2):
+            minted_list.extend(engine.mint_by_bdb_path(bdb_path))
+        minted_list.extend(engine.mint_by_bdb_path(bdb_path, MINT_COUNT // 2))
+        engine.close_all()
+        with lzma.open(PERL_MINTED_PATH) as f:
+            for i, python_sping in enumerate(minted_list):
+                perl_sping = f.readline().strip()
+                assert perl_sping == python_sping, 'Mismatch at {}'.format(i)
+
+    def test_1010(self, test_docs, tmp_path):
+        """Resident minter continues the sequence through a template extension, and the
+        checkpointed BerkeleyDB matches one updated by the regular minter.
+        """
+        name_str = '77913_r7_last_before_template_extend.bdb'
+        bdb_path = self._copy_bdb(test_docs, tmp_path, name_str)
+        expected_list = list(
+            nog.minter.mint_by_bdb_path(test_docs.joinpath(name_str), 10, dry_run=True)
+        )
+        engine = nog.minter_engine.MinterEngine()
+        assert engine.mint_by_bdb_path(bdb_path, 10) == expected_list
+        engine.close_all()
+        assert list(nog.minter.mint_by_bdb_path(bdb_path, 10, dry_run=True)) == list(
+            nog.minter.mint_by_bdb_path(test_docs.joinpath(name_str), 20, dry_run=True)
+        )[10:]
+
+    def test_1020(self, test_docs, tmp_path):
+        """Identifiers minted before an interruption are not minted again after the
+        journal is replayed.
+        """
+        bdb_path = self._copy_bdb(test_docs, tmp_path)
+        resident_minter = nog.minter_engine.ResidentMinter(
+            bdb_path, checkpoint_interval=10 ** 6, checkpoint_max_age=10 ** 6
+        )
+        resident_minter.open()
+        before_list = resident_minter.mint(25)
+        # Simulate a crash by dropping the minter without a checkpoint.
+        resident_minter._minter.close()
+        resident_minter._close_journal()
+
+        resident_minter = nog.minter_engine.ResidentMinter(bdb_path)
+        resident_minter.open()
+        after_list = resident_minter.mint(25)
+        resident_minter.close()
+
+        with lzma.open(PERL_MINTED_PATH) as f:
+            perl_list = [f.readline().strip() for _ in range(50)]
+        assert before_list + after_list == perl_list
+
+    def test_1030(self, test_docs, tmp_path):
+        """A minter left with a journal is detected, and minting under the file lock
+        replays the journal before continuing the sequence.
+        """
+        bdb_path = self._copy_bdb(test_docs, tmp_path)
+        assert not nog.minter_engine.journal_exists(bdb_path)
+        resident_minter = nog.minter_engine.ResidentMinter(
+            bdb_path, checkpoint_interval=10 ** 6, checkpoint_max_age=10 ** 6
+        )
+        resident_minter.open()
+        before_list = resident_minter.mint(25)
+        resident_minter._minter.close()
+        resident_minter._close_journal()
+        assert nog.minter_engine.journal_exists(bdb_path)
+
+        after_list = nog.minter_service.mint_with_file_lock(bdb_path, 25)
+
+        with lzma.open(PERL_MINTED_PATH) as f:
+            perl_list = [f.readline().strip() for _ in range(50)]
+        assert before_list + after_list == perl_list
@@ -0,0 +1,106 @@
+import shutil
+import stat
+import threading
+import time
+
+import backports.lzma as lzma
+import pytest
+
+import nog.exc
+import nog.minter_service
+import tests.test_nog_minter
+
+PERL_MINTED_PATH = tests.test_nog_minter.PERL_MINTED_PATH
+
+CLIENT_COUNT = 20
+MINTS_PER_CLIENT = 5
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestNogMinterService:
+    def _copy_bdb(self, test_docs, tmp_path):
+        bdb_path = tmp_path / 'minters' / 'nog.bdb'
+        bdb_path.parent.mkdir()
+        shutil.copy(
+            test_docs.joinpath('77913_r7.bdb').as_posix(), bdb_path.as_posix()
+        )
+        return bdb_path
+
+    def _start_service(self, tmp_path):
+        service = nog.minter_service.MinterService(
+            tmp_path / 'minter.sock', tmp_path / 'minters'
+        )
+        thread = threading.Thread(target=service.serve_forever)
+        thread.start()
+        for _ in range(100):
+            if (tmp_path / 'minter.sock').exists():
+                break
+            time.sleep(0.01)
+        return service, thread
+
+    def _perl_list(self, count):
+        with lzma.open(PERL_MINTED_PATH) as f:
+            return [f.readline().strip() for _ in range(count)]
+
+    def test_1000(self, test_docs, tmp_path):
+        """Concurrent clients receive distinct identifiers that together form the
+        sequence minted by N2T.
+        """
+        bdb_path = self._copy_bdb(test_docs, tmp_path)
+        service, thread = self._start_service(tmp_path)
+        minted_list = []
+
+        def client():
+            for _ in range(MINTS_PER_CLIENT):
+                minted_list.extend(
+                    nog.minter_service.mint_by_bdb_path(
+                        tmp_path / 'minter.sock', bdb_path, 2
+                    )
+                )
+
+        try:
+            client_list = [threading.Thread(target=client) for _ in range(CLIENT_COUNT)]
+            for t in client_list:
+                t.start()
+            for t in client_list:
+                t.join()
+        finally:
+            service.shutdown()
+            thread.join()
+        assert sorted(minted_list) == sorted(
+            self._perl_list(CLIENT_COUNT * MINTS_PER_CLIENT * 2)
+        )
+
+    def test_1010(self, test_docs, tmp_path):
+        """The file locked fallback continues the sequence minted by the service, and
+        refuses to mint while the service holds the minter open.
+        """
+        bdb_path = self._copy_bdb(test_docs, tmp_path)
+        socket_path = tmp_path / 'minter.sock'
+        with pytest.raises(nog.minter_service.MinterServiceUnavailable):
+            nog.minter_service.mint_by_bdb_path(socket_path, bdb_path)
+        service, thread = self._start_service(tmp_path)
+        try:
+            minted_list = nog.minter_service.mint_by_bdb_path(socket_path, bdb_path, 10)
+            with pytest.raises(nog.exc.MinterError):
+                nog.minter_service.mint_with_file_lock(bdb_path)
+        finally:
+            service.shutdown()
+            thread.join()
+        minted_list += nog.minter_service.mint_with_file_lock(bdb_path, 10)
+        assert minted_list == self._perl_list(20)
+
+    def test_1020(self, tmp_path):
+        """Only the service user and its group may connect to the socket."""
+        service, thread = self._start_service(tmp_path)
+        try:
+            # A response shows that the service is serving, so the mode has been set.
+            with pytest.raises(nog.exc.MinterError):
+                nog.minter_service.mint_by_bdb_path(
+                    tmp_path / 'minter.sock', tmp_path / 'nog.bdb'
+                )
+            mode = (tmp_path / 'minter.sock').stat().st_mode
+        finally:
+            service.shutdown()
+            thread.join()
+        assert stat.S_IMODE(mode) == 0o660
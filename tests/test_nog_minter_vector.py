@@ -0,0 +1,77 @@
+"""Test the vectorized minter against the scalar minter and N2T
+"""
+import logging
+import timeit
+
+import backports.lzma as lzma
+
+import nog.minter
+import nog.minter_vector
+import tests.test_nog_minter
+
+PERL_MINT_COUNT = 1000000
+BENCHMARK_MINT_COUNT = 100000
+
+PERL_MINTED_PATH = tests.test_nog_minter.PERL_MINTED_PATH
+
+log = logging.getLogger(__name__)
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestNogMinterVector:
+    def test_1000(self, test_docs):
+        """Vectorized minter yields the full sequence of identifiers minted by N2T,
+        through template extensions.
+        """
+        with nog.minter.Minter(test_docs.joinpath('77913_r7.bdb'), dry_run=True) as m:
+            minted_list = nog.minter_vector.mint_list(m, PERL_MINT_COUNT)
+        with lzma.open(PERL_MINTED_PATH) as f:
+            for i, python_sping in enumerate(minted_list):
+                perl_sping = f.readline().strip()
+                assert perl_sping == python_sping, 'Mismatch at {}'.format(i)
+
+    def test_1010(self, test_docs):
+        """Vectorized minter leaves the minter in the same state as the scalar
+        minter, when minting and when skipping across a template extension.
+        """
+        bdb_path = test_docs.joinpath('77913_r7_last_before_template_extend.bdb')
+        with nog.minter.Minter(bdb_path, dry_run=True) as scalar_minter:
+            expected_list = list(scalar_minter.mint(5000))
+            expected_dict = scalar_minter.as_dict()
+        with nog.minter.Minter(bdb_path, dry_run=True) as vector_minter:
+            assert nog.minter_vector.mint_list(vector_minter, 5000) == expected_list
+            assert vector_minter.as_dict() == expected_dict
+        with nog.minter.Minter(bdb_path, dry_run=True) as vector_minter:
+            nog.minter_vector.skip(vector_minter, 4990)
+            assert list(vector_minter.mint(10)) == expected_list[-10:]
+            assert vector_minter.as_dict() == expected_dict
+
+    def test_1020(self, test_docs):
+        """Micro-benchmark: Vectorized vs. scalar minting of {BENCHMARK_MINT_COUNT}
+        identifiers. The timings are logged, and only the output is checked."""
+        assert nog.minter_vector.is_available()
+        bdb_path = test_docs.joinpath('77913_r7.bdb')
+        result_dict = {}
+
+        def run_scalar():
+            with nog.minter.Minter(bdb_path, dry_run=True) as m:
+                result_dict['scalar'] = list(m.mint(BENCHMARK_MINT_COUNT))
+
+        def run_vector():
+            with nog.minter.Minter(bdb_path, dry_run=True) as m:
+                result_dict['vector'] = nog.minter_vector.mint_list(
+                    m, BENCHMARK_MINT_COUNT
+                )
+
+        scalar_sec = min(timeit.repeat(run_scalar, number=1, repeat=3))
+        vector_sec = min(timeit.repeat(run_vector, number=1, repeat=3))
+        log.info(
+            'Minting {} identifiers: scalar={:.4f}s vector={:.4f}s '
+            'speedup={:.0f}x'.format(
+                BENCHMARK_MINT_COUNT,
+                scalar_sec,
+                vector_sec,
+                scalar_sec / max(vector_sec, 1e-9),
+            )
+        )
+        assert result_dict['vector'] == result_dict['scalar']
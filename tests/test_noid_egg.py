@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+import binder_async
+import noid_egg
+import tests.util.egg_server
+import tests.util.http_stand_in
+
+IDENTIFIER_COUNT = 100
+
+
+@pytest.fixture()
+def egg_server(monkeypatch):
+    with tests.util.egg_server.EggServer() as server:
+        tests.util.http_stand_in.patch_module(
+            monkeypatch,
+            noid_egg,
+            _server=server.url,
+            _authorization='Basic ZXppZDo=',
+            _numAttempts=1,
+            _reattemptDelay=0,
+            _maxRequestSize=1000000,
+        )
+        noid_egg._closeIdleConnections()
+        yield server
+        noid_egg._closeIdleConnections()
+
+
+def _batch(count=IDENTIFIER_COUNT):
+    return [
+        (
+            'ark:/99999/fk4{}'.format(i),
+            {
+                '_t': 'https://example.org/{}'.format(i),
+                'erc.who': u'Jan\xe9e {}'.format(i),
+            },
+        )
+        for i in range(count)
+    ]
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestNoidEgg:
+    def test_1000(self, egg_server):
+        """Batches are set and fetched over a single keep-alive connection."""
+        batch = _batch()
+        noid_egg.batchSetElements(batch)
+        assert noid_egg.batchGetElements([i for i, _ in batch]) == [d for _, d in batch]
+        assert noid_egg.getElements('ark:/99999/fk4x') is None
+        assert noid_egg.identifierExists(batch[0][0])
+        noid_egg.deleteIdentifier(batch[0][0])
+        assert not noid_egg.identifierExists(batch[0][0])
+        assert egg_server.connection_count == 1
+
+    def test_1010(self, egg_server, monkeypatch):
+        """Large batches are split into requests within the maximum request size."""
+        monkeypatch.setattr(noid_egg, '_maxRequestSize', 1000)
+        batch = _batch()
+        noid_egg.batchSetElements(batch)
+        assert egg_server.request_count > 1
+        assert egg_server.max_body_size <= 1000
+        assert noid_egg.batchGetElements([i for i, _ in batch]) == [d for _, d in batch]
+        noid_egg.batchDeleteIdentifier([i for i, _ in batch])
+        assert noid_egg.batchGetElements([i for i, _ in batch]) == [None] * len(batch)
+        assert egg_server.max_body_size <= 1000
+
+    def test_1020(self, egg_server):
+        """A batch update sets and removes only the elements that changed, in one
+        fetch and one update request."""
+        batch = _batch()
+        noid_egg.batchSetElements(batch)
+        new_batch = [(i, {'_t': d['_t'], 'erc.what': 'x'}) for i, d in batch]
+        request_count = egg_server.request_count
+        binder_async._batchUpdate(_StateHolder(), [], new_batch)
+        assert egg_server.request_count == request_count + 2
+        assert noid_egg.batchGetElements([i for i, _ in batch]) == [
+            d for _, d in new_batch
+        ]
+
+
+class _StateHolder(object):
+    """Minimal register_async state holder for calling registrar functions directly."""
+
+    def __init__(self):
+        self.enabledFlagHolder = [True]
+        self.threadNameHolder = [threading.currentThread().getName()]
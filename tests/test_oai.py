@@ -0,0 +1,107 @@
+"""Test OAI-PMH harvesting with keyset resumption tokens and pre-rendered records
+"""
+import hashlib
+import re
+
+import django.conf
+import lxml.etree
+import pytest
+
+import ezidapp.models
+import oai
+
+BATCH_SIZE = 7
+OAI_NS = '{http://www.openarchives.org/OAI/2.0/}'
+
+
+@pytest.fixture()
+def oai_config(monkeypatch):
+    monkeypatch.setattr(oai, '_baseUrl', 'https://ezid.example.org')
+    monkeypatch.setattr(oai, '_recordCacheEnabled', False)
+    monkeypatch.setattr(oai, '_listSizeCacheLifetime', 3600)
+    oai._listSizeCache.clear()
+
+
+def _harvest(verb, prefix):
+    """Harvest all pages and return the list of response bodies."""
+    response_list = []
+    oai_request = (verb, {'metadataPrefix': prefix})
+    while True:
+        response = oai._doHarvest(oai_request, BATCH_SIZE, verb == 'ListRecords')
+        response_list.append(response)
+        token = lxml.etree.XML(response).find('.//' + OAI_NS + 'resumptionToken')
+        if token is None or not token.text:
+            return response_list
+        oai_request = (verb, {'resumptionToken': token.text})
+
+
+def _strip_response_date(response):
+    return re.sub('<responseDate>[^<]*</responseDate>', '', response)
+
+
+def _harvested_identifiers(response_list):
+    return [
+        e.text
+        for response in response_list
+        for e in lxml.etree.XML(response).iterfind(
+            './/{0}header/{0}identifier'.format(OAI_NS)
+        )
+    ]
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestOai:
+    def test_1000(self):
+        """Resumption tokens round trip, and tokens issued before keyset positions
+        remain valid."""
+        token = oai._buildResumptionToken(1000, 42, None, 'oai_dc', 100, 500)
+        assert oai._unpackResumptionToken(token) == (1000, 42, None, 'oai_dc', 100, 500)
+        legacy_token = '1000,,oai_dc,100,500'
+        legacy_token += ',' + hashlib.sha1(
+            legacy_token + ',' + django.conf.settings.SECRET_KEY
+        ).hexdigest()[::4]
+        assert oai._unpackResumptionToken(legacy_token) == (
+            1000,
+            None,
+            None,
+            'oai_dc',
+            100,
+            500,
+        )
+        assert oai._unpackResumptionToken(token.replace(',42,', ',43,')) is None
+
+    def test_1010(self, oai_config):
+        """A paged harvest returns every OAI-visible identifier exactly once, in
+        update time order."""
+        identifier_list = list(
+            ezidapp.models.SearchIdentifier.objects.filter(oaiVisible=True)
+            .order_by('updateTime', 'id')
+            .values_list('identifier', flat=True)
+        )
+        assert len(identifier_list) > BATCH_SIZE
+        response_list = _harvest('ListIdentifiers', 'oai_dc')
+        assert _harvested_identifiers(response_list) == identifier_list
+        assert len(response_list) == (len(identifier_list) - 1) // BATCH_SIZE + 1
+
+    @pytest.mark.parametrize('prefix', ['oai_dc', 'datacite'])
+    def test_1020(self, oai_config, monkeypatch, prefix):
+        """Harvests served from pre-rendered records are identical to harvests
+        rendered on the fly."""
+        rendered_list = _harvest('ListRecords', prefix)
+
+        def get_cached_records(identifier_list):
+            return {
+                i.identifier: {
+                    p: oai._renderRecord(
+                        ezidapp.models.SearchIdentifier.objects.get(id=i.id), p
+                    )
+                    for p in oai._metadataPrefixes
+                }
+                for i in identifier_list
+            }
+
+        monkeypatch.setattr(oai, '_getCachedRecords', get_cached_records)
+        cached_list = _harvest('ListRecords', prefix)
+        assert [_strip_response_date(r) for r in cached_list] == [
+            _strip_response_date(r) for r in rendered_list
+        ]
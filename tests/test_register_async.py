@@ -0,0 +1,163 @@
+"""Test the scheduling of asynchronous registrations: row cache refill, worker
+scaling and per-key rate limiting
+"""
+import threading
+
+import pytest
+
+import datacite_async
+import ezidapp.models
+import register_async
+import util
+
+CREATE = ezidapp.models.RegistrationQueue.CREATE
+
+
+class _Row(object):
+    def __init__(self, seq, identifier, rate_limit_key=None):
+        self.seq = seq
+        self.identifier = identifier
+        self.operation = CREATE
+        self.rateLimitKey = rate_limit_key
+
+
+def _state_holder(**kwargs):
+    return register_async._StateHolder(
+        'test',
+        ezidapp.models.DataciteQueue,
+        None,
+        None,
+        None,
+        None,
+        None,
+        None,
+        5,
+        300,
+        [True],
+        [threading.currentThread().getName()],
+        **kwargs
+    )
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestRegisterAsync:
+    def test_1000(self):
+        """A token bucket allows a burst, then operations at the configured rate."""
+        bucket = register_async._TokenBucket(2, 3)
+        now = bucket.time
+        assert [bucket.take(now) for _ in range(4)] == [True, True, True, False]
+        assert bucket.delay(now) == pytest.approx(0.5)
+        assert bucket.take(now + 0.5)
+        assert not bucket.take(now + 0.5)
+        assert bucket.take(now + 10)
+
+    def test_1010(self):
+        """Rows for a key that has reached its rate limit are passed over in favor
+        of rows for other keys."""
+        sh = _state_holder(rateLimitKeyFunction=lambda i, m: None, rateLimit=1)
+        sh.loadedRows = [_Row(i, 'doi:10.5072/A{}'.format(i), 'A') for i in range(5)]
+        sh.loadedRows.append(_Row(5, 'doi:10.5072/B5', 'B'))
+        sh.loadedRows.append(_Row(6, 'doi:10.5072/C6'))
+        selected_list = []
+        while True:
+            rows, delay = register_async._nextUnprocessedLoadedRows(sh)
+            if not rows:
+                break
+            selected_list.append(rows[0].seq)
+        assert selected_list == [0, 5, 6]
+        assert 0 < delay <= 1
+        assert sh.numBusyWorkers == 3
+        register_async._deleteLoadedRows(sh, [sh.loadedRows[0]])
+        assert sh.numBusyWorkers == 2
+        assert [r.seq for r in sh.loadedRows] == [1, 2, 3, 4, 5, 6]
+
+    def test_1020(self):
+        """The row cache is topped up in queue order, without disturbing rows being
+        processed, and with at most one row per identifier."""
+        sh = _state_holder()
+        for i in range(4):
+            register_async.enqueueIdentifier(
+                ezidapp.models.DataciteQueue,
+                'doi:10.5072/FK2R{}'.format(i % 3),
+                'update',
+                'blob',
+            )
+        assert register_async._loadRows(sh) == 3
+        rows, _ = register_async._nextUnprocessedLoadedRows(sh)
+        rows[0].delete()
+        register_async._deleteLoadedRows(sh, rows)
+        assert register_async._loadRows(sh) == 3
+        assert [r.identifier for r in sh.loadedRows] == [
+            'doi:10.5072/FK2R1',
+            'doi:10.5072/FK2R2',
+            'doi:10.5072/FK2R0',
+        ]
+        assert not hasattr(sh.loadedRows[0], 'beingProcessed')
+
+    def test_1030(self, monkeypatch):
+        """Workers are started with the amount of work loaded, within bounds, and
+        idle workers retire down to the minimum."""
+        started_list = []
+        monkeypatch.setattr(
+            register_async, '_startWorker', lambda sh, i: started_list.append(i)
+        )
+        sh = _state_holder(minWorkerThreads=1, maxWorkerThreads=4)
+        register_async._adjustWorkers(sh)
+        assert started_list == [0]
+        sh.loadedRows = [_Row(i, 'doi:10.5072/A{}'.format(i)) for i in range(10)]
+        register_async._adjustWorkers(sh)
+        assert started_list == [0, 1, 2, 3]
+        assert [register_async._retireWorker(sh) for _ in range(4)] == [
+            True,
+            True,
+            True,
+            False,
+        ]
+        assert sh.numWorkers == 1
+
+    def test_1040(self):
+        """Rows whose rate limit key cannot be computed are loaded without a key,
+        leaving the error to the worker that processes them."""
+        sh = _state_holder(
+            rateLimitKeyFunction=datacite_async._rateLimitKey, rateLimit=1
+        )
+        for i, blob in enumerate(
+            [
+                util.blobify({'_d': 'CDL.CDL'}),
+                'not a blob',
+                util.blobify({'datacite': 'no datacenter'}),
+            ]
+        ):
+            register_async.enqueueIdentifier(
+                ezidapp.models.DataciteQueue,
+                'doi:10.5072/FK2K{}'.format(i),
+                'update',
+                blob,
+            )
+        assert register_async._loadRows(sh) == 3
+        assert [r.rateLimitKey for r in sh.loadedRows] == ['CDL', None, None]
+
+    def test_1050(self, monkeypatch):
+        """A burst of rows for one rate limit key does not keep rows for other keys
+        queued behind it out of the cache."""
+        monkeypatch.setattr(register_async, '_perKeyRowLimit', 3)
+        sh = _state_holder(
+            rateLimitKeyFunction=datacite_async._rateLimitKey, rateLimit=1
+        )
+        for i, allocator in enumerate(['A'] * 8 + ['B'] * 2):
+            register_async.enqueueIdentifier(
+                ezidapp.models.DataciteQueue,
+                'doi:10.5072/FK2B{}'.format(i),
+                'create',
+                util.blobify({'_d': allocator + '.X'}),
+            )
+        assert register_async._loadRows(sh) == 5
+        assert [r.rateLimitKey for r in sh.loadedRows] == ['A'] * 3 + ['B'] * 2
+        rows, _ = register_async._nextUnprocessedLoadedRows(sh)
+        assert rows[0].rateLimitKey == 'A'
+        rows[0].delete()
+        register_async._deleteLoadedRows(sh, rows)
+        assert register_async._loadRows(sh) == 5
+        assert [r.identifier for r in sh.loadedRows] == [
+            'doi:10.5072/FK2B{}'.format(i) for i in [1, 2, 3, 8, 9]
+        ]
@@ -0,0 +1,93 @@
+"""Test the caching and estimation of search result counts
+"""
+import pytest
+
+import ezidapp.models
+import ezidapp.models.update_queue
+import search_util
+
+RESULT_COUNT = 25
+ESTIMATE_THRESHOLD = 10
+
+
+class _QuerySet(object):
+    """Stand-in for the search queryset that records the counts it performs."""
+
+    def __init__(self, count_list, limit=None):
+        self.count_list = count_list
+        self.limit = limit
+
+    def __getitem__(self, s):
+        return _QuerySet(self.count_list, s.stop)
+
+    def count(self):
+        self.count_list.append(self.limit)
+        return min(RESULT_COUNT, self.limit or RESULT_COUNT)
+
+
+class _Group(object):
+    groupname = 'testgroup'
+    pid = 'ark:/99999/fk4group'
+
+
+class _User(object):
+    username = 'testuser'
+    pid = 'ark:/99999/fk4user'
+    group = _Group()
+
+
+@pytest.fixture()
+def count_list(monkeypatch):
+    count_list = []
+    monkeypatch.setattr(search_util, '_countCacheSize', 10)
+    monkeypatch.setattr(search_util, '_countCacheTtl', 300)
+    monkeypatch.setattr(search_util, '_countEstimateThreshold', ESTIMATE_THRESHOLD)
+    monkeypatch.setattr(
+        search_util, 'formulateQuery', lambda *args, **kwargs: _QuerySet(count_list)
+    )
+    search_util._countCache.clear()
+    yield count_list
+    search_util._countCache.clear()
+
+
+def _count(approximate=False, constraints=None):
+    return search_util.executeSearchCountOnly(
+        _User(), constraints or {'owner': 'testuser'}, approximate=approximate
+    )
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestSearchCount:
+    def test_1000(self, count_list):
+        """Counts are cached by user and normalized constraints."""
+        assert _count() == RESULT_COUNT
+        assert _count(constraints={'owner': ' testuser '}) == RESULT_COUNT
+        assert count_list == [None]
+        _count(constraints={'owner': 'otheruser'})
+        assert count_list == [None, None]
+
+    def test_1010(self, count_list):
+        """Cached counts are invalidated by updates to the search database, made in
+        this process or signaled by the update queue."""
+        _count()
+        search_util.noteSearchDatabaseUpdate()
+        _count()
+        assert count_list == [None, None]
+        si = ezidapp.models.StoreIdentifier.objects.all()[0]
+        ezidapp.models.update_queue.enqueue(si, 'update')
+        _count()
+        assert count_list == [None, None, None]
+        _count()
+        assert count_list == [None, None, None]
+
+    def test_1020(self, count_list):
+        """Approximate counts stop at the estimate threshold. Estimates are not used
+        for exact counts, but exact counts are used for approximate ones."""
+        c = _count(approximate=True)
+        assert c == ESTIMATE_THRESHOLD + 1
+        assert search_util.isEstimate(c)
+        assert _count(approximate=True) == c
+        assert count_list == [ESTIMATE_THRESHOLD + 1]
+        assert _count() == RESULT_COUNT
+        assert _count(approximate=True) == RESULT_COUNT
+        assert count_list == [ESTIMATE_THRESHOLD + 1, None]
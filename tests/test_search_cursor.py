@@ -0,0 +1,132 @@
+"""Test keyset pagination of search results by cursor
+"""
+import django.db.models
+import pytest
+
+import ezidapp.models
+import search_util
+
+PAGE_SIZE = 4
+SAMPLE_SIZE = 14
+
+
+class _Group(object):
+    groupname = 'testgroup'
+    pid = 'ark:/99999/fk4group'
+
+
+class _User(object):
+    username = 'testuser'
+    pid = 'ark:/99999/fk4user'
+    group = _Group()
+
+
+@pytest.fixture()
+def constraints(search_db_rollback):
+    """Set the create times of a sample of one owner's identifiers so that they
+    have many ties, and return constraints that select the sample."""
+    owner = (
+        ezidapp.models.SearchIdentifier.objects.values('owner__username')
+        .annotate(n=django.db.models.Count('id'))
+        .filter(n__gte=SAMPLE_SIZE)
+        .order_by('-n')[0]['owner__username']
+    )
+    id_list = ezidapp.models.SearchIdentifier.objects.filter(
+        owner__username=owner
+    ).values_list('id', flat=True)[:SAMPLE_SIZE]
+    for i, si_id in enumerate(id_list):
+        ezidapp.models.SearchIdentifier.objects.filter(id=si_id).update(
+            createTime=1000 + i % 3
+        )
+    return {'owner': owner, 'createTime': (1000, 1002)}
+
+
+def _search(constraints, order_by, from_=0, to=SAMPLE_SIZE, cursor=None):
+    return [
+        si.identifier
+        for si in search_util.executeSearch(
+            _User(), constraints, from_, to, order_by, cursor=cursor
+        )
+    ]
+
+
+def _page_by_cursor(constraints, order_by):
+    """Page forward through the results by cursor, then back again, and return
+    the pages in each direction."""
+    forward_list = []
+    cursor = None
+    while True:
+        page = search_util.executeSearch(
+            _User(), constraints, 0, PAGE_SIZE, order_by, cursor=cursor
+        )
+        if not page:
+            break
+        forward_list.append([si.identifier for si in page])
+        last, first = page[-1], page[0]
+        cursor = search_util.makeCursor(last, order_by, True, len(forward_list))
+    backward_list = []
+    cursor = search_util.makeCursor(first, order_by, False)
+    while True:
+        page = search_util.executeSearch(
+            _User(), constraints, 0, PAGE_SIZE, order_by, cursor=cursor
+        )
+        if not page:
+            break
+        backward_list.insert(0, [si.identifier for si in page])
+        cursor = search_util.makeCursor(page[0], order_by, False)
+    return forward_list, backward_list
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestSearchCursor:
+    def test_1000(self, constraints):
+        """Paging by cursor through a column with ties, in either direction and
+        either order, visits the same results as paging by offset."""
+        for order_by in 'createTime', '-createTime':
+            expected_list = _search(constraints, order_by)
+            assert len(expected_list) == SAMPLE_SIZE
+            forward_list, backward_list = _page_by_cursor(constraints, order_by)
+            assert [len(p) for p in forward_list] == [4, 4, 4, 2]
+            assert sum(forward_list, []) == expected_list
+            # Paging back from the last page yields the pages before it.
+            assert sum(backward_list, []) == expected_list[: -len(forward_list[-1])]
+
+    def test_1010(self, constraints):
+        """A tampered cursor, or one made for another ordering, is rejected, and
+        the results are selected by offset."""
+        si = ezidapp.models.SearchIdentifier.objects.get(
+            identifier=_search(constraints, 'createTime')[5]
+        )
+        data = [3, PAGE_SIZE, SAMPLE_SIZE]
+        cursor = search_util.makeCursor(si, 'createTime', True, data)
+        assert search_util.getCursorData(cursor, 'createTime') == data
+        assert _search(constraints, 'createTime', 0, PAGE_SIZE, cursor) == _search(
+            constraints, 'createTime', 6, 6 + PAGE_SIZE
+        )
+        tampered = cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B')
+        assert search_util.getCursorData(tampered, 'createTime') is None
+        assert search_util.getCursorData(cursor, '-createTime') is None
+        for c, order_by in (tampered, 'createTime'), (cursor, '-createTime'):
+            assert _search(constraints, order_by, 8, 8 + PAGE_SIZE, c) == _search(
+                constraints, order_by
+            )[8 : 8 + PAGE_SIZE]
+
+    def test_1020(self, constraints, monkeypatch):
+        """Orderings not covered by cursors page by offset, ignoring any cursor."""
+        assert search_util.supportsCursor('-resourceTitle')
+        for order_by in None, 'owner', 'profile', 'resourcePublicationYear':
+            assert not search_util.supportsCursor(order_by)
+        si = ezidapp.models.SearchIdentifier.objects.get(
+            identifier=_search(constraints, 'createTime')[0]
+        )
+        cursor = search_util.makeCursor(si, 'createTime')
+
+        def apply_cursor(*args):
+            assert False, 'cursor applied'
+
+        monkeypatch.setattr(search_util, '_applyCursor', apply_cursor)
+        page_list = [
+            _search(constraints, 'owner', i, i + PAGE_SIZE, cursor)
+            for i in range(0, SAMPLE_SIZE, PAGE_SIZE)
+        ]
+        assert [len(p) for p in page_list] == [4, 4, 4, 2]
@@ -0,0 +1,138 @@
+"""Test longest-match shoulder lookups against a linear scan, logging the timings of
+both, and test the minter path cache
+"""
+import logging
+import random
+import timeit
+
+import ezidapp.models.shoulder
+
+SHOULDER_COUNT = 5000
+LOOKUP_COUNT = 1000
+
+log = logging.getLogger(__name__)
+
+
+def _linear_longest_match(prefix_list, identifier):
+    """The lookup that was used before the trie was introduced."""
+    lm = None
+    for prefix in prefix_list:
+        if identifier.startswith(prefix):
+            if lm is None or len(prefix) > len(lm):
+                lm = prefix
+    return lm
+
+
+def _random_prefix_list(rnd):
+    prefix_set = set()
+    while len(prefix_set) < SHOULDER_COUNT:
+        if rnd.random() < 0.5:
+            prefix = 'ark:/{}/{}'.format(
+                rnd.randint(10000, 10100), _random_str(rnd, 'bcdfghjk2345', 1, 4)
+            )
+        else:
+            prefix = 'doi:10.{}/{}'.format(
+                rnd.randint(5000, 5100), _random_str(rnd, 'BCDFGHJK2345', 0, 4)
+            )
+        prefix_set.add(prefix)
+    return sorted(prefix_set)
+
+
+def _random_str(rnd, alphabet, min_len, max_len):
+    return ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(min_len, max_len)))
+
+
+def _random_identifier_list(rnd, prefix_list):
+    return [
+        rnd.choice(prefix_list) + _random_str(rnd, 'bcdfghjk2345BCDFGHJK', 0, 10)
+        for _ in range(LOOKUP_COUNT)
+    ]
+
+
+# noinspection PyClassHasNoInit
+class TestShoulderMatch:
+    def test_1000(self):
+        """PrefixTrie returns the same longest match as a linear scan."""
+        rnd = random.Random(1)
+        prefix_list = _random_prefix_list(rnd)
+        trie = ezidapp.models.shoulder.PrefixTrie((p, p) for p in prefix_list)
+        for identifier in _random_identifier_list(rnd, prefix_list) + [
+            'ark:/99999/unknown',
+            'doi:10',
+            '',
+        ]:
+            assert trie.longestMatch(identifier) == _linear_longest_match(
+                prefix_list, identifier
+            )
+
+    def test_1010(self):
+        """PrefixTrie with no matching prefix returns None."""
+        trie = ezidapp.models.shoulder.PrefixTrie([('ark:/99999/fk4', 1)])
+        assert trie.longestMatch('ark:/99999/fk') is None
+        assert trie.longestMatch('ark:/99999/fk4') == 1
+
+    def test_1020(self, monkeypatch):
+        """getLongestMatch returns the same shoulders as a linear scan over
+        {SHOULDER_COUNT} shoulders. The timings of both are logged."""
+        rnd = random.Random(2)
+        prefix_list = _random_prefix_list(rnd)
+        identifier_list = _random_identifier_list(rnd, prefix_list)
+        monkeypatch.setattr(
+            ezidapp.models.shoulder,
+            '_shoulderTrie',
+            ezidapp.models.shoulder.PrefixTrie((p, p) for p in prefix_list),
+        )
+        result_dict = {}
+
+        def run_linear():
+            result_dict['linear'] = [
+                _linear_longest_match(prefix_list, identifier)
+                for identifier in identifier_list
+            ]
+
+        def run_trie():
+            result_dict['trie'] = [
+                ezidapp.models.shoulder.getLongestMatch(identifier)
+                for identifier in identifier_list
+            ]
+
+        linear_sec = min(timeit.repeat(run_linear, number=1, repeat=3))
+        trie_sec = min(timeit.repeat(run_trie, number=1, repeat=3))
+        log.info(
+            'Longest match, {} lookups over {} shoulders: '
+            'linear={:.4f}s trie={:.4f}s speedup={:.0f}x'.format(
+                LOOKUP_COUNT,
+                SHOULDER_COUNT,
+                linear_sec,
+                trie_sec,
+                linear_sec / max(trie_sec, 1e-9),
+            )
+        )
+        assert result_dict['trie'] == result_dict['linear']
+
+
+class _FakeShoulder(object):
+    def __init__(self, prefix, minter):
+        self.prefix = prefix
+        self.minter = minter
+
+
+# noinspection PyClassHasNoInit
+class TestMinterPathCache:
+    def test_1000(self, tmp_bdb_root):
+        """Minter paths are cached by prefix and recomputed when the minter changes
+        or the cache is cleared."""
+        ezidapp.models.shoulder.clearMinterPathCache()
+        hits, misses = ezidapp.models.shoulder.getMinterPathCacheStatistics()
+        s = _FakeShoulder('ark:/99999/fk4', 'ezid:/99999/fk4')
+        path = ezidapp.models.shoulder.getMinterPath(s)
+        assert path.parts[-3:] == ('99999', 'fk4', 'nog.bdb')
+        assert ezidapp.models.shoulder.getMinterPath(s) == path
+        s.minter = 'ezid:/99999/fk5'
+        assert ezidapp.models.shoulder.getMinterPath(s).parts[-2] == 'fk5'
+        ezidapp.models.shoulder.clearMinterPathCache()
+        ezidapp.models.shoulder.getMinterPath(s)
+        assert ezidapp.models.shoulder.getMinterPathCacheStatistics() == (
+            hits + 1,
+            misses + 3,
+        )
@@ -0,0 +1,105 @@
+"""Test incremental maintenance of identifier statistics
+"""
+import threading
+import time
+
+import pytest
+
+import backproc
+import ezidapp.models
+import ezidapp.models.update_queue
+import stats
+
+JANUARY = int(time.mktime((2019, 1, 15, 0, 0, 0, 0, 0, -1)))
+FEBRUARY = int(time.mktime((2019, 2, 15, 0, 0, 0, 0, 0, -1)))
+
+
+@pytest.fixture()
+def user_list():
+    user_list = list(ezidapp.models.SearchUser.objects.all().order_by('id')[:2])
+    assert len(user_list) == 2
+    return user_list
+
+
+def _search_identifier(user, create_time, has_metadata=True):
+    return ezidapp.models.SearchIdentifier(
+        identifier='ark:/13030/fk4stats',
+        owner_id=user.id,
+        createTime=create_time,
+        isTest=False,
+        hasMetadata=has_metadata,
+    )
+
+
+def _apply(old, new):
+    deltas = {}
+    stats.addDelta(
+        deltas,
+        None if old is None else stats.getStatisticsKey(old),
+        None if new is None else stats.getStatisticsKey(new),
+    )
+    stats.applyDeltas(deltas)
+
+
+def _count(user, month):
+    return stats.query(month=month, owner=user.pid, type='ARK', hasMetadata=True)
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestStats:
+    def test_1000(self, user_list):
+        """A create adds the identifier to its statistics class."""
+        u = user_list[0]
+        count = _count(u, '2019-01')
+        _apply(None, _search_identifier(u, JANUARY))
+        assert _count(u, '2019-01') == count + 1
+
+    def test_1010(self, user_list):
+        """An update that changes the owner and creation month moves the
+        identifier between statistics classes, and an update that changes neither
+        changes nothing."""
+        u1, u2 = user_list
+        _apply(None, _search_identifier(u1, JANUARY))
+        counts = _count(u1, '2019-01'), _count(u2, '2019-02')
+        _apply(_search_identifier(u1, JANUARY), _search_identifier(u1, JANUARY + 60))
+        assert (_count(u1, '2019-01'), _count(u2, '2019-02')) == counts
+        _apply(_search_identifier(u1, JANUARY), _search_identifier(u2, FEBRUARY))
+        assert (_count(u1, '2019-01'), _count(u2, '2019-02')) == (
+            counts[0] - 1,
+            counts[1] + 1,
+        )
+
+    def test_1020(self, user_list):
+        """A delete removes the identifier from its statistics class, and classes
+        whose counts drop to zero are removed."""
+        u = user_list[0]
+        ezidapp.models.Statistics.objects.filter(month='1999-01').delete()
+        old_time = int(time.mktime((1999, 1, 15, 0, 0, 0, 0, 0, -1)))
+        _apply(None, _search_identifier(u, old_time))
+        assert _count(u, '1999-01') == 1
+        _apply(_search_identifier(u, old_time), None)
+        assert not ezidapp.models.Statistics.objects.filter(month='1999-01').exists()
+
+    def test_1030(self, monkeypatch):
+        """If statistics changes cannot be applied after the search database has
+        been updated, a reconciliation is requested."""
+        monkeypatch.setattr(stats, '_reconciliationRequested', threading.Event())
+        si = ezidapp.models.StoreIdentifier.objects.filter(owner__isnull=False)[0]
+        ezidapp.models.update_queue.enqueue(si, 'update', updateExternalServices=False)
+        update_model = ezidapp.models.UpdateQueue.objects.filter(
+            identifier=si.identifier
+        ).order_by('-seq')[0]
+
+        def apply_deltas(deltas):
+            raise Exception('applyDeltas failed')
+
+        monkeypatch.setattr(
+            backproc, '_updateSearchDatabase', lambda *args: {('2019-01', 1): 1}
+        )
+        monkeypatch.setattr(stats, 'applyDeltas', apply_deltas)
+        with pytest.raises(Exception):
+            backproc._processUpdate(update_model, lambda: True)
+        assert stats._reconciliationRequested.isSet()
+        assert ezidapp.models.UpdateQueue.objects.filter(
+            identifier=si.identifier
+        ).exists()
@@ -0,0 +1,99 @@
+"""Test the StoreIdentifier blob format of the update queue and benchmark it against
+the legacy Django/JSON-serialized format
+"""
+import logging
+import time
+import zlib
+
+import django.core.serializers
+import django.db
+
+import ezidapp.models
+import ezidapp.models.custom_fields
+
+IDENTIFIER_COUNT = 200
+
+log = logging.getLogger(__name__)
+
+
+def _get_field():
+    return ezidapp.models.UpdateQueue._meta.get_field('object')
+
+
+def _get_si_list():
+    return list(ezidapp.models.StoreIdentifier.objects.all()[:IDENTIFIER_COUNT])
+
+
+def _encode(si):
+    return str(_get_field().get_db_prep_save(si, django.db.connection))
+
+
+def _encode_legacy(si):
+    return zlib.compress(django.core.serializers.serialize("json", [si]))
+
+
+def _decode(blob):
+    return _get_field().from_db_value(blob, None, django.db.connection, None)[0]
+
+
+def _field_dict(si):
+    return {
+        f.attname: f.value_from_object(si)
+        for f in ezidapp.models.StoreIdentifier._meta.concrete_fields
+    }
+
+
+# noinspection PyClassHasNoInit,PyProtectedMember
+class TestUpdateQueue:
+    def test_1000(self):
+        """StoreIdentifiers round trip through the blob format, and legacy blobs
+        remain readable."""
+        si_list = _get_si_list()
+        assert si_list
+        for si in si_list:
+            assert _field_dict(_decode(_encode(si))) == _field_dict(si)
+            assert _field_dict(_decode(_encode_legacy(si))) == _field_dict(si)
+
+    def test_1010(self):
+        """The blob format covers all fields of StoreIdentifier."""
+        cf = ezidapp.models.custom_fields
+        assert set(
+            f.attname for f in ezidapp.models.StoreIdentifier._meta.concrete_fields
+        ) == set(
+            cf._storeIdentifierIntFields
+            + cf._storeIdentifierBoolFields
+            + cf._storeIdentifierStringFields
+            + ['cm']
+        )
+
+    def test_1020(self):
+        """Benchmark: Enqueue (encode) and dequeue (decode) cost, legacy vs. blob
+        format."""
+        si_list = _get_si_list()
+
+        def run(encode_fn):
+            start = time.time()
+            blob_list = [encode_fn(si) for si in si_list]
+            encode_sec = time.time() - start
+            start = time.time()
+            for blob in blob_list:
+                _decode(blob).toLegacy()
+            return encode_sec, time.time() - start, sum(len(b) for b in blob_list)
+
+        legacy_encode_sec, legacy_decode_sec, legacy_bytes = run(_encode_legacy)
+        encode_sec, decode_sec, blob_bytes = run(_encode)
+        log.info(
+            'Update queue, {} identifiers: '
+            'legacy encode={:.4f}s decode={:.4f}s size={} '
+            'blob encode={:.4f}s decode={:.4f}s size={}'.format(
+                len(si_list),
+                legacy_encode_sec,
+                legacy_decode_sec,
+                legacy_bytes,
+                encode_sec,
+                decode_sec,
+                blob_bytes,
+            )
+        )
+        assert encode_sec < legacy_encode_sec
+        assert decode_sec < legacy_decode_sec
@@ -0,0 +1,64 @@
+"""Local stand-in for the "egg" (binder) portion of noid
+
+Implements the subset of the egg protocol used by EZID: requests with a body of ":hx%"
+operation lines (fetch, set, rm, purge), over keep-alive HTTP/1.1 connections. Bindings
+are held in memory, in their encoded form. Connections, requests and request body sizes
+are recorded so that tests can check how the client uses the server.
+"""
+import tests.util.http_stand_in
+
+
+class _Handler(tests.util.http_stand_in.Handler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        line_list = self.stand_in.handle_body(self.read_body())
+        self.respond(200, '\n'.join(line_list) + '\n', 'text/plain')
+
+    do_POST = do_GET
+
+
+class EggServer(tests.util.http_stand_in.HttpStandIn):
+    handler_class = _Handler
+
+    def __init__(self):
+        super(EggServer, self).__init__()
+        self.binding_dict = {}
+        self.request_count = 0
+        self.max_body_size = 0
+
+    @property
+    def url(self):
+        return self.base_url() + '/a/ezid/b'
+
+    def handle_body(self, body_str):
+        """Perform the operations in a request body and return the response lines."""
+        with self._lock:
+            self.request_count += 1
+            self.max_body_size = max(self.max_body_size, len(body_str))
+            line_list = []
+            for op_str in body_str.splitlines():
+                line_list.extend(self._handle_operation(op_str))
+            line_list.extend(['egg-status: 0', ''])
+            return line_list
+
+    def _handle_operation(self, op_str):
+        assert op_str.startswith(':hx% ')
+        arg_list = op_str[5:].split(' ')
+        id_str, op = arg_list[0].rsplit('.', 1)
+        d = self.binding_dict.setdefault(id_str, {})
+        if op == 'fetch':
+            return (
+                ['# id: {}'.format(id_str)]
+                + ['{}: {}'.format(k, v) for k, v in sorted(d.items())]
+                + ['# elements bound under {}: {}'.format(id_str, len(d))]
+            )
+        elif op == 'set':
+            d[arg_list[1]] = arg_list[2]
+        elif op == 'rm':
+            d.pop(arg_list[1], None)
+        elif op == 'purge':
+            d.clear()
+        else:
+            raise AssertionError('Unsupported operation: {}'.format(op))
+        return []
@@ -0,0 +1,91 @@
+"""Base for local stand-ins for the HTTP services that EZID is a client of
+
+A stand-in runs a threaded HTTP server on an ephemeral port on localhost, from
+`start()` to `stop()`, or for the duration of a `with` block. Subclasses set
+`handler_class` to a subclass of `Handler` that implements the protocol, and keep
+their state under `_lock`. Connections are counted, so that tests can check that
+clients reuse them.
+"""
+import BaseHTTPServer
+import SocketServer
+import threading
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Request handler base. `stand_in` is set to the stand-in being served."""
+
+    stand_in = None
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.stand_in._lock:
+            self.stand_in.connection_count += 1
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def respond(self, status, body_str='', content_type=None, header_dict=None):
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header('Content-Type', content_type)
+        for k, v in sorted((header_dict or {}).items()):
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body_str)))
+        self.end_headers()
+        self.wfile.write(body_str)
+
+    def log_message(self, *_):
+        pass
+
+
+class HttpStandIn(object):
+    handler_class = Handler
+    # If False, errors raised while handling requests, such as clients closing
+    # connections early, are not reported.
+    report_errors = True
+
+    def __init__(self):
+        self.connection_count = 0
+        self._lock = threading.Lock()
+
+        class BoundHandler(self.handler_class):
+            stand_in = self
+
+        self._server = _Server(('127.0.0.1', 0), BoundHandler)
+        self._server.report_errors = self.report_errors
+        self._thread = None
+
+    def base_url(self, host='127.0.0.1'):
+        return 'http://{}:{}'.format(host, self._server.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+
+def patch_module(monkeypatch, module, **attr_dict):
+    """Set module level variables of the client under test, such as its
+    configuration, for the duration of a test."""
+    for k, v in sorted(attr_dict.items()):
+        monkeypatch.setattr(module, k, v)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    report_errors = True
+
+    def handle_error(self, request, client_address):
+        if self.report_errors:
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
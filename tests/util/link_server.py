@@ -0,0 +1,65 @@
+"""Local stand-in for the web servers hosting identifier target URLs
+
+Serves resources by path: `/ok/<n>` returns an HTML page of `n` bytes,
+`/status/<code>` returns an empty response with the given status code, and
+`/slow/<n>` returns an HTML page of `n` bytes after a short delay. Each request's
+Host header and time are recorded, along with the maximum number of concurrent
+requests seen per host, so that tests can check the politeness of the link checker.
+"""
+import time
+
+import tests.util.http_stand_in
+
+SLOW_DELAY = 0.05
+
+
+def page(size):
+    """Return the HTML page of `size` bytes served at `/ok/<size>`."""
+    head, tail = '<html><body>', '</body></html>'
+    return head + 'x' * max(size - len(head) - len(tail), 0) + tail
+
+
+class _Handler(tests.util.http_stand_in.Handler):
+    def do_GET(self):
+        host = self.headers.get('Host', '').split(':')[0]
+        self.stand_in.begin_request(host, self.path)
+        kind, arg = self.path.strip('/').split('/')
+        if kind == 'slow':
+            time.sleep(SLOW_DELAY)
+        # The request ends, for concurrency purposes, before the response is sent,
+        # as the client may issue its next request as soon as it has read the
+        # response.
+        self.stand_in.end_request(host)
+        if kind == 'status':
+            self.respond(int(arg))
+        else:
+            self.respond(200, page(int(arg)), 'text/html; charset=UTF-8')
+
+
+class LinkServer(tests.util.http_stand_in.HttpStandIn):
+    handler_class = _Handler
+    # The link checker closes connections once it has read as much of a response
+    # as it wants.
+    report_errors = False
+
+    def __init__(self):
+        super(LinkServer, self).__init__()
+        self.request_list = []
+        self.max_concurrent_dict = {}
+        self._concurrent_dict = {}
+
+    def url(self, path, host='127.0.0.1'):
+        return self.base_url(host) + path
+
+    def begin_request(self, host, path):
+        with self._lock:
+            n = self._concurrent_dict.get(host, 0) + 1
+            self._concurrent_dict[host] = n
+            self.max_concurrent_dict[host] = max(
+                self.max_concurrent_dict.get(host, 0), n
+            )
+            self.request_list.append((host, path, time.time()))
+
+    def end_request(self, host):
+        with self._lock:
+            self._concurrent_dict[host] -= 1
@@ -0,0 +1,85 @@
+"""Local stand-in for the DataCite Metadata Store (MDS) API
+
+Implements the subset of the MDS API used by EZID: registering DOIs and their target
+URLs, fetching target URLs, storing metadata and deactivating DOIs, over keep-alive
+HTTP/1.1 connections. State is held in memory. Connections, requests and Authorization
+headers are recorded, and error statuses can be queued to be returned in place of the
+next responses, so that tests can check how the client uses the server.
+"""
+import re
+import urllib
+
+import tests.util.http_stand_in
+
+
+class _Handler(tests.util.http_stand_in.Handler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        status, response_str = self.stand_in.handle(
+            self.command, self.path, self.headers.get('Authorization'), self.read_body()
+        )
+        self.respond(
+            status,
+            response_str,
+            'text/plain;charset=UTF-8',
+            {'Retry-After': '0'} if status == 429 else None,
+        )
+
+    do_POST = do_GET
+    do_DELETE = do_GET
+
+
+class MdsServer(tests.util.http_stand_in.HttpStandIn):
+    handler_class = _Handler
+
+    def __init__(self):
+        super(MdsServer, self).__init__()
+        self.target_dict = {}
+        self.metadata_dict = {}
+        self.active_set = set()
+        self.authorization_set = set()
+        self.request_count = 0
+        # Statuses to return, in order, in place of the next responses.
+        self.error_list = []
+
+    @property
+    def doi_url(self):
+        return self.base_url() + '/doi'
+
+    @property
+    def metadata_url(self):
+        return self.base_url() + '/metadata'
+
+    def handle(self, method, path, authorization, body_str):
+        """Perform a request and return (status, response body)."""
+        with self._lock:
+            self.request_count += 1
+            self.authorization_set.add(authorization)
+            if self.error_list:
+                return self.error_list.pop(0), 'Service temporarily unavailable'
+            resource, _, doi = path.partition('/')[2].partition('/')
+            doi = urllib.unquote(doi)
+            if (method, resource) == ('POST', 'doi'):
+                d = dict(line.split('=', 1) for line in body_str.splitlines())
+                if not d['url'].startswith('http'):
+                    return 400, '[url] malformed URL'
+                self.target_dict[d['doi']] = d['url']
+                return 201, 'OK'
+            elif (method, resource) == ('GET', 'doi'):
+                if doi not in self.target_dict:
+                    return 404, 'DOI not found'
+                return 200, self.target_dict[doi]
+            elif (method, resource) == ('POST', 'metadata'):
+                m = re.search(r'<identifier identifierType="DOI">([^<]*)<', body_str)
+                if not m:
+                    return 400, 'DOI missing'
+                self.metadata_dict[m.group(1)] = body_str
+                self.active_set.add(m.group(1))
+                return 201, 'OK ({})'.format(m.group(1))
+            elif (method, resource) == ('DELETE', 'metadata'):
+                if doi not in self.metadata_dict:
+                    return 404, 'DOI not found'
+                self.active_set.discard(doi)
+                return 200, 'OK'
+            raise AssertionError('Unsupported request: {} {}'.format(method, path))
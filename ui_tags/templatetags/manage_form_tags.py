@@ -225,7 +225,15 @@ def datetime_disp(x, href):
 
 
 @register.simple_tag
-def pager_display(request, current_page, total_pages, page_size, select_position):
+def pager_display(
+    request,
+    current_page,
+    total_pages,
+    page_size,
+    select_position,
+    prev_cursor='',
+    next_cursor='',
+):
     if total_pages < 2:
         return ''
     p_out = ''
@@ -251,6 +259,7 @@ def pager_display(request, current_page, total_pages, page_size, select_position
                 page_size,
                 'pagination__prev',
                 _("Previous page of results"),
+                prev_cursor,
             )
             + ' '
         )
@@ -277,6 +286,7 @@ def pager_display(request, current_page, total_pages, page_size, select_position
                 page_size,
                 'pagination__next',
                 _("Next page of results"),
+                next_cursor,
             )
             + ' '
         )
@@ -294,11 +304,15 @@ def pager_display(request, current_page, total_pages, page_size, select_position
     return p_out
 
 
-def page_link(request, this_page, link_text, page_size, cname, title=None):
+def page_link(
+    request, this_page, link_text, page_size, cname, title=None, cursor=''
+):
     attr_aria = " aria-label='" + title + "'" if title else ""
     return (
         "<button data-page='"
         + str(this_page)
+        + "' data-cursor='"
+        + escape(cursor)
         + "' class='"
         + cname
         + "'"